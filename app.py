@@ -1,47 +1,87 @@
 # Libraries to be imported
+# LangGraph, LangChain and the API clients are imported on first use, so importing this module
+# stays cheap and needs no secrets (OCR lives in ocr.py, the clients in clients.py)
 import os
 import json
 import subprocess
 import re
-from langgraph.graph import StateGraph, END
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
+from itertools import islice
+from collections import deque
 from typing import TypedDict, List
-import cv2
-import pytesseract
-from elevenlabs.client import ElevenLabs
-from elevenlabs.play import play
-from elevenlabs import save
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_core.prompts import ChatPromptTemplate, PromptTemplate
-from pydantic import BaseModel, Field
-from typing import Dict, Any, Union
-from langchain.output_parsers import PydanticOutputParser
-import streamlit as st
-
-
-#Setup elevenlabs
-client = ElevenLabs(
-  api_key=st.secrets['eleven_labs'],
-)
-
-#setup Gemini llm
-#Setup the API key
-os.environ["GOOGLE_API_KEY"] = st.secrets['google_gemini']
-
-#Setup the LLM
-llm = ChatGoogleGenerativeAI(model="gemini-2.5-flash", temperature=0)
+from pydantic import BaseModel, Field, ValidationError
+from typing import Dict, Any, Union, Optional
+from clients import LLM_MODEL, get_llm, get_tts_client
+from clip_cache import ClipCache, clip_key
+from voice_casting import get_casting_index
+from voice_catalog import VoiceCatalog
+from audio_concat import concat_mp3
+from llm_cache import LLMResponseCache
+from incremental_json import IncrementalArrayParser
+from llm_json import parse_array, validate_item, loads_object
+from dialogue_rules import segment_dialogue
+from character_registry import CharacterRegistry
+from tts_plan import plan_tts_requests
+from metrics import traced_node, record, record_llm_usage, submit_traced
+from scheduler import schedulers
+from workspace import create_job_workspace
+
+
+#Cache of the LLM responses (get_llm_cache), bump the version of a prompt when its template changes
+PROMPT_VERSIONS = {
+    "character_identifier": 3,
+    "dialogue_splitter": 1,
+    "character_dialogue_identifier": 3,
+    "character_dialogue_identifier_batch": 2,
+    "voice_selector": 1,
+}
+
+#Concurrency settings for the voice generator
+TTS_MAX_WORKERS = int(os.environ.get("AUDIFY_TTS_MAX_WORKERS", 3)) # max TTS requests in flight
+TTS_MAX_SEGMENTS = 5 # free tier ElevenLabs subscription, only the first few segments are generated
+TTS_MODEL_ID = "eleven_multilingual_v2"
+TTS_STREAMING = os.environ.get("AUDIFY_TTS_STREAMING", "1") == "1" # use the ElevenLabs streaming endpoint (the clip is still read whole)
+
+#Stream the dialogue splitter output straight into the voice generator
+STREAM_DIALOGUE_TO_TTS = os.environ.get("AUDIFY_STREAM_DIALOGUE", "1") == "1"
+
+#Rule based dialogue splitter, the LLM is only called when the rules are less confident than this
+DIALOGUE_RULES_MIN_CONFIDENCE = float(os.environ.get("AUDIFY_DIALOGUE_RULES_MIN_CONFIDENCE", 0.8))
+
+#Checkpoints of the workflow, used to resume failed jobs
+CHECKPOINT_DB_PATH = os.environ.get("AUDIFY_CHECKPOINT_DB", os.path.join(".audify_cache", "checkpoints.db"))
+
+#Audio combiner settings
+AUDIO_SILENCE_MS = int(os.environ.get("AUDIFY_SILENCE_MS", 0)) # silence between two segments
+AUDIO_NORMALIZE = os.environ.get("AUDIFY_NORMALIZE_LOUDNESS", "0") == "1" # needs pydub
+
+#Combined mode: a single LLM call returns the corrected text, the new characters and the dialogue
+COMBINED_LLM_MODE = os.environ.get("AUDIFY_COMBINED_LLM", "0") == "1"
+
+#Batch mode of book mode: the pages sent to the LLM in a single request, 1 disables it
+LLM_BATCH_PAGES = int(os.environ.get("AUDIFY_LLM_BATCH_PAGES", 1))
+PAGE_DELIMITER = "===== PAGE {} ====="
 
 
 # Research state of the graph
 # The shared "notepad" for our agents
 class ResearchState(TypedDict):
+    job_id : str
+    job_dir : str
     default_charachter : str
     ocr_text: str
+    ocr_details : dict
     voice_list : List[dict]
     new_charachter_identified : str
     charachter_list: dict
     corrected_text : str
     page_number : List[int]
     dialogue: str
+    audio_segments : List[bytes]
+    tts_plan : List[dict]
+    metrics : dict
     speakerXid : dict
     output_path : str
     final_audio_path : str
@@ -50,7 +90,7 @@ class ResearchState(TypedDict):
 # Get all the voices from elenlabs
 def get_voices():
     print("Getting All the Voices")
-    voice_list = client.voices.search()
+    voice_list = schedulers["elevenlabs"].call(get_tts_client().voices.search)
     voice_list = voice_list.voices
 
     voice_data_to_keep = ['voice_id', 'name', 'labels', 'description']
@@ -63,36 +103,81 @@ def get_voices():
     return voice_dict
 
 
-# function to preprocess the image and get the OCR text
-def image_ocr(image):
-    '''
-    This function applies a series of preprocessing steps to an image to improve OCR accuracy. 
-    And then runs the pytesseract OCR on the preprocessed image.
+# Voice catalog, persisted and refreshed in the background (cached for performance)
+@lru_cache(maxsize=None)
+def get_voice_catalog():
+    return VoiceCatalog(get_voices)
 
-    Args:
-        image: The image uploaded by the user
 
-    Returns:
-        text: OCR text from pytesseract
+# Cache of the LLM responses, opened on first use so importing the app does not create it
+@lru_cache(maxsize=None)
+def get_llm_cache():
+    return LLMResponseCache()
+
+
+# Cache of the synthesized clips, consulted before calling ElevenLabs, created on first use
+@lru_cache(maxsize=None)
+def get_clip_cache():
+    return ClipCache()
+
+
+# The OCR functions moved to ocr.py, they can still be imported from here without loading OpenCV up front
+OCR_NAMES = ("image_ocr", "image_ocr_batch", "preprocess_for_ocr", "deskew_image", "estimate_text_height")
+
+def __getattr__(name):
+    if name in OCR_NAMES:
+        import ocr
+        return getattr(ocr, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# Invoke an LLM chain through the response cache
+def prompt_characters(inputs):
     '''
-    print('Running image OCR using PyTesseract')
-    # 1. Convert to grayscale
-    image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    Returns the characters of the prompt inputs, counted against the Gemini quota.
+    '''
+    return sum(len(str(value)) for value in inputs.values())
 
-    # 2. Resize the image 
-    image = cv2.resize(image, None, fx=2, fy=2, interpolation=cv2.INTER_CUBIC)
 
-    # 3. Denoising
-    image = cv2.medianBlur(image, 3)
+def invoke_llm_cached(node, chain, inputs, parse=None, refresh=False):
+    '''
+    Returns the LLM response for the rendered inputs of a node. Identical calls (same prompt
+    version, model and inputs) are answered from the persistent cache, which is safe since the LLM
+    runs with temperature=0. With a parse function, a response is only cached once it parses, and
+    a cached response that does not parse is dropped and asked again, so a retried job never gets
+    the same malformed response back.
 
-    # 4. Run OCR
-    custom_config = r'--oem 3 --psm 6'  # OCR Engine Mode 3, Page Segmentation Mode 6
-    text = pytesseract.image_to_string(image, config=custom_config)
+    Args:
+        node: Name of the node, used with its prompt version in the cache key
+        chain: The prompt | llm chain
+        inputs: The prompt inputs
+        parse: Optional function parsing the response content, its errors are raised
+        refresh: Ask the LLM even if the response is cached, e.g. to re-ask after a bad response
 
-    #Remove the \n tages from the text
-    text = text.replace('\n', ' ')
+    Returns:
+        The response content, or its parsed value with a parse function
+    '''
+    llm_cache = get_llm_cache()
+    key = llm_cache.key(node, PROMPT_VERSIONS[node], LLM_MODEL, inputs)
+    content = None if refresh else llm_cache.get(key, node)
+    if content is not None:
+        try:
+            parsed = parse(content) if parse else content
+        except Exception as e:
+            print(f"Dropping the cached response of {node}, it does not parse ({e})")
+            llm_cache.delete(key)
+        else:
+            print(f"LLM cache hit for {node}")
+            record("llm_cache_hits")
+            return parsed
+
+    response = schedulers["gemini"].call(chain.invoke, inputs, characters=prompt_characters(inputs))
+    record_llm_usage(response)
+    content = response.content
+    parsed = parse(content) if parse else content
+    llm_cache.put(key, node, content)
+    return parsed
 
-    return text
 
 #Function to get the voice id for given charchter
 def get_voice_id_by_name(name_to_find, voices_list):
@@ -101,11 +186,14 @@ def get_voice_id_by_name(name_to_find, voices_list):
 
     Args:
         name_to_find (str): The name of the voice you are looking for.
-        voices_list (list): The list of voice dictionaries to search through.
+        voices_list (list or VoiceCatalog): The voices to search through. A VoiceCatalog is looked up by its name index.
 
     Returns:
         str: The voice_id if the name is found, otherwise None.
     """
+    if isinstance(voices_list, VoiceCatalog):
+        return voices_list.get_voice_id(name_to_find)
+
     for voice in voices_list:
         if voice['name'] == name_to_find:
             return voice['voice_id']
@@ -114,30 +202,33 @@ def get_voice_id_by_name(name_to_find, voices_list):
 
 # Agent 1: Character identifier and text corrector Agent
 
-def character_identifier(state: ResearchState):
-    '''
+# Output of the character identifier
+class OcrOutput(BaseModel):
+    corrected_text: str = Field(..., description="The corrected text from LLM")
+    characters: Dict[str, Dict[str, Any]] = Field(
+        ..., description="Dictionary of characters where key is character name and value is a dictionary of properties"
+    )
+    new_charachter_identifed: str = Field(..., description="Binary response in Yes or No")
 
+
+def character_identifier_chain(llm):
     '''
-    print("Running Charachter Identification")
-    # 1. create the output parser for the llm
-    class OcrOutput(BaseModel):
-        corrected_text: str = Field(..., description="The corrected text from LLM")
-        characters: Dict[str, Dict[str, Any]] = Field(
-            ..., description="Dictionary of characters where key is character name and value is a dictionary of properties"
-        )
-        new_charachter_identifed: str = Field(..., description="Binary response in Yes or No")
-
-    # 2. Create parser
+    Returns the prompt | llm chain of the character identifier and its output parser.
+    '''
+    from langchain_core.prompts import PromptTemplate
+    from langchain.output_parsers import PydanticOutputParser
+
+    # 1. Create parser
     ocr_parser = PydanticOutputParser(pydantic_object=OcrOutput)
 
-    # 3. Define the system prompt
+    # 2. Define the system prompt
 
     prompt_character_identify = PromptTemplate(
         template=(
             """ You are an expert book page reviewer. Your instructions are as below:
             
         1. Read through the text and correct the spelling where required and return the corrected text.
-        2. Identify if a new character is introduced in the text with reference to the list of characters already available in context. here is the list of existing charachters {charachter_list}. If there is a new charachter other than the ones in the charachter_list, respond with Yes in the new_charachter_identifed field.
+        2. Identify if a new character is introduced in the text with reference to the known characters of the charachter_list below. If there is a new charachter other than the ones in the charachter_list, respond with Yes in the new_charachter_identifed field. A known character called by another name (e.g. a nickname or a title) is not a new character, use its name from the charachter_list, or add an alias_of property with that name. Characters only sharing a surname (e.g. Jane Bennet and Elizabeth Bennet) are different characters.
         3. For the new characters, identify their properties like Gender, Age, or any physical characteristics. 
 
         Return ONLY valid JSON (no extra text, no markdown, no commentary).
@@ -154,28 +245,35 @@ def character_identifier(state: ResearchState):
         partial_variables={"format_instructions": ocr_parser.get_format_instructions()},
     )
 
-    # 4. Create the chain
-    chain_character_identify = prompt_character_identify | llm | ocr_parser
+    # 3. Create the chain
+    return prompt_character_identify | llm, ocr_parser
 
-    # 5. invoke the llm
-    response = chain_character_identify.invoke({"text": state['ocr_text'],
-                        'charachter_list':state['charachter_list']})
 
-    # 6. uodate the character list
-    # Get the dictionary of existing characters from the input state
-    updated_character_list = state['charachter_list']
-    
-    # Merge the new characters found by the LLM into the existing dictionary
-    if response.characters:
-        updated_character_list.update(response.characters)
+def character_identifier(state: ResearchState, chains=None):
+    '''
+    Corrects the OCR text and identifies the characters of the page.
+    '''
+    print("Running Charachter Identification")
+    chains = chains or get_chains()
+
+    # 1. invoke the llm, only the known characters mentioned on the page are sent
+    registry = CharacterRegistry(state['charachter_list'])
+    response = invoke_llm_cached("character_identifier", chains.character_identifier,
+                                 {"text": state['ocr_text'], 'charachter_list': registry.digest(state['ocr_text'])},
+                                 parse=chains.ocr_parser.parse)
+
+    # 2. uodate the character list
+    # Name variants of known characters become aliases, only the others are new
+    new_charachters = registry.merge(response.characters, state['ocr_text'])
+    new_charachter_identified = "Yes" if new_charachters else "No"
 
-    print(f"New Charachters were identified: {response.new_charachter_identifed}")
+    print(f"New Charachters were identified: {new_charachter_identified}")
 
-    # 7. Return 
+    # 3. Return 
     return {
         "corrected_text": response.corrected_text,
-        "charachter_list": updated_character_list,
-        "new_charachter_identified": response.new_charachter_identifed
+        "charachter_list": registry.to_dict(),
+        "new_charachter_identified": new_charachter_identified
     }
 
 
@@ -199,16 +297,41 @@ def new_charachter_route(state: ResearchState):
         return "dialogue_splitter"  
 
 
+# Rules for splitting a page into narration and dialogue, shared by the dialogue prompts
+DIALOGUE_RULES = """    **Rules for Identification:**
+    1.  **Narrator:** Any text that is not inside quotation marks is narration. The speaker for this text must always be designated as `"Narrator"`.
+    2.  **Dialogue:** Any text enclosed in quotation marks (`“... ”` or `"... "`) is dialogue.
+    3.  **Speaker Identification (CRITICAL):**
+        * Your primary goal is to identify the **specific character name** for all dialogue.
+        * If a dialogue is followed by an attribution tag with a name (e.g., `... ,” Max said.`), use that name.
+        * **If a dialogue is attributed to a pronoun (e.g., `... ,” he said.`), you MUST scan the preceding text to resolve this pronoun to the most recently mentioned and relevant character. Your reasoning should connect the pronoun to a named character.**
+        * **Only if the character's name cannot be reasonably determined from the current or preceding context should you use the label `"Unknown Speaker"`. Do NOT use pronouns like "He" or "She" as the speaker's name.**
+    4.  **Segmentation:**
+        * A new segment begins whenever the speaker changes. For example, a sentence like `“Hello,” he said, “how are you?”` must be broken into THREE segments: Dialogue -> Narration -> Dialogue.
+        * Preserve the original order of the text exactly as it appears.
+    5.  **Text Formatting:**
+        * The text in the `"text"` field should be the exact segment from the source.
+        * You MUST NOT include the surrounding quotation marks for dialogue segments.
+"""
+
+
 # Agent 2: Dialogue Splitter
 
-def dialogue_splitter(state: ResearchState):
-    '''
+# A segment of the dialogue, segments the LLM returns without a speaker get UNKNOWN_SPEAKER
+class DialogueSegment(BaseModel):
+    speaker: str = Field(..., description="Name of the speaker, Narrator for narration")
+    text: str = Field(..., description="The raw text of the segment without the quotation marks")
 
+
+UNKNOWN_SPEAKER = {"speaker": "Unknown Speaker"}
+
+def dialogue_splitter_chain(llm):
     '''
+    Returns the prompt | llm chain of the dialogue splitter.
+    '''
+    from langchain_core.prompts import PromptTemplate
 
     # 1. Define the prompt for dialogue splitter
-    print("Running Dialogue Splitter")
-
     prompt_for_dialogue = PromptTemplate(
         template=(
             """ You are an expert literary text parser. Your primary function is to deconstruct a given passage of text into its fundamental components: narration and dialogue. You must follow these instructions precisely.
@@ -222,21 +345,7 @@ def dialogue_splitter(state: ResearchState):
     1.  `"speaker"`: (String) The name of the speaker.
     2.  `"text"`: (String) The raw text of the segment.
 
-    **Rules for Identification:**
-    1.  **Narrator:** Any text that is not inside quotation marks is narration. The speaker for this text must always be designated as `"Narrator"`.
-    2.  **Dialogue:** Any text enclosed in quotation marks (`“... ”` or `"... "`) is dialogue.
-    3.  **Speaker Identification (CRITICAL):**
-        * Your primary goal is to identify the **specific character name** for all dialogue.
-        * If a dialogue is followed by an attribution tag with a name (e.g., `... ,” Max said.`), use that name.
-        * **If a dialogue is attributed to a pronoun (e.g., `... ,” he said.`), you MUST scan the preceding text to resolve this pronoun to the most recently mentioned and relevant character. Your reasoning should connect the pronoun to a named character.**
-        * **Only if the character's name cannot be reasonably determined from the current or preceding context should you use the label `"Unknown Speaker"`. Do NOT use pronouns like "He" or "She" as the speaker's name.**
-    4.  **Segmentation:**
-        * A new segment begins whenever the speaker changes. For example, a sentence like `“Hello,” he said, “how are you?”` must be broken into THREE segments: Dialogue -> Narration -> Dialogue.
-        * Preserve the original order of the text exactly as it appears.
-    5.  **Text Formatting:**
-        * The text in the `"text"` field should be the exact segment from the source.
-        * You MUST NOT include the surrounding quotation marks for dialogue segments.
-
+""" + DIALOGUE_RULES + """
     **CRITICAL INSTRUCTION: Your response must be ONLY the raw JSON array. Do not include any introductory text, explanations, \\n tags or markdown formatting like ```json. Your entire output must start with `[` and end with `]`.**
 
     **Example:**
@@ -277,23 +386,465 @@ def dialogue_splitter(state: ResearchState):
     )
 
     # 2. Create the chain
-    chain_for_dialogue = prompt_for_dialogue | llm
+    return prompt_for_dialogue | llm
+
+
+def dialogue_splitter(state: ResearchState, chains=None):
+    '''
+    Splits the corrected text into narration and dialogue segments.
+    '''
+    print("Running Dialogue Splitter")
+
+    # 1. Try the rules first, most pages have no dialogue or clearly tagged speakers
+    segments, confidence = segment_dialogue(state['corrected_text'], state.get('charachter_list'))
+    if confidence >= DIALOGUE_RULES_MIN_CONFIDENCE:
+        print(f"Dialogue split by the rules (confidence {confidence:.2f})")
+        return {"dialogue": json.dumps(segments)}
 
-    # 3. Invoke the llm
-    dialogue = chain_for_dialogue.invoke({"text": state['corrected_text']})   
+    # 2. Invoke the llm, a response without any usable segment is not cached
+    chain = (chains or get_chains()).dialogue_splitter
+    try:
+        segments, rejected, complete = invoke_llm_cached("dialogue_splitter", chain, {"text": state['corrected_text']},
+                                                         parse=parse_dialogue)
+    except ValueError as e:
+        print(f"Unusable dialogue splitter response ({e})")
+        segments, rejected, complete = [], [], True
+
+    # 3. The text of malformed segments or of a response cut short is split again
+    if rejected:
+        print(f"Dropped {len(rejected)} malformed dialogue segments, their text is split by the rules")
+    coverage = DialogueCoverage(state['corrected_text'], state.get('charachter_list'))
+    segments = [covered for segment in segments for covered in coverage.add(segment)]
+    segments += finish_dialogue(coverage, complete, chain)
 
     # 4. Return
-    return {"dialogue": dialogue.content} 
+    return {"dialogue": json.dumps(segments)}
 
 
-# Agent 3: Voice selector Agent
+# Repair of a dialogue splitter response with malformed segments or cut short
+
+def parse_dialogue(content):
+    '''
+    parse_array of a dialogue splitter response, used as the parse function of invoke_llm_cached.
+
+    Raises:
+        ValueError: The response has no usable segment, so it is neither cached nor kept in the cache
+    '''
+    segments, rejected, complete = parse_array(content, DialogueSegment, UNKNOWN_SPEAKER)
+    if not segments:
+        raise ValueError("no usable dialogue segment")
+    return segments, rejected, complete
+
+
+def rule_segments(text, charachter_list=None):
+    '''
+    Returns the rule based split of the text, or a single Narrator segment when its quotation marks
+    are not balanced.
+    '''
+    segments, _ = segment_dialogue(text, charachter_list)
+    return segments or [{"speaker": "Narrator", "text": text}]
+
+
+class DialogueCoverage:
+    '''
+    Follows the segments returned by the LLM through the text of the page, so the text of the
+    segments that were dropped (malformed objects) is split by the rules instead of disappearing
+    from the audio.
+
+    Args:
+        text: The text sent to the dialogue splitter
+        charachter_list: The known characters, used by the rule based splitter
+    '''
+    def __init__(self, text, charachter_list=None):
+        self.text = text
+        self.charachter_list = charachter_list
+        self.position = 0 # end of the last segment found in the text
+        self.last_speaker = None
+        self.added = 0
+        self.lost = False # a segment was not found, the skipped text is not known
+
+    def skipped(self, end, before_dialogue=False):
+        '''
+        Returns the text between the last segment and end, without the quotation marks around the
+        dialogues, or "" when there are no words in it.
+        '''
+        span = self.text[self.position:end]
+        if self.last_speaker not in (None, "Narrator"):
+            span = re.sub(r'^[\s,.;:!?]*[”"]', "", span) # closing quotation mark of the last dialogue
+        if before_dialogue:
+            span = re.sub(r'[“"]\s*$', "", span) # opening quotation mark of the next one
+        return span.strip() if re.search(r"\w", span) else ""
+
+    def add(self, segment):
+        '''
+        Returns the rule based segments of the text skipped before the segment, then the segment.
+        '''
+        self.added += 1
+        words = segment['text'].split()
+        match = re.compile(r"\s+".join(map(re.escape, words))).search(self.text, self.position) if words else None
+        if match is None:
+            # The LLM changed the text of the segment, it cannot be followed
+            self.lost = True
+            return [segment]
+        missing = "" if self.lost else self.skipped(match.start(), before_dialogue=segment['speaker'] != "Narrator")
+        self.position = match.end()
+        self.last_speaker = segment['speaker']
+        return (rule_segments(missing, self.charachter_list) if missing else []) + [segment]
+
+    def rest(self):
+        return self.skipped(len(self.text))
+
+
+def finish_dialogue(coverage, complete, chain=None):
+    '''
+    Returns the segments of the text the dialogue splitter response did not cover. When the
+    response was cut short, only that part of the text is sent to the LLM again; the text after the
+    last segment of a complete response (a malformed last segment) is split by the rules. A response
+    without any usable segment is replaced by the rule based split, so the job never fails on the
+    JSON of the LLM.
+
+    Args:
+        coverage: The DialogueCoverage of the segments of the response
+        complete: False when the response was cut short
+        chain: The dialogue splitter chain
+    '''
+    rest = coverage.rest()
+    if not rest:
+        return []
+    record("llm_json_repairs")
+    if not coverage.added:
+        print("Unusable dialogue splitter response, the page is split by the rules")
+        return rule_segments(rest, coverage.charachter_list)
+    if complete:
+        return [] if coverage.lost else rule_segments(rest, coverage.charachter_list)
+
+    print(f"Dialogue splitter response was cut short, splitting its last {len(rest)} characters again")
+    try:
+        more, _, _ = invoke_llm_cached("dialogue_splitter", chain or get_chains().dialogue_splitter, {"text": rest},
+                                       parse=parse_dialogue)
+    except ValueError as e:
+        print(f"Unusable dialogue splitter response ({e})")
+        more = []
+    rest_coverage = DialogueCoverage(rest, coverage.charachter_list)
+    more = [covered for segment in more for covered in rest_coverage.add(segment)]
+    tail = rest_coverage.rest()
+    return more + (rule_segments(tail, coverage.charachter_list) if tail else [])
+
+
+# Dialogue Splitter streaming its segments
+
+def stream_dialogue_segments(text, charachter_list=None, chain=None):
+    '''
+    Streams the dialogue splitter LLM output and yields every {speaker, text} segment as soon as
+    its JSON object is closed. A cached response is replayed segment by segment, and pages the
+    rules split confidently never reach the LLM.
+
+    Args:
+        text: The corrected text of the page
+        charachter_list: The known characters, used by the rule based splitter
+        chain: The dialogue splitter chain, get_chains().dialogue_splitter by default
+
+    Yields:
+        dict: The segments, in order
+    '''
+    segments, confidence = segment_dialogue(text, charachter_list)
+    if confidence >= DIALOGUE_RULES_MIN_CONFIDENCE:
+        print(f"Dialogue split by the rules (confidence {confidence:.2f})")
+        yield from segments
+        return
+
+    chain = chain or get_chains().dialogue_splitter
+    inputs = {"text": text}
+    llm_cache = get_llm_cache()
+    key = llm_cache.key("dialogue_splitter", PROMPT_VERSIONS["dialogue_splitter"], LLM_MODEL, inputs)
+    parser = IncrementalArrayParser(loads=loads_object)
+    coverage = DialogueCoverage(text, charachter_list)
+
+    # The text of malformed segments is split by the rules, a response cut short is completed once it is done
+    def validated(chunk):
+        for item in parser.feed(chunk):
+            try:
+                segment = validate_item(item, DialogueSegment, UNKNOWN_SPEAKER)
+            except (ValidationError, TypeError):
+                print("Dropped a malformed dialogue segment, its text is split by the rules")
+                continue
+            yield from coverage.add(segment)
+
+    content = llm_cache.get(key, "dialogue_splitter")
+    if content is not None:
+        print("LLM cache hit for dialogue_splitter")
+        record("llm_cache_hits")
+        yield from validated(content)
+        if not coverage.added:
+            # Nothing was yielded yet, the LLM is asked again
+            print("Dropping the cached response of dialogue_splitter, it has no usable segment")
+            llm_cache.delete(key)
+            parser = IncrementalArrayParser(loads=loads_object)
+            content = None
+
+    if content is None:
+        chunks = []
+        for chunk in schedulers["gemini"].stream(chain.stream, inputs, characters=prompt_characters(inputs)):
+            record_llm_usage(chunk)
+            chunks.append(chunk.content)
+            yield from validated(chunk.content)
+        # Only a complete response with usable segments is cached
+        if parser.finished and coverage.added:
+            llm_cache.put(key, "dialogue_splitter", "".join(chunks))
+
+    yield from finish_dialogue(coverage, parser.finished, chain)
+
+
+
+
+# Agent 1+2: Character identifier and Dialogue Splitter in a single LLM call
+
+# Output of the combined character identifier and dialogue splitter
+class CombinedOutput(BaseModel):
+    corrected_text: str = Field(..., description="The corrected text from LLM")
+    characters: Dict[str, Dict[str, Any]] = Field(
+        ..., description="Dictionary of characters where key is character name and value is a dictionary of properties"
+    )
+    new_charachter_identifed: str = Field(..., description="Binary response in Yes or No")
+    dialogue: List[DialogueSegment] = Field(..., description="The corrected text split into narration and dialogue segments, in order")
+
+
+def character_dialogue_identifier_chain(llm):
+    '''
+    Returns the prompt | llm chain of the combined mode and its output parser.
+    '''
+    from langchain_core.prompts import PromptTemplate
+    from langchain.output_parsers import PydanticOutputParser
+
+    # 1. Create parser
+    combined_parser = PydanticOutputParser(pydantic_object=CombinedOutput)
+
+    # 2. Define the system prompt
+    prompt_combined = PromptTemplate(
+        template=(
+            """ You are an expert book page reviewer and literary text parser. Your instructions are as below:
+
+        1. Read through the text and correct the spelling where required and return the corrected text.
+        2. Identify if a new character is introduced in the text with reference to the known characters of the charachter_list below. If there is a new charachter other than the ones in the charachter_list, respond with Yes in the new_charachter_identifed field. A known character called by another name (e.g. a nickname or a title) is not a new character, use its name from the charachter_list, or add an alias_of property with that name. Characters only sharing a surname (e.g. Jane Bennet and Elizabeth Bennet) are different characters.
+        3. For the new characters, identify their properties like Gender, Age, or any physical characteristics.
+        4. Split the corrected text chronologically into narration and dialogue segments, following the rules below.
+
+""" + DIALOGUE_RULES + """
+        Return ONLY valid JSON (no extra text, no markdown, no commentary).
+        {format_instructions}
+
+        Here is the text from a page which is part of a book. {text}
+        Here is the charachter_list: {charachter_list}
+        """
+        ),
+        input_variables=['text', 'charachter_list'],
+        partial_variables={"format_instructions": combined_parser.get_format_instructions()},
+    )
+
+    # 3. Create the chain
+    return prompt_combined | llm, combined_parser
+
+
+def character_dialogue_identifier(state: ResearchState, chains=None):
+    '''
+    Combined mode of character_identifier and dialogue_splitter. A single structured response
+    returns the corrected text, the new characters and the speaker segmented dialogue, which
+    halves the LLM round trips per page.
+    '''
+    print("Running Charachter Identification and Dialogue Splitter")
+    chains = chains or get_chains()
+
+    # 1. invoke the llm, only the known characters mentioned on the page are sent
+    registry = CharacterRegistry(state['charachter_list'])
+    response = invoke_llm_cached("character_dialogue_identifier", chains.character_dialogue_identifier,
+                                 {"text": state['ocr_text'], 'charachter_list': registry.digest(state['ocr_text'])},
+                                 parse=chains.combined_parser.parse)
+
+    # 2. update the character list, name variants of known characters become aliases
+    new_charachters = registry.merge(response.characters, state['ocr_text'])
+    new_charachter_identified = "Yes" if new_charachters else "No"
+
+    print(f"New Charachters were identified: {new_charachter_identified}")
+
+    # 3. Return, the dialogue is kept as a JSON string like the output of dialogue_splitter
+    return {
+        "corrected_text": response.corrected_text,
+        "charachter_list": registry.to_dict(),
+        "new_charachter_identified": new_charachter_identified,
+        "dialogue": json.dumps([segment.model_dump() for segment in response.dialogue]),
+    }
+
+
+# Agent 1+2 for several pages: batch mode of book mode
+
+# Output of the batch mode, one combined output per page
+class PageOutput(CombinedOutput):
+    page: int = Field(..., description="Number of the page in the batch, as given in its delimiter")
 
-def voice_selector(state: ResearchState):
+
+class BatchOutput(BaseModel):
+    pages: List[PageOutput] = Field(..., description="The output of every page of the batch, in page order")
+
+
+def character_dialogue_identifier_batch_chain(llm):
+    '''
+    Returns the prompt | llm chain of the batch mode and its output parser.
     '''
+    from langchain_core.prompts import PromptTemplate
+    from langchain.output_parsers import PydanticOutputParser
 
+    # 1. Create parser
+    batch_parser = PydanticOutputParser(pydantic_object=BatchOutput)
+
+    # 2. Define the system prompt
+    prompt_batch = PromptTemplate(
+        template=(
+            """ You are an expert book page reviewer and literary text parser. You are given several consecutive pages of a book, every page starts with a delimiter line like """ + PAGE_DELIMITER.format(1) + """. Process every page separately, in order, as below:
+
+        1. Read through the text of the page and correct the spelling where required and return the corrected text of the page only.
+        2. Identify if a new character is introduced in the page with reference to the known characters of the charachter_list below and of the earlier pages. If there is a new charachter, respond with Yes in the new_charachter_identifed field of the page. A known character called by another name (e.g. a nickname or a title) is not a new character, use its known name, or add an alias_of property with that name. Characters only sharing a surname (e.g. Jane Bennet and Elizabeth Bennet) are different characters.
+        3. For the new characters, identify their properties like Gender, Age, or any physical characteristics.
+        4. Split the corrected text of the page chronologically into narration and dialogue segments, following the rules below.
+
+""" + DIALOGUE_RULES + """
+        Return ONLY valid JSON (no extra text, no markdown, no commentary), with one entry per page in the pages array and the number of the page in its page field.
+        {format_instructions}
+
+        Here are the pages which are part of a book.
+        {pages}
+
+        Here is the charachter_list: {charachter_list}
+        """
+        ),
+        input_variables=['pages', 'charachter_list'],
+        partial_variables={"format_instructions": batch_parser.get_format_instructions()},
+    )
+
+    # 3. Create the chain
+    return prompt_batch | llm, batch_parser
+
+
+def character_dialogue_identifier_batch(texts, charachter_list, chains=None):
+    '''
+    Runs character_dialogue_identifier on several consecutive pages with a single LLM request,
+    which saves the fixed latency of a request per page in book mode. When the response cannot be
+    parsed or misses a page, the pages fall back to one character_dialogue_identifier call each.
+
+    Args:
+        texts: The OCR text of the pages, in order
+        charachter_list: The characters known before the first page
+        chains: The PipelineChains, get_chains() by default
+
+    Returns:
+        list: The state update of every page, like the one of character_dialogue_identifier. The
+              charachter_list of a page includes the characters of the earlier pages of the batch.
+    '''
+    from langchain_core.exceptions import OutputParserException
+
+    print(f"Running Charachter Identification and Dialogue Splitter on {len(texts)} pages")
+    chains = chains or get_chains()
+    registry = CharacterRegistry(charachter_list)
+
+    # 1. invoke the llm once for all the pages, a response missing a page is not used (nor cached)
+    def parse_pages(content):
+        outputs = sorted(chains.batch_parser.parse(content).pages, key=lambda output: output.page)
+        if [output.page for output in outputs] != list(range(1, len(texts) + 1)):
+            raise ValueError(f"expected pages 1 to {len(texts)}, got {[output.page for output in outputs]}")
+        return outputs
+
+    pages = "\n\n".join(f"{PAGE_DELIMITER.format(number)}\n{text}" for number, text in enumerate(texts, start=1))
+    try:
+        outputs = invoke_llm_cached("character_dialogue_identifier_batch", chains.character_dialogue_identifier_batch,
+                                    {"pages": pages, 'charachter_list': registry.digest("\n".join(texts))},
+                                    parse=parse_pages)
+    except (OutputParserException, ValueError) as e:
+        # 2. fall back to one call per page, carrying the characters forward
+        print(f"Batch response could not be used ({e}), processing the pages one by one")
+        record("llm_batch_fallbacks")
+        updates = []
+        for text in texts:
+            update = character_dialogue_identifier({"ocr_text": text, "charachter_list": charachter_list}, chains=chains)
+            charachter_list = update['charachter_list']
+            updates.append(update)
+        return updates
+
+    # 3. update the character list page after page, name variants of known characters become aliases
+    updates = []
+    for output in outputs:
+        new_charachters = registry.merge(output.characters, output.corrected_text)
+        updates.append({
+            "corrected_text": output.corrected_text,
+            "charachter_list": registry.to_dict(),
+            "new_charachter_identified": "Yes" if new_charachters else "No",
+            "dialogue": json.dumps([segment.model_dump() for segment in output.dialogue]),
+        })
+    return updates
+
+
+# Agent 3: Voice selector Agent
+
+def voice_selector(state: ResearchState, chains=None):
+    '''
+    Assigns a voice to every character that does not have one yet. Characters are cast locally
+    against the voice index, and only the ambiguous ones are sent to the LLM.
     '''
     print("Running Voice Selector")
 
+    # Get the existing dictionary from the state, or a new one if it doesn't exist
+    existing_speakerXid = state.get('speakerXid', {})
+
+    # 1. Only the characters seen for the first time need a voice
+    new_characters = {name: properties for name, properties in state['charachter_list'].items()
+                      if name not in existing_speakerXid}
+
+    # 2. Local casting, the narrator voice is kept for the narration
+    casting_index = get_casting_index(state['voice_list'])
+    narrator_voice_ids = {state.get('default_charachter')}
+    used_voice_ids = set(existing_speakerXid.values())
+    ambiguous_characters = {}
+    for name, properties in new_characters.items():
+        voice_id = casting_index.cast(name, properties, used_voice_ids, narrator_voice_ids)
+        if voice_id is None:
+            ambiguous_characters[name] = properties
+        else:
+            print(f"Cast {name} locally")
+            existing_speakerXid[name] = voice_id
+            used_voice_ids.add(voice_id)
+
+    if not ambiguous_characters:
+        return {"speakerXid": existing_speakerXid}
+
+    # 3. Ask the LLM for the ambiguous characters only
+    print(f"Casting {len(ambiguous_characters)} ambiguous characters with the LLM")
+    # The whole voice list is sent, so the cached responses stay valid when only the narrator changes
+    chain = (chains or get_chains()).voice_selector
+    llm_cast = llm_voice_selector(ambiguous_characters, state['voice_list'], chain, excluded_voice_ids=narrator_voice_ids)
+
+    # 4. The characters the LLM could not cast get their best local match instead of the narrator voice
+    for name, properties in ambiguous_characters.items():
+        ranked = casting_index.rank(name, properties, used_voice_ids, narrator_voice_ids)
+        if name not in llm_cast and ranked:
+            llm_cast[name] = ranked[0][1]['voice_id']
+    existing_speakerXid.update(llm_cast)
+
+    # 5. return
+    return {"speakerXid": existing_speakerXid}
+
+
+# LLM fallback of the voice selector
+
+# A voice assignment of the voice selector output, null when no voice matches the character
+class VoiceAssignment(BaseModel):
+    name: str = Field(..., description="Name of the character")
+    assigned_voice_id: Optional[str] = Field(..., description="The voice id of the character")
+
+
+def voice_selector_chain(llm):
+    '''
+    Returns the prompt | llm chain of the voice selector.
+    '''
+    from langchain_core.prompts import PromptTemplate
+
     # 1. Prompt for selecting the voice
     prompt_for_voice_selection = PromptTemplate(
         template=(
@@ -367,82 +918,284 @@ def voice_selector(state: ResearchState):
     )
 
     # 2. create the llm chain
-    chain_for_voice_selection = prompt_for_voice_selection | llm
+    return prompt_for_voice_selection | llm
 
-    # 3. Invoke the llm chain
-    voice_selection_response = chain_for_voice_selection.invoke({"character_list": state['charachter_list'],
-                        'voice_list':state['voice_list']})
 
-    # Get the existing dictionary from the state, or a new one if it doesn't exist
-    existing_speakerXid = state.get('speakerXid', {})
-    
-    # 4. create voice dictionary
-    voice_json = json.loads(voice_selection_response.content)
+def llm_voice_selector(character_list, voice_list, chain=None, reask=True, excluded_voice_ids=()):
+    '''
+    Asks the LLM to cast the given characters. The response is repaired locally if needed, and
+    only the characters left without a valid assignment (missing, malformed, with an unknown voice
+    id or with an excluded one, e.g. the narrator voice) are asked again, once, bypassing the cache.
+    The characters still without one are left out of the result.
+
+    Returns:
+        dict: character name -> voice id
+    '''
+    # 1. Invoke the llm chain
+    chain = chain or get_chains().voice_selector
+    voice_selection_response = invoke_llm_cached("voice_selector", chain,
+                                                 {"character_list": character_list, 'voice_list': voice_list},
+                                                 refresh=not reask)
+
+    # 2. create voice dictionary, keeping the valid assignments of the known characters only
+    assignments, _, _ = parse_array(voice_selection_response, VoiceAssignment)
+    voice_ids = {voice.get('voice_id') for voice in voice_list} - set(excluded_voice_ids)
+    names = {name.lower(): name for name in character_list}
+    speakerXid = {}
+    for item in assignments:
+        name = names.get(item['name'].strip().lower())
+        if name and (item['assigned_voice_id'] is None or item['assigned_voice_id'] in voice_ids):
+            speakerXid[name] = item['assigned_voice_id']
+
+    # 3. ask again for the characters without a valid assignment
+    missing = {name: properties for name, properties in character_list.items() if name not in speakerXid}
+    if missing and reask:
+        print(f"No valid voice for {', '.join(missing)}, asking again for these characters only")
+        record("llm_json_repairs")
+        speakerXid.update(llm_voice_selector(missing, voice_list, chain, reask=False, excluded_voice_ids=excluded_voice_ids))
+
+    # 4. return the new mappings
+    return speakerXid
+
+
+# Synthesize a single dialogue segment
+def synthesize_segment(text, voice, filename, tts_client=None):
+    '''
+    Converts one dialogue segment to speech and saves it to the given file.
+    The clip cache is checked first, so a segment already rendered with the same voice and model is reused.
 
-    # Add the new mappings
-    for item in voice_json:
-        existing_speakerXid[item['name']] = item['assigned_voice_id']
+    Args:
+        text: The text of the segment
+        voice: The ElevenLabs voice id to use
+        filename: Path of the mp3 file to write
+        tts_client: Optional TTS client, defaults to the ElevenLabs client of get_tts_client
 
-    # 4. return
-    return {"speakerXid": existing_speakerXid}
+    Returns:
+        audio: The mp3 clip
+    '''
+    key = clip_key(text, voice, TTS_MODEL_ID)
+    clip_cache = get_clip_cache()
+    audio = clip_cache.get(key)
+
+    if audio is None:
+        tts_client = tts_client or get_tts_client()
+        # The clip is cached and saved whole, so the chunks of either endpoint are joined before it is returned
+        tts = tts_client.text_to_speech
+        convert = tts.stream if TTS_STREAMING and hasattr(tts, "stream") else tts.convert
+        # Within the ElevenLabs quota, the clip is requested again on a transient error
+        audio = schedulers["elevenlabs"].call(lambda: b"".join(convert(text=f"{text}.", voice_id=voice, model_id=TTS_MODEL_ID,)),
+                                              characters=len(text))
+        clip_cache.put(key, audio)
+        record("tts_characters", len(text))
+        print(f"Generated and saved {filename}")
+    else:
+        record("clip_cache_hits")
+        print(f"Loaded {filename} from the clip cache")
 
+    with open(filename, "wb") as f:
+        f.write(audio)
+    record("bytes_written", len(audio))
+    return audio
 
-# Agent 4. Voice Generator
 
-def voice_generator(state: ResearchState):
+# Segments already synthesized in an output folder
+class SegmentManifest:
     '''
-
+    Records every segment clip saved in the output folder together with the content address of its
+    text and voice, so a retried job only synthesizes the segments that are missing or have changed.
     '''
-    print("Running Voice Generator")
+    def __init__(self, output_path):
+        self.path = os.path.join(output_path, "segments.json")
+        self.lock = threading.Lock()
+        try:
+            with open(self.path) as f:
+                self.done = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.done = {}
+
+    def get(self, filename, key):
+        '''
+        Returns the clip if this segment was already completed with the same text and voice.
+        '''
+        if self.done.get(os.path.basename(filename)) != key:
+            return None
+        try:
+            with open(filename, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def mark_done(self, filename, key):
+        with self.lock:
+            self.done[os.path.basename(filename)] = key
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(self.done, f)
+            os.replace(tmp_path, self.path)
+
+
+# Synthesize a segment unless it was completed by an earlier attempt
+def synthesize_tracked_segment(manifest, text, voice, filename, tts_client=None):
+    key = clip_key(text, voice, TTS_MODEL_ID)
+    audio = manifest.get(filename, key)
+    if audio is not None:
+        print(f"Reusing {filename} from an earlier attempt")
+        return audio
+
+    audio = synthesize_segment(text, voice, filename, tts_client)
+    manifest.mark_done(filename, key)
+    return audio
+
+
+# Streaming voice generator
+
+def voice_generator_stream(state: ResearchState, max_workers=None, tts_client=None, segments=None):
+    '''
+    Converts the dialogue to speech and yields the clips in order as soon as each one (and the ones
+    before it) is ready, so playback can start while the rest of the page is still being synthesized.
+    The segments are first planned into TTS requests: adjacent segments read by the same voice are
+    merged and long ones are split at sentence boundaries. The requests are synthesized concurrently
+    on a bounded thread pool (at most `max_workers` requests in flight, rate limited per provider),
+    and each clip is saved as part_test{i}.mp3 in the output folder.
 
+    Args:
+        segments: Optional iterable of segments, e.g. parsed from the streamed LLM output.
+            Each request is sent to TTS as soon as its segments have arrived. Defaults to state['dialogue'].
+
+    Yields:
+        (index, request, audio): Position of the request, the request dict (speaker, voice, text and
+            the indices of its dialogue segments) and the mp3 clip
+    '''
     # 1. Create a new folder
-    # Create a directory to save the audio clips
-    if not os.path.exists("audio_clips"):
-        os.makedirs("audio_clips")
+    # Create a directory to save the audio clips (the job workspace or the page folder in book mode)
+    output_path = state.get('output_path') or create_job_workspace()['output_path']
+    if not os.path.exists(output_path):
+        os.makedirs(output_path)
 
-    # 2. Create json object from the dialogue
-    json_obj = json.loads(state['dialogue'])
+    # 2. Create json object from the dialogue, malformed segments are dropped
+    if segments is None:
+        segments, _, _ = parse_array(state['dialogue'], DialogueSegment, UNKNOWN_SPEAKER)
 
-    # 3. Get speakerXid
+    # 3. Get speakerXid, speakers named by an alias get the voice of their character
     speakerXid = state["speakerXid"]
+    registry = CharacterRegistry(state.get('charachter_list'))
+    def voice_of(speaker):
+        return speakerXid.get(speaker) or speakerXid.get(registry.resolve(speaker), default_voice)
 
     # 4. Generate the audio
     default_voice = state['default_charachter'] #Set default voice when there is no voice id selected
 
-    counter = 0 # remove the counter logic to generate the audio of entire page. currently limited since I am using free tier ElevenLabs subscription.
+    # remove the segment limit to generate the audio of entire page. currently limited since I am using free tier ElevenLabs subscription.
+    segments = islice(segments, TTS_MAX_SEGMENTS)
 
-    for i, dialogue_ in enumerate(json_obj):
-        if counter <5:
-            speaker = dialogue_['speaker']
+    # Plan the TTS requests
+    requests = plan_tts_requests(segments, voice_of)
 
-            if speaker in speakerXid.keys():
-                voice = speakerXid[speaker]
-                #print(f"voice for {speaker} is {voice}")
-            else:
-                voice = default_voice
-                #print(f"default voice for {speaker} is {voice}")
-            
-            audio = client.text_to_speech.convert(text=f"{dialogue_['text']}.", voice_id=voice, model_id="eleven_multilingual_v2",)
+    # Requests completed by an earlier attempt of the same job are not synthesized again
+    manifest = SegmentManifest(output_path)
 
-            filename = f"audio_clips/part_test{i+1}.mp3"
-            save(audio, filename)
-            print(f"Generated and saved {filename}")
+    with ThreadPoolExecutor(max_workers=max_workers or TTS_MAX_WORKERS) as executor:
+        pending = deque()
+        for i, request in enumerate(requests):
+            filename = os.path.join(output_path, f"part_test{i+1}.mp3")
+            pending.append((i, request, submit_traced(executor, synthesize_tracked_segment, manifest, request['text'], request['voice'], filename, tts_client)))
 
-            counter += 1
+            # Hand over the clips already done while the next segments are still arriving
+            while pending and pending[0][2].done():
+                i_, request_, future = pending.popleft()
+                yield i_, request_, future.result()
 
-    output_path = "audio_clips"
-    
-    # 5. return
-    return {"output_path": output_path}
+        # Yield the rest in order, raises the first error encountered
+        while pending:
+            i_, request_, future = pending.popleft()
+            yield i_, request_, future.result()
+
+
+# Paths of the job workspace
+def get_job_paths(state: ResearchState):
+    '''
+    Returns the output paths of the job. Jobs started without a workspace get their own,
+    so they never share clips with another job.
+    '''
+    if state.get('output_path'):
+        return {"output_path": state['output_path']}
+    return {k: v for k, v in create_job_workspace().items() if k == 'output_path' or not state.get(k)}
+
+
+# Agent 4. Voice Generator
+
+def voice_generator(state: ResearchState, max_workers=None, tts_client=None):
+    '''
+    Converts the dialogue to speech with voice_generator_stream. The clips are returned in memory,
+    in order, so mp3_combine can join them without going back to the disk, together with the
+    tts_plan mapping every clip back to its dialogue segments.
+    '''
+    print("Running Voice Generator")
+
+    job_paths = get_job_paths(state)
+    tts_plan = []
+    audio_segments = []
+    for _, request, audio in voice_generator_stream({**state, **job_paths}, max_workers=max_workers, tts_client=tts_client):
+        tts_plan.append(request)
+        audio_segments.append(audio)
+
+    # return
+    return {**job_paths, "tts_plan": tts_plan, "audio_segments": audio_segments}
+
+
+# Agent 2+4: Dialogue Splitter streaming its segments into the Voice Generator
+
+def dialogue_speech(state: ResearchState, max_workers=None, tts_client=None, chains=None):
+    '''
+    Streams the dialogue splitter output and sends every segment to TTS as soon as its JSON object
+    is complete, so audio synthesis overlaps with the LLM generation of the rest of the page.
+    '''
+    print("Running Dialogue Splitter with streaming Voice Generator")
+
+    dialogue = []
+    def segments():
+        for segment in stream_dialogue_segments(state['corrected_text'], state.get('charachter_list'),
+                                                chain=chains.dialogue_splitter if chains else None):
+            dialogue.append(segment)
+            yield segment
+
+    job_paths = get_job_paths(state)
+    segment_stream = segments()
+    tts_plan = []
+    audio_segments = []
+    for _, request, audio in voice_generator_stream({**state, **job_paths}, max_workers=max_workers,
+                                                    tts_client=tts_client, segments=segment_stream):
+        tts_plan.append(request)
+        audio_segments.append(audio)
+    # Segments past the TTS limit still belong to the dialogue
+    for _ in segment_stream:
+        pass
+
+    return {**job_paths, "dialogue": json.dumps(dialogue), "tts_plan": tts_plan, "audio_segments": audio_segments}
             
 # Agent 5. Combine the Audios together
 
 def mp3_combine(state: ResearchState):
     '''
-    Combines multiple MP3 files from a directory into a single output file
-    using ffmpeg, ensuring they are sorted in numerical order.
+    Combines the clips of the voice generator into a single output file. The clips kept in memory
+    are joined in process by appending their mp3 frames; otherwise the MP3 files of the output
+    directory are combined using ffmpeg, ensuring they are sorted in numerical order.
     '''
     print("Combining audio clips...")
+    output_filename = state.get('final_audio_path') or "final_audiobook.mp3"
+
+    # 0. In-process concatenation of the clips in memory
+    audio_segments = state.get('audio_segments')
+    if audio_segments:
+        try:
+            audio = concat_mp3(audio_segments, silence_ms=AUDIO_SILENCE_MS, normalize=AUDIO_NORMALIZE)
+            with open(output_filename, "wb") as f:
+                f.write(audio)
+            record("bytes_written", len(audio))
+            print(f"Successfully created {output_filename}")
+            return {"final_audio_path" : output_filename}
+        except ValueError as e:
+            print(f"In-process concatenation failed, falling back to ffmpeg: {e}")
 
     # 1. Get the path of the output audios
     output_path = state['output_path']
@@ -469,8 +1222,7 @@ def mp3_combine(state: ResearchState):
     print(files)#
 
     # 4. Create a temporary file list for ffmpeg
-    file_list_path = "file_list.txt"
-    output_filename = "final_audiobook.mp3"
+    file_list_path = os.path.join(output_path, "file_list.txt")
 
     try:
         with open(file_list_path, "w") as f:
@@ -493,6 +1245,7 @@ def mp3_combine(state: ResearchState):
         
         # Use check=True to raise an error if ffmpeg fails
         subprocess.run(command, check=True, capture_output=True, text=True)
+        record("bytes_written", os.path.getsize(output_filename))
         print(f"Successfully created {output_filename}")
 
     except FileNotFoundError:
@@ -513,23 +1266,79 @@ def mp3_combine(state: ResearchState):
     return {"final_audio_path" : output_filename}
 
 
+# Chains of the LLM nodes
+class PipelineChains:
+    '''
+    The prompt | llm chains and output parsers of every LLM node. Building them renders the format
+    instructions and parses the long prompt templates, so they are built once per LLM and shared
+    by all the invocations of the graph.
+    '''
+    def __init__(self, llm):
+        self.llm = llm
+        self.character_identifier, self.ocr_parser = character_identifier_chain(llm)
+        self.dialogue_splitter = dialogue_splitter_chain(llm)
+        self.character_dialogue_identifier, self.combined_parser = character_dialogue_identifier_chain(llm)
+        self.character_dialogue_identifier_batch, self.batch_parser = character_dialogue_identifier_batch_chain(llm)
+        self.voice_selector = voice_selector_chain(llm)
+
+
+_chains = None
+_chains_lock = threading.Lock()
+
+def get_chains(llm=None):
+    '''
+    Returns the PipelineChains of the LLM (get_llm() by default), built on first use.
+    '''
+    global _chains
+    llm = llm or get_llm()
+    with _chains_lock:
+        if _chains is None or _chains.llm is not llm:
+            _chains = PipelineChains(llm)
+        return _chains
+
+
 # Create workflow
-@st.cache_resource
-def get_compiled_graph():
-    print("--- Compiling LangGraph Workflow ---")
+def build_workflow(include_audio=True, combined=False, stream_dialogue=STREAM_DIALOGUE_TO_TTS, chains=None):
+    '''
+    Builds the agent workflow. With include_audio=False the graph stops after the dialogue splitter,
+    which lets book mode run the text stages of a page while the audio of the previous page is generated.
+    With combined=True a single LLM call identifies the characters and splits the dialogue.
+    With stream_dialogue=True the dialogue splitter sends every segment to TTS as soon as it is streamed.
+    The LLM nodes use the given PipelineChains, or get_chains() when they run.
+    '''
+    from langgraph.graph import StateGraph, END
 
     workflow = StateGraph(ResearchState)
 
-    workflow.add_node("character_identifier", character_identifier)
-    workflow.add_node("dialogue_splitter", dialogue_splitter)
-    workflow.add_node("voice_selector", voice_selector)
-    workflow.add_node("voice_generator", voice_generator)
-    workflow.add_node("mp3_combine", mp3_combine)
+    # Every node is traced: wall time, tokens, characters, cache hits and bytes written
+    def add_node(name, node):
+        if chains is not None and node in (character_identifier, character_dialogue_identifier, dialogue_splitter,
+                                           dialogue_speech, voice_selector):
+            node = partial(node, chains=chains)
+        workflow.add_node(name, traced_node(name, node))
+
+    # Node that runs once the dialogue is ready
+    after_dialogue = "voice_generator" if include_audio else END
+    stream_dialogue = stream_dialogue and include_audio and not combined
+
+    if combined:
+        add_node("character_identifier", character_dialogue_identifier)
+        dialogue_ready = after_dialogue
+    elif stream_dialogue:
+        # The dialogue splitter also generates the voices
+        add_node("character_identifier", character_identifier)
+        add_node("dialogue_splitter", dialogue_speech)
+        workflow.add_edge("dialogue_splitter", "mp3_combine")
+        dialogue_ready = "dialogue_splitter"
+    else:
+        add_node("character_identifier", character_identifier)
+        add_node("dialogue_splitter", dialogue_splitter)
+        workflow.add_edge("dialogue_splitter", after_dialogue)
+        dialogue_ready = "dialogue_splitter"
+    add_node("voice_selector", voice_selector)
 
     workflow.set_entry_point("character_identifier")
-    workflow.add_edge("voice_selector", "dialogue_splitter")
-    workflow.add_edge("dialogue_splitter", "voice_generator")
-    workflow.add_edge("voice_generator", "mp3_combine")
+    workflow.add_edge("voice_selector", dialogue_ready)
     workflow.add_conditional_edges(
         # The starting node of the edge
         "character_identifier",
@@ -538,14 +1347,55 @@ def get_compiled_graph():
         # A dictionary mapping the function's return values to node names
         {
             "voice_selector": "voice_selector",
-            "dialogue_splitter": "dialogue_splitter"
+            "dialogue_splitter": dialogue_ready
         }
     )
-    # You might also want an edge to the end
-    workflow.add_edge("mp3_combine", END)
 
+    if include_audio:
+        if not stream_dialogue:
+            add_node("voice_generator", voice_generator)
+            workflow.add_edge("voice_generator", "mp3_combine")
+        add_node("mp3_combine", mp3_combine)
+        # You might also want an edge to the end
+        workflow.add_edge("mp3_combine", END)
+
+    return workflow
+
+
+# Checkpointer of the workflow state
+@lru_cache(maxsize=None)
+def get_checkpointer():
+    '''
+    Returns the checkpointer saving the state after every node. The state is saved in a local
+    SQLite file so a failed job can be resumed, even by another process, from its last completed node.
+    '''
+    try:
+        import sqlite3
+        from langgraph.checkpoint.sqlite import SqliteSaver
+    except ImportError:
+        from langgraph.checkpoint.memory import InMemorySaver
+        print("langgraph-checkpoint-sqlite is not installed, checkpoints are kept in memory")
+        return InMemorySaver()
+
+    os.makedirs(os.path.dirname(CHECKPOINT_DB_PATH) or ".", exist_ok=True)
+    return SqliteSaver(sqlite3.connect(CHECKPOINT_DB_PATH, check_same_thread=False))
 
-    app = workflow.compile()
+
+@lru_cache(maxsize=None)
+def get_compiled_graph(combined=COMBINED_LLM_MODE, checkpoint=False):
+    print("--- Compiling LangGraph Workflow ---")
+
+    # The chains are built once, here, and shared by every invocation of the graph
+    # With checkpoint=True the graph must be invoked with a thread_id (the job id) in its config
+    app = build_workflow(combined=combined, chains=get_chains()).compile(checkpointer=get_checkpointer() if checkpoint else None)
 
     return app
 
+
+@lru_cache(maxsize=None)
+def get_compiled_text_graph(combined=COMBINED_LLM_MODE):
+    print("--- Compiling LangGraph Text Workflow ---")
+
+    app = build_workflow(include_audio=False, combined=combined, chains=get_chains()).compile()
+
+    return app
@@ -0,0 +1,200 @@
+# In-process concatenation of mp3 clips
+import io
+
+
+# MPEG audio tables (Layer III only, which is what ElevenLabs returns)
+MPEG1 = 3
+MPEG2 = 2
+MPEG25 = 0
+BITRATES = {
+    MPEG1: [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    MPEG2: [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+BITRATES[MPEG25] = BITRATES[MPEG2]
+SAMPLE_RATES = {
+    MPEG1: [44100, 48000, 32000],
+    MPEG2: [22050, 24000, 16000],
+    MPEG25: [11025, 12000, 8000],
+}
+
+# Target loudness used when normalizing the segments
+TARGET_DBFS = -20.0
+
+
+def parse_frame_header(data, offset=0):
+    '''
+    Parses the 4 byte header of an MPEG Layer III frame.
+
+    Returns:
+        dict: The frame properties, or None if there is no valid header at the offset
+    '''
+    if offset + 4 > len(data):
+        return None
+    b0, b1, b2, b3 = data[offset:offset + 4]
+    if b0 != 0xFF or (b1 & 0xE0) != 0xE0:
+        return None
+
+    version = (b1 >> 3) & 0x3
+    layer = (b1 >> 1) & 0x3
+    bitrate_index = b2 >> 4
+    sample_rate_index = (b2 >> 2) & 0x3
+    if version == 1 or layer != 1 or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
+
+    bitrate = BITRATES[version][bitrate_index] * 1000
+    sample_rate = SAMPLE_RATES[version][sample_rate_index]
+    padding = (b2 >> 1) & 0x1
+    mono = (b3 >> 6) == 3
+    samples = 1152 if version == MPEG1 else 576
+
+    return {
+        "version": version,
+        "bitrate": bitrate,
+        "sample_rate": sample_rate,
+        "channels": 1 if mono else 2,
+        "crc": not (b1 & 0x1),
+        "samples": samples,
+        "length": samples // 8 * bitrate // sample_rate + padding,
+        "side_info": (17 if mono else 32) if version == MPEG1 else (9 if mono else 17),
+    }
+
+
+def skip_id3(data):
+    '''
+    Returns the clip without its ID3v2 (start) and ID3v1 (end) tags.
+    '''
+    start = 0
+    if data[:3] == b"ID3" and len(data) >= 10:
+        size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+        footer = 10 if data[5] & 0x10 else 0
+        start = 10 + size + footer
+    end = len(data)
+    if end - start >= 128 and data[end - 128:end - 125] == b"TAG":
+        end -= 128
+    return data[start:end]
+
+
+def find_first_frame(data):
+    '''
+    Returns the offset and header of the first frame, checking that the next frame follows
+    so that a stray 0xFF byte is not taken as a sync word.
+    '''
+    offset = data.find(b"\xff")
+    while offset != -1:
+        header = parse_frame_header(data, offset)
+        if header:
+            next_offset = offset + header['length']
+            if next_offset >= len(data) or parse_frame_header(data, next_offset):
+                return offset, header
+        offset = data.find(b"\xff", offset + 1)
+    return None, None
+
+
+def mp3_frames(data):
+    '''
+    Returns the audio frames of a clip and the header of its first frame. Tags and the
+    Xing/Info frame are dropped since they describe the single clip, not the combined file.
+    '''
+    data = skip_id3(data)
+    offset, header = find_first_frame(data)
+    if header is None:
+        raise ValueError("No mp3 frame found in clip")
+
+    info_offset = offset + 4 + (2 if header['crc'] else 0) + header['side_info']
+    if data[info_offset:info_offset + 4] in (b"Xing", b"Info"):
+        offset += header['length']
+
+    return data[offset:], header
+
+
+def mp3_duration(data):
+    '''
+    Returns the duration of a clip in seconds, 0.0 when it holds no mp3 frame.
+    '''
+    try:
+        frames, _ = mp3_frames(data)
+    except ValueError:
+        return 0.0
+    offset = 0
+    seconds = 0.0
+    while header := parse_frame_header(frames, offset):
+        seconds += header['samples'] / header['sample_rate']
+        offset += header['length']
+    return seconds
+
+
+def silence(header, duration_ms):
+    '''
+    Builds silent frames with the same format as the given frame header.
+    A Layer III frame whose side info and main data are all zeros decodes to silence.
+    '''
+    if duration_ms <= 0:
+        return b""
+    frame_header = bytearray(header['raw'])
+    frame_header[1] |= 0x01 # no CRC
+    frame_header[2] &= ~0x02 & 0xFF # no padding
+    frame_length = header['length'] - ((header['raw'][2] >> 1) & 0x1)
+    frame = bytes(frame_header) + bytes(frame_length - 4)
+
+    frame_count = round(duration_ms / 1000 * header['sample_rate'] / header['samples'])
+    return frame * max(frame_count, 1)
+
+
+def concat_pcm(clips, silence_ms=0, normalize=False):
+    '''
+    Decodes every clip to PCM and re-encodes the result, used when the clips do not share the same format
+    or when the loudness has to be normalized. Needs the optional pydub package.
+    '''
+    try:
+        from pydub import AudioSegment
+    except ImportError:
+        raise ValueError("pydub is required to combine clips of different formats or to normalize loudness")
+
+    combined = AudioSegment.empty()
+    gap = AudioSegment.silent(duration=silence_ms)
+    for i, clip in enumerate(clips):
+        segment = AudioSegment.from_file(io.BytesIO(clip), format="mp3")
+        if normalize and segment.dBFS != float("-inf"):
+            segment = segment.apply_gain(TARGET_DBFS - segment.dBFS)
+        if i and silence_ms:
+            combined += gap
+        combined += segment
+
+    output = io.BytesIO()
+    combined.export(output, format="mp3")
+    return output.getvalue()
+
+
+def concat_mp3(clips, silence_ms=0, normalize=False):
+    '''
+    Joins mp3 clips in memory by appending their frames, with optional silence between segments.
+
+    Args:
+        clips: List of mp3 clips (bytes) in segment order
+        silence_ms: Silence inserted between two segments
+        normalize: Normalize the loudness of every segment (decodes to PCM)
+
+    Returns:
+        bytes: The combined mp3
+
+    Raises:
+        ValueError: If a clip cannot be parsed, or needs decoding and pydub is not installed
+    '''
+    if normalize:
+        return concat_pcm(clips, silence_ms, normalize)
+
+    parts = []
+    first = None
+    for clip in clips:
+        frames, header = mp3_frames(clip)
+        header['raw'] = frames[:4]
+        if first is None:
+            first = header
+        elif (header['version'], header['sample_rate'], header['channels']) != (first['version'], first['sample_rate'], first['channels']):
+            # Frames of different formats cannot be appended
+            return concat_pcm(clips, silence_ms, normalize)
+        if parts and silence_ms:
+            parts.append(silence(first, silence_ms))
+        parts.append(frames)
+
+    return b"".join(parts)
@@ -0,0 +1,93 @@
+# Micro-benchmark of the per-invocation overhead of the LLM nodes
+'''
+Compares the LLM nodes when their prompt, output parser and chain are rebuilt on every call
+(as they used to be) with the chains built once by get_chains(). The LLM stand-in answers
+instantly and the responses come from the warm LLM cache, so only the node overhead is measured.
+
+Example:
+    python benchmarks/bench_chain_setup.py --calls 200
+'''
+import os
+import sys
+import time
+import logging
+import shutil
+import argparse
+import tempfile
+import statistics
+from types import SimpleNamespace
+
+from run_benchmark import REPO_ROOT, PAGES, VOICES, Latency, make_fake_llm, quiet
+
+
+def measure(fn, calls):
+    '''
+    Returns the median and p95 duration of fn in microseconds, the median is less noisy than the
+    mean since every call also reads the SQLite cache.
+    '''
+    durations = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        fn()
+        durations.append((time.perf_counter() - start) * 1e6)
+    durations.sort()
+    return statistics.median(durations), durations[int(0.95 * (len(durations) - 1))]
+
+
+def run(args):
+    # 1. Fresh LLM cache, the dialogue splitter always goes to the LLM
+    work_dir = tempfile.mkdtemp(prefix="audify-chains-")
+    os.environ["AUDIFY_LLM_CACHE"] = os.path.join(work_dir, "llm.db")
+    os.environ["AUDIFY_DIALOGUE_RULES_MIN_CONFIDENCE"] = "2"
+    sys.path.insert(0, REPO_ROOT)
+    with quiet(args.verbose):
+        import app
+        import clients
+    logging.getLogger("audify.metrics").setLevel(logging.WARNING)
+
+    llm = make_fake_llm(Latency(0, 0, 0))
+    clients.set_llm(llm)
+    chains = app.get_chains()
+
+    state = {"ocr_text": PAGES[0], "corrected_text": PAGES[0], "charachter_list": {"Max": {"Gender": "Male"}}}
+    characters = {"Artois": {"Gender": "Male"}}
+
+    # 2. The nodes with their chains rebuilt on every call, and with the shared chains
+    def rebuilt_character_identifier():
+        chain, parser = app.character_identifier_chain(llm)
+        app.character_identifier(dict(state), chains=SimpleNamespace(character_identifier=chain, ocr_parser=parser))
+
+    def rebuilt_dialogue_splitter():
+        app.dialogue_splitter(state, chains=SimpleNamespace(dialogue_splitter=app.dialogue_splitter_chain(llm)))
+
+    def rebuilt_voice_selector():
+        app.llm_voice_selector(characters, VOICES, app.voice_selector_chain(llm))
+
+    nodes = {
+        "character_identifier": (rebuilt_character_identifier, lambda: app.character_identifier(dict(state), chains=chains)),
+        "dialogue_splitter": (rebuilt_dialogue_splitter, lambda: app.dialogue_splitter(state, chains=chains)),
+        "voice_selector": (rebuilt_voice_selector, lambda: app.llm_voice_selector(characters, VOICES, chains.voice_selector)),
+    }
+
+    results = {}
+    with quiet(args.verbose):
+        build_median, _ = measure(lambda: app.PipelineChains(llm), args.calls)
+        for node, (rebuilt, shared) in nodes.items():
+            shared() # warm the LLM cache
+            results[node] = measure(rebuilt, args.calls), measure(shared, args.calls)
+
+    # 3. Report
+    print(f"Building all the chains: {build_median:.0f} us")
+    print()
+    print(f"{'node (median)':<24}{'rebuilt us':>12}{'shared us':>12}{'saved us':>12}")
+    for node, ((rebuilt, _), (shared, _)) in results.items():
+        print(f"{node:<24}{rebuilt:>12.0f}{shared:>12.0f}{rebuilt - shared:>12.0f}")
+
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-invocation overhead of the LLM nodes")
+    parser.add_argument("--calls", type=int, default=100, help="Calls of every node")
+    parser.add_argument("--verbose", action="store_true", help="Show the output of the pipeline")
+    run(parser.parse_args())
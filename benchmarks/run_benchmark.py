@@ -0,0 +1,358 @@
+# Offline benchmark of the Audify pipeline
+'''
+Runs the compiled graph over a corpus of page images with local stand-ins for Gemini,
+ElevenLabs and ffmpeg, and reports the latency of every stage, the throughput in pages per
+minute and the peak RSS. No API key or network access is needed.
+
+Example:
+    python benchmarks/run_benchmark.py --repeat 10 --concurrency 2 --llm-latency 0.8 --tts-latency 0.5
+'''
+import os
+import re
+import sys
+import ast
+import json
+import time
+import random
+import shutil
+import argparse
+import logging
+import resource
+import tempfile
+import threading
+import statistics
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_CORPUS = [os.path.join(REPO_ROOT, "artifacts", "Sample.png")]
+
+# Text returned by the OCR stand-in, one page after the other
+PAGES = [
+    "Artois read my thoughts. “They are talking of the Polignacs,” he said. “My dearest friend,” Max said, "
+    "“you will have to go away.” The candles burned low while the Queen listened from the doorway.",
+    "Alice was beginning to get very tired of sitting by her sister on the bank. “Who are you?” said the "
+    "Caterpillar. “I hardly know, sir,” Alice replied, “just at present.” The Caterpillar looked at her in silence.",
+    "The rain had not stopped since the morning. Max walked along the river and counted the boats, "
+    "thinking of the letter he had not yet answered.",
+    "“Is anybody there?” she asked. Nobody answered. “Then I shall wait,” said the Queen, and she sat down by the fire.",
+]
+
+# Characters the LLM stand-in knows about
+CHARACTERS = {
+    "Artois": {"Gender": "Male", "Age": "Middle aged"},
+    "Max": {"Gender": "Male", "Age": "Young"},
+    "Alice": {"Gender": "Female", "Age": "Young"},
+    "Caterpillar": {"Gender": "Unknown", "Age": "Old"},
+    "Queen": {"Gender": "Female", "Age": "Old"},
+}
+
+# Voice library of the TTS stand-in
+VOICES = [
+    {"voice_id": "fake-narrator", "name": "Narrator", "labels": {"gender": "male", "age": "middle_aged", "use_case": "narration"}, "description": "calm narrator"},
+    {"voice_id": "fake-young-male", "name": "Young Male", "labels": {"gender": "male", "age": "young"}, "description": "bright"},
+    {"voice_id": "fake-old-male", "name": "Old Male", "labels": {"gender": "male", "age": "old"}, "description": "deep"},
+    {"voice_id": "fake-young-female", "name": "Young Female", "labels": {"gender": "female", "age": "young"}, "description": "soft"},
+    {"voice_id": "fake-old-female", "name": "Old Female", "labels": {"gender": "female", "age": "old"}, "description": "warm"},
+]
+
+# One MPEG1 Layer III frame header: 128 kbps, 44.1 kHz, mono
+MP3_HEADER = bytes([0xFF, 0xFB, 0x90, 0xC0])
+MS_PER_CHARACTER = 65 # roughly 15 characters of speech per second
+
+# Stand-in for ffmpeg's concat demuxer, used if the in-process concatenation falls back to ffmpeg
+FAKE_FFMPEG = '''#!/usr/bin/env python3
+import sys
+args = sys.argv[1:]
+with open(args[args.index("-i") + 1]) as f:
+    files = [line.strip()[len("file '"):-1] for line in f if line.strip()]
+with open(args[-1], "wb") as out:
+    for name in files:
+        with open(name, "rb") as clip:
+            out.write(clip.read())
+'''
+
+
+class Latency:
+    '''
+    Simulated latency of a provider: `mean` seconds, +/- `jitter` as a fraction of the mean.
+    '''
+    def __init__(self, mean, jitter, seed):
+        self.mean = mean
+        self.jitter = jitter
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def sleep(self):
+        with self.lock:
+            factor = 1 + self.random.uniform(-self.jitter, self.jitter)
+        time.sleep(max(0.0, self.mean * factor))
+
+
+def text_between(prompt, start, end=None):
+    '''
+    Returns the part of a rendered prompt between two markers.
+    '''
+    text = prompt.split(start, 1)[-1]
+    return text.split(end, 1)[0].strip() if end else text.strip()
+
+
+def make_fake_llm(latency):
+    '''
+    Returns a runnable answering the prompts of the pipeline like Gemini would, after the simulated latency.
+    '''
+    from langchain_core.runnables import RunnableLambda
+    from langchain_core.messages import AIMessage
+    from dialogue_rules import segment_dialogue
+
+    def respond(prompt):
+        prompt = prompt.to_string() if hasattr(prompt, "to_string") else str(prompt)
+        latency.sleep()
+
+        if "Voice Casting Director" in prompt:
+            names = ast.literal_eval(text_between(prompt, "Here is the list of charachters:", "Here is the list of voices:"))
+            content = json.dumps([{"name": name, "assigned_voice_id": VOICES[1 + i % (len(VOICES) - 1)]['voice_id'],
+                                   "casting_justification": "benchmark"} for i, name in enumerate(names)])
+        elif "consecutive pages of a book" in prompt:
+            pages = re.split(r"===== PAGE \d+ =====", text_between(prompt, "Here are the pages which are part of a book.", "Here is the charachter_list:"))[1:]
+            known = text_between(prompt, "Here is the charachter_list:")
+            outputs = []
+            for number, text in enumerate(pages, start=1):
+                text = text.strip()
+                characters = {name: properties for name, properties in CHARACTERS.items() if name in text and name not in known}
+                known += " " + " ".join(characters)
+                outputs.append({"page": number, "corrected_text": text, "characters": characters,
+                                "new_charachter_identifed": "Yes" if characters else "No",
+                                "dialogue": segment_dialogue(text, CHARACTERS)[0]})
+            content = json.dumps({"pages": outputs})
+        elif "Here is the text from a page" in prompt:
+            text = text_between(prompt, "Here is the text from a page which is part of a book.", "Here is the charachter_list:")
+            known = text_between(prompt, "Here is the charachter_list:")
+            characters = {name: properties for name, properties in CHARACTERS.items() if name in text and name not in known}
+            response = {"corrected_text": text, "characters": characters,
+                        "new_charachter_identifed": "Yes" if characters else "No"}
+            if "literary text parser" in prompt:
+                response["dialogue"] = segment_dialogue(text, CHARACTERS)[0]
+            content = json.dumps(response)
+        else:
+            text = text_between(prompt, "Now, process the user's text.")
+            content = json.dumps(segment_dialogue(text, CHARACTERS)[0])
+
+        return AIMessage(content=content, usage_metadata={
+            "input_tokens": len(prompt) // 4, "output_tokens": len(content) // 4, "total_tokens": (len(prompt) + len(content)) // 4,
+        })
+
+    return RunnableLambda(respond)
+
+
+class FakeTextToSpeech:
+    '''
+    Stand-in for client.text_to_speech: returns silent mp3 frames as long as the text would be spoken.
+    '''
+    def __init__(self, latency):
+        from audio_concat import parse_frame_header, silence
+        self.latency = latency
+        self.header = {**parse_frame_header(MP3_HEADER), "raw": MP3_HEADER}
+        self.silence = silence
+
+    def convert(self, text, voice_id, model_id, **kwargs):
+        self.latency.sleep()
+        audio = self.silence(self.header, len(text) * MS_PER_CHARACTER)
+        # Delivered in chunks like the real endpoint
+        return iter([audio[i:i + 4096] for i in range(0, len(audio), 4096)])
+
+    stream = convert
+
+
+class FakeElevenLabs:
+    def __init__(self, latency):
+        self.text_to_speech = FakeTextToSpeech(latency)
+
+
+def fake_ocr(latency, page_index):
+    latency.sleep()
+    return PAGES[page_index % len(PAGES)], {}
+
+
+def load_corpus(paths):
+    '''
+    Returns the page images of the corpus, folders are expanded to the images they contain.
+    '''
+    images = []
+    for path in paths:
+        if os.path.isdir(path):
+            images.extend(os.path.join(path, name) for name in sorted(os.listdir(path))
+                          if name.lower().endswith((".png", ".jpg", ".jpeg")))
+        else:
+            images.append(path)
+    return images
+
+
+def quiet(verbose):
+    '''
+    Hides the progress messages of the pipeline unless verbose.
+    '''
+    return contextlib.nullcontext() if verbose else contextlib.redirect_stdout(open(os.devnull, "w"))
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+def peak_rss_mb():
+    '''
+    Peak resident set size of the benchmark and of its child processes (the OCR workers), in MB.
+    '''
+    self_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    scale = 1 if sys.platform == "darwin" else 1024 # bytes on macOS, KB on Linux
+    return round(self_rss * scale / 2**20, 1), round(children_rss * scale / 2**20, 1)
+
+
+def run_page(app, graph, image_path, page_index, ocr, ocr_latency):
+    '''
+    Runs one page through the OCR and the compiled graph.
+
+    Returns:
+        dict: The seconds spent in every stage, and the total
+    '''
+    import cv2
+    from ocr import image_ocr
+
+    start = time.perf_counter()
+    state = {
+        **app.create_job_workspace(),
+        "default_charachter": VOICES[0]['voice_id'],
+        "voice_list": VOICES,
+        "charachter_list": {},
+        "page_number": [],
+        "speakerXid": {},
+    }
+
+    if ocr == "tesseract":
+        state["ocr_text"], state["ocr_details"] = image_ocr(cv2.imread(image_path), return_details=True)
+    else:
+        state["ocr_text"], state["ocr_details"] = fake_ocr(ocr_latency, page_index)
+    stages = {"image_ocr": time.perf_counter() - start}
+
+    final_state = graph.invoke(state)
+    for node, stats in final_state.get("metrics", {}).items():
+        stages[node] = stats["seconds"]
+    stages["total"] = time.perf_counter() - start
+    return stages
+
+
+def run_benchmark(args):
+    images = load_corpus(args.corpus or DEFAULT_CORPUS)
+    pages = [images[i % len(images)] for i in range(len(images) * args.repeat)]
+
+    # 1. Isolated working directory: fresh caches, job workspaces and checkpoints
+    work_dir = tempfile.mkdtemp(prefix="audify-bench-")
+    os.makedirs(os.path.join(work_dir, "bin"))
+    ffmpeg_path = os.path.join(work_dir, "bin", "ffmpeg")
+    with open(ffmpeg_path, "w") as f:
+        f.write(FAKE_FFMPEG)
+    os.chmod(ffmpeg_path, 0o755)
+    os.environ["PATH"] = os.path.join(work_dir, "bin") + os.pathsep + os.environ["PATH"]
+    os.environ.setdefault("AUDIFY_ELEVENLABS_RPS", str(args.tts_rps))
+    os.chdir(work_dir)
+    sys.path.insert(0, REPO_ROOT)
+
+    # 2. Import the pipeline and replace its clients with the stand-ins, no secret is needed
+    import_start = time.perf_counter()
+    with quiet(args.verbose):
+        import app
+        import clients
+        from metrics import registry
+    import_seconds = time.perf_counter() - import_start
+    if not args.verbose:
+        logging.getLogger("audify.metrics").setLevel(logging.WARNING)
+
+    clients.set_llm(make_fake_llm(Latency(args.llm_latency, args.jitter, args.seed)))
+    clients.set_tts_client(FakeElevenLabs(Latency(args.tts_latency, args.jitter, args.seed + 1)))
+    app.TTS_MAX_WORKERS = args.tts_workers
+    ocr = args.ocr if args.ocr != "auto" else ("tesseract" if shutil.which("tesseract") else "fake")
+    ocr_latency = Latency(args.ocr_latency, args.jitter, args.seed + 2)
+    graph = app.build_workflow(combined=args.combined, stream_dialogue=not args.no_stream).compile()
+
+    def run_all():
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            futures = [executor.submit(run_page, app, graph, image, i, ocr, ocr_latency) for i, image in enumerate(pages)]
+            return [future.result() for future in futures]
+
+    # 3. Optional warm up, so the measured run hits the LLM and clip caches
+    with quiet(args.verbose):
+        if args.warm:
+            run_all()
+        start = time.perf_counter()
+        results = run_all()
+        elapsed = time.perf_counter() - start
+
+    # 4. Report
+    stages = {}
+    for result in results:
+        for stage, seconds in result.items():
+            stages.setdefault(stage, []).append(seconds)
+
+    report = {
+        "pages": len(pages),
+        "ocr": ocr,
+        "import_seconds": round(import_seconds, 3),
+        "elapsed_seconds": round(elapsed, 3),
+        "pages_per_minute": round(len(pages) / elapsed * 60, 2),
+        "peak_rss_mb": dict(zip(("self", "children"), peak_rss_mb())),
+        "stages": {stage: {
+            "calls": len(values),
+            "mean_ms": round(statistics.mean(values) * 1000, 1),
+            "p50_ms": round(percentile(values, 0.5) * 1000, 1),
+            "p95_ms": round(percentile(values, 0.95) * 1000, 1),
+        } for stage, values in stages.items()},
+        "totals": registry.snapshot(),
+    }
+
+    if not args.keep:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return report
+
+
+def print_report(report):
+    print(f"Pages: {report['pages']} (OCR: {report['ocr']})")
+    print(f"Import of app.py: {report['import_seconds']:.3f} s")
+    print(f"Elapsed: {report['elapsed_seconds']:.3f} s, {report['pages_per_minute']} pages/min")
+    print(f"Peak RSS: {report['peak_rss_mb']['self']} MB (OCR workers: {report['peak_rss_mb']['children']} MB)")
+    print()
+    print(f"{'stage':<24}{'calls':>7}{'mean ms':>11}{'p50 ms':>11}{'p95 ms':>11}")
+    for stage, stats in report['stages'].items():
+        print(f"{stage:<24}{stats['calls']:>7}{stats['mean_ms']:>11}{stats['p50_ms']:>11}{stats['p95_ms']:>11}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline benchmark of the Audify pipeline")
+    parser.add_argument("corpus", nargs="*", help="Page images or folders of page images (default: artifacts/Sample.png)")
+    parser.add_argument("--repeat", type=int, default=4, help="Number of times the corpus is processed")
+    parser.add_argument("--concurrency", type=int, default=1, help="Pages processed at the same time")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="Seconds per LLM call")
+    parser.add_argument("--tts-latency", type=float, default=0.3, help="Seconds per TTS call")
+    parser.add_argument("--ocr-latency", type=float, default=0.2, help="Seconds per page of the OCR stand-in")
+    parser.add_argument("--jitter", type=float, default=0.2, help="Latency jitter, as a fraction of the latency")
+    parser.add_argument("--tts-workers", type=int, default=3, help="TTS requests in flight per page")
+    parser.add_argument("--tts-rps", type=float, default=0, help="TTS requests per second, 0 for no limit")
+    parser.add_argument("--ocr", choices=("auto", "tesseract", "fake"), default="auto",
+                        help="Use tesseract on the page images, or the OCR stand-in (auto: tesseract if installed)")
+    parser.add_argument("--combined", action="store_true", help="Single LLM call for characters and dialogue")
+    parser.add_argument("--no-stream", action="store_true", help="Do not stream the dialogue splitter into TTS")
+    parser.add_argument("--warm", action="store_true", help="Process the corpus once before measuring (warm caches)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Also write the report to this file")
+    parser.add_argument("--keep", action="store_true", help="Keep the working directory")
+    parser.add_argument("--verbose", action="store_true", help="Show the output of the pipeline")
+    args = parser.parse_args()
+
+    json_path = os.path.abspath(args.json) if args.json else None
+    args.corpus = [os.path.abspath(path) for path in args.corpus]
+    report = run_benchmark(args)
+    print_report(report)
+    if json_path:
+        with open(json_path, "w") as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,152 @@
+# Multi-page book mode
+import os
+import re
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+from ocr import image_ocr_batch
+from metrics import trace_node, traced_node, add_stats, submit_traced
+from scheduler import BULK, priority
+from app import (LLM_BATCH_PAGES, voice_generator, voice_selector, mp3_combine, get_compiled_text_graph,
+                 get_chains, character_dialogue_identifier_batch)
+
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+# Load the pages of a book
+def load_book_pages(source):
+    '''
+    Returns the ordered list of pages of a book. The images of a directory are not read here,
+    the OCR workers read each page when its turn comes.
+
+    Args:
+        source: A directory of page images (sorted by the page number in the file name) or a list of images
+
+    Returns:
+        list: The paths of the page images, or the given images
+    '''
+    if not isinstance(source, (str, os.PathLike)):
+        return list(source)
+
+    def get_pagenumber(filename):
+        # Extracts numbers from a string like "page_12.png" -> 12
+        s = re.search(r'\d+', filename)
+        return int(s.group()) if s else -1
+
+    files = [f for f in os.listdir(source) if f.lower().endswith(IMAGE_EXTENSIONS)]
+    files.sort(key=lambda f: (get_pagenumber(f), f))
+
+    return [os.path.join(source, f) for f in files]
+
+
+# Audio stage of a single page
+def render_page_audio(state, page_dir):
+    '''
+    Runs the voice generator and the audio combiner for one page, writing into the page folder.
+    Their stats are added to the metrics of the page.
+    '''
+    state = dict(state)
+    state['output_path'] = os.path.join(page_dir, "audio_clips")
+    state['final_audio_path'] = os.path.join(page_dir, "page.mp3")
+    state.update(traced_node("voice_generator", voice_generator)(state))
+    state.update(traced_node("mp3_combine", mp3_combine)(state))
+    return state
+
+
+# Text stages of a batch of pages
+def process_page_batch(batch, page_states):
+    '''
+    Runs the text stages of several pages with a single LLM request (see
+    character_dialogue_identifier_batch), then the voice selector of the pages with new characters.
+
+    Args:
+        batch: The (ocr_text, ocr_details) of the pages
+        page_states: The input state of every page, the state of the first page carries the
+                     characters and voices known before the batch
+
+    Yields:
+        dict: The final text state of every page, in order
+    '''
+    chains = get_chains()
+    charachter_list = page_states[0]['charachter_list']
+    speakerXid = page_states[0]['speakerXid']
+
+    with trace_node("character_identifier") as trace:
+        updates = character_dialogue_identifier_batch([ocr_text for ocr_text, _ in batch], charachter_list, chains=chains)
+
+    for i, (state, update) in enumerate(zip(page_states, updates)):
+        # The batch call is accounted to the first page
+        state = {**state, **update, "speakerXid": dict(speakerXid),
+                 "metrics": add_stats({}, "character_identifier", trace.stats) if i == 0 else {}}
+        if update['new_charachter_identified'] == "Yes":
+            state.update(traced_node("voice_selector", voice_selector)(state, chains=chains))
+        speakerXid = state.get('speakerXid', {})
+        yield state
+
+
+# Book level entry point
+def process_book(source, default_charachter, voice_list, output_dir="book_output",
+                 charachter_list=None, speakerXid=None, ocr_workers=None, batch_pages=LLM_BATCH_PAGES, **ocr_options):
+    '''
+    Converts a whole book into audio, one page after the other, as a three stage pipeline:
+    OCR of page N+1 runs while page N is in the LLM stages and page N-1 is in TTS.
+    The LLM stages run in page order so that charachter_list and speakerXid are carried
+    forward from one page to the next. With batch_pages > 1 they run on batch_pages pages at a
+    time, with a single LLM request per batch. The API calls of a book run in the bulk lane, so
+    interactive pages go first.
+
+    Args:
+        source: A directory of page images or an ordered list of images
+        default_charachter: Voice id of the narrator
+        voice_list: The voices from get_voices()
+        output_dir: Folder where the audio of every page is written
+        charachter_list: Characters already known from earlier pages
+        speakerXid: Voices already assigned to characters
+        ocr_workers: Number of OCR processes, defaults to the CPU count
+        batch_pages: Pages sent to the LLM in a single request, 1 runs the text graph page by page
+        ocr_options: Preprocessing options passed to image_ocr (deskew, binarize)
+
+    Returns:
+        list: The final state of every page, in page order
+    '''
+    pages = load_book_pages(source)
+    print(f"Processing a book of {len(pages)} pages")
+
+    text_graph = get_compiled_text_graph()
+    charachter_list = dict(charachter_list or {})
+    speakerXid = dict(speakerXid or {})
+
+    with priority(BULK), ThreadPoolExecutor(max_workers=1) as audio_executor:
+        # 1. OCR runs a few pages ahead of the LLM stages on a process pool, pages come back in order
+        ocr_results = image_ocr_batch(pages, max_workers=ocr_workers, return_details=True, **ocr_options)
+
+        # 2. LLM stages in page order, each page is handed to the audio stage as soon as it is done
+        audio_futures = []
+        ocr_results = enumerate(ocr_results, start=1)
+        while batch := list(islice(ocr_results, max(batch_pages, 1))):
+            print(f"--- Page {batch[0][0]}" + (f" to {batch[-1][0]}" if len(batch) > 1 else "") + " ---")
+            page_states = [{
+                "default_charachter": default_charachter,
+                "ocr_text": ocr_text,
+                "ocr_details": ocr_details,
+                "voice_list": voice_list,
+                "charachter_list": dict(charachter_list),
+                "page_number": [page_number],
+                "speakerXid": dict(speakerXid),
+            } for page_number, (ocr_text, ocr_details) in batch]
+
+            if len(batch) > 1:
+                page_states = process_page_batch([result for _, result in batch], page_states)
+            else:
+                page_states = [text_graph.invoke(page_states[0])]
+
+            for page_state in page_states:
+                # Carry the characters and their voices forward
+                charachter_list = dict(page_state['charachter_list'])
+                speakerXid = dict(page_state.get('speakerXid', {}))
+
+                page_dir = os.path.join(output_dir, f"page_{page_state['page_number'][0]}")
+                audio_futures.append(submit_traced(audio_executor, render_page_audio, page_state, page_dir))
+
+        # 3. Wait for the audio of every page
+        return [future.result() for future in audio_futures]
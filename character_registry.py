@@ -0,0 +1,239 @@
+# Registry of the characters of a book, with their aliases
+import re
+
+
+# Titles ignored when matching a name to a character
+TITLES = {"mr", "mrs", "ms", "miss", "dr", "sir", "madam", "madame", "monsieur", "mademoiselle", "the"}
+
+# Properties sent to the LLM in the digest, the others are only used for casting
+DIGEST_PROPERTIES = ("gender", "age")
+MIN_ALIAS_LENGTH = 3
+
+# Words of the page text saying that two names are the same character, e.g. "Maximilian, called Max"
+NAMING_CUES = re.compile(r"\b(?:called|calls|call|known as|nicknamed|named|alias|short for)\b", re.IGNORECASE)
+
+
+def name_parts(name):
+    '''
+    Returns the lower case words of a name, without the titles.
+    '''
+    return [part for part in re.findall(r"[\w'\-]+", name.lower()) if part not in TITLES]
+
+
+def name_titles(name):
+    '''
+    Returns the titles of a name, e.g. {"mrs"} for "Mrs. Bennet".
+    '''
+    return {part for part in re.findall(r"[\w'\-]+", name.lower()) if part in TITLES - {"the"}}
+
+
+def get_property(properties, key):
+    for name, value in (properties or {}).items():
+        if name.lower() == key:
+            return value
+    return None
+
+
+def names_linked(text, name, other):
+    '''
+    True when a sentence of the text names both and says they are the same, e.g.
+    "Maximilian, whom everyone called Max, ...".
+    '''
+    for sentence in re.split(r"(?<=[.!?])\s+", text or ""):
+        if NAMING_CUES.search(sentence) and all(re.search(rf"\b{re.escape(n)}\b", sentence, re.IGNORECASE) for n in (name, other)):
+            return True
+    return False
+
+
+class CharacterRegistry:
+    '''
+    The characters of a book under their canonical names. Every character has an `aliases`
+    property with the other names it was found under ("max", "Maximilian" ...), so the name
+    variants of a character share one entry and one voice.
+
+    Args:
+        characters: The charachter_list of the state, name -> properties
+    '''
+    def __init__(self, characters=None):
+        self.characters = {name: dict(properties or {}) for name, properties in (characters or {}).items()}
+        self.index = {} # lower case name or alias -> canonical name
+        self.untitled = {} # name or alias without its titles -> [(titles, canonical name)]
+        self.first_names = {} # first name of a name or alias of several words -> [(titles, canonical name)]
+        for name in self.characters:
+            self._index(name)
+
+    def aliases(self, name):
+        return list(self.characters[name].get('aliases') or [])
+
+    def _index(self, name):
+        for alias in [name] + self.aliases(name):
+            self.index[alias.lower()] = name
+            parts = name_parts(alias)
+            entry = (name_titles(alias), name)
+            entries = self.untitled.setdefault(" ".join(parts), [])
+            if entry not in entries:
+                entries.append(entry)
+            # The last word is the surname, it is shared by a family and never names a character alone
+            for part in parts[:-1]:
+                entries = self.first_names.setdefault(part, [])
+                if entry not in entries:
+                    entries.append(entry)
+
+    def _matching(self, entries, titles, gender=None):
+        '''
+        The characters of the (titles, canonical name) entries whose titles and gender agree with the name.
+        '''
+        candidates = set()
+        for alias_titles, canonical in entries or []:
+            known_gender = get_property(self.characters[canonical], "gender")
+            if titles and alias_titles and titles != alias_titles:
+                continue
+            if gender and known_gender and str(gender).lower() != str(known_gender).lower():
+                continue
+            candidates.add(canonical)
+        return candidates
+
+    def resolve(self, name, gender=None):
+        '''
+        Returns the canonical name of a name or a known alias, or None for an unknown character.
+        A name also matches a character without its titles ("Darcy" for "Mr. Darcy"), and a first
+        name on its own matches the character of that first name ("Elizabeth" for "Elizabeth
+        Bennet"), when the titles and the gender agree ("Mrs. Bennet" is not "Mr. Bennet") and only
+        one character matches. A surname alone never does, "Bennet" may be any of the family.
+
+        Args:
+            name: The name found on a page
+            gender: The gender of the character with that name, when it is known
+        '''
+        if not name:
+            return None
+        lowered = name.strip().lower()
+        if lowered in self.index:
+            return self.index[lowered]
+        parts = name_parts(name)
+        if not parts:
+            return None
+
+        titles = name_titles(name)
+        candidates = self._matching(self.untitled.get(" ".join(parts)), titles, gender)
+        if not candidates and len(parts) == 1:
+            candidates = self._matching(self.first_names.get(parts[0]), titles, gender)
+        return candidates.pop() if len(candidates) == 1 else None
+
+    def alias_map(self):
+        '''
+        Maps every lower case name resolve accepts on its own to its canonical name: the names and
+        aliases, and the names without their titles and the first names that fit only one character.
+        This is the one alias policy of the app, the dialogue rules match the speakers with it too.
+        '''
+        aliases = dict(self.index)
+        for index in (self.untitled, self.first_names):
+            for key, entries in index.items():
+                names = {canonical for _, canonical in entries}
+                if len(names) == 1 and len(key) >= MIN_ALIAS_LENGTH:
+                    aliases.setdefault(key, names.pop())
+        return aliases
+
+    def short_form_of(self, name):
+        '''
+        Returns the only character whose name or alias has the name as a short form or the other
+        way round ("Max" and "Maximilian"), or None. Only the first names are compared, a shared
+        surname is not enough.
+        '''
+        parts = name_parts(name)
+        if len(parts) != 1 or len(parts[0]) < MIN_ALIAS_LENGTH:
+            return None
+        candidates = set()
+        for alias, canonical in self.index.items():
+            alias_parts = name_parts(alias)
+            if alias_parts and len(alias_parts[0]) >= MIN_ALIAS_LENGTH and alias_parts[0] != parts[0] \
+                    and (alias_parts[0].startswith(parts[0]) or parts[0].startswith(alias_parts[0])):
+                candidates.add(canonical)
+        return candidates.pop() if len(candidates) == 1 else None
+
+    def same_as(self, name, properties, text=None):
+        '''
+        Returns the known character the LLM or the page text says the name is another name of: the
+        LLM gives its name in an alias_of property, or the text links the name to a short form of it.
+        '''
+        alias_of = get_property(properties, "alias_of")
+        if alias_of:
+            return self.resolve(str(alias_of))
+        canonical = self.short_form_of(name)
+        if canonical is not None and text and any(names_linked(text, name, alias)
+                                                  for alias in [canonical] + self.aliases(canonical)):
+            return canonical
+        return None
+
+    def merge(self, characters, text=None):
+        '''
+        Adds the characters found on a page. A name variant of a known character becomes one of its
+        aliases, and only fills the properties the character does not have yet.
+
+        Args:
+            characters: The characters found by the LLM, name -> properties
+            text: The text of the page, a short form of a name is only merged when the text says so
+
+        Returns:
+            list: The canonical names of the characters that were not known before
+        '''
+        new_names = []
+        for name, properties in (characters or {}).items():
+            properties = {key: value for key, value in (properties or {}).items() if key.lower() != "alias_of"}
+            canonical = self.resolve(name, get_property(properties, "gender")) or self.same_as(name, (characters or {})[name], text)
+
+            # Two characters with different genders are never merged
+            if canonical is not None:
+                gender, known_gender = get_property(properties, "gender"), get_property(self.characters[canonical], "gender")
+                if gender and known_gender and str(gender).lower() != str(known_gender).lower() and name.lower() != canonical.lower():
+                    canonical = None
+
+            if canonical is None:
+                self.characters[name] = properties
+                new_names.append(name)
+            else:
+                known = self.characters[canonical]
+                for key, value in properties.items():
+                    if key != 'aliases' and get_property(known, key.lower()) in (None, "", "Unknown"):
+                        known[key] = value
+                aliases = self.aliases(canonical)
+                for alias in [name] + list(properties.get('aliases') or []):
+                    if alias != canonical and alias not in aliases:
+                        aliases.append(alias)
+                known['aliases'] = aliases
+                name = canonical
+            self._index(name)
+        return new_names
+
+    def mentioned_in(self, text):
+        '''
+        Returns the canonical names of the characters whose name or alias appears in the text.
+        '''
+        words = set(re.findall(r"[\w'\-]+", text.lower()))
+        mentioned = []
+        for name in self.characters:
+            for alias in [name] + self.aliases(name):
+                parts = [part for part in name_parts(alias) if len(part) >= MIN_ALIAS_LENGTH]
+                if parts and any(part in words for part in parts):
+                    mentioned.append(name)
+                    break
+        return mentioned
+
+    def digest(self, text):
+        '''
+        Compact description of the characters mentioned in the text, sent to the LLM instead of the
+        whole character list so the prompt does not grow with the book.
+        '''
+        lines = []
+        for name in self.mentioned_in(text):
+            properties = self.characters[name]
+            details = [f"{key}: {value}" for key, value in properties.items()
+                       if key.lower() in DIGEST_PROPERTIES and value not in (None, "")]
+            aliases = self.aliases(name)
+            if aliases:
+                details.append(f"also called {', '.join(aliases)}")
+            lines.append(f"- {name}" + (f" ({'; '.join(details)})" if details else ""))
+        return "\n".join(lines) if lines else "None"
+
+    def to_dict(self):
+        return {name: dict(properties) for name, properties in self.characters.items()}
@@ -0,0 +1,99 @@
+# API clients, created lazily on first use
+import os
+import sys
+import threading
+
+
+LLM_MODEL = "gemini-2.5-flash"
+
+# Environment variable read before the Streamlit secrets, for every secret
+SECRET_ENV_VARS = {
+    "eleven_labs": "ELEVENLABS_API_KEY",
+    "google_gemini": "GOOGLE_API_KEY",
+}
+SECRETS_FILES = (
+    os.path.join(".streamlit", "secrets.toml"),
+    os.path.join(os.path.expanduser("~"), ".streamlit", "secrets.toml"),
+)
+
+_clients = {}
+_lock = threading.Lock()
+
+
+def get_secret(name):
+    '''
+    Returns a secret from its environment variable, then from the Streamlit secrets. Outside of
+    the Streamlit app (e.g. in the workers) the secrets file is read without importing Streamlit.
+
+    Args:
+        name: Name of the secret in secrets.toml, e.g. eleven_labs or google_gemini
+    '''
+    env_var = SECRET_ENV_VARS.get(name)
+    if env_var and os.environ.get(env_var):
+        return os.environ[env_var]
+
+    # 1. Running in the Streamlit app
+    if "streamlit" in sys.modules:
+        import streamlit as st
+        try:
+            return st.secrets[name]
+        except (KeyError, FileNotFoundError):
+            pass
+
+    # 2. Reading the secrets file directly, tomllib is in the standard library from Python 3.11
+    try:
+        import tomllib
+    except ImportError:
+        import tomli as tomllib
+    for path in SECRETS_FILES:
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                secrets = tomllib.load(f)
+            if name in secrets:
+                return secrets[name]
+
+    raise KeyError(f"Secret {name} not found, set {env_var} or add it to .streamlit/secrets.toml")
+
+
+def _get_or_create(name, factory):
+    with _lock:
+        if name not in _clients:
+            _clients[name] = factory()
+        return _clients[name]
+
+
+def get_llm():
+    '''
+    Returns the Gemini chat model, created on first use.
+    '''
+    def create():
+        from langchain_google_genai import ChatGoogleGenerativeAI
+        # Retries are left to the scheduler (scheduler.py), which shares the quota between the workers
+        return ChatGoogleGenerativeAI(model=LLM_MODEL, temperature=0, google_api_key=get_secret("google_gemini"), max_retries=1)
+    return _get_or_create("llm", create)
+
+
+def get_tts_client():
+    '''
+    Returns the ElevenLabs client, created on first use.
+    '''
+    def create():
+        from elevenlabs.client import ElevenLabs
+        return ElevenLabs(api_key=get_secret("eleven_labs"))
+    return _get_or_create("tts", create)
+
+
+def set_llm(llm):
+    '''
+    Replaces the LLM used by the pipeline, e.g. with a local stand-in in the benchmark.
+    '''
+    with _lock:
+        _clients["llm"] = llm
+
+
+def set_tts_client(client):
+    '''
+    Replaces the TTS client used by the pipeline, e.g. with a local stand-in in the benchmark.
+    '''
+    with _lock:
+        _clients["tts"] = client
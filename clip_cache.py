@@ -0,0 +1,125 @@
+# On-disk cache of synthesized TTS clips
+import os
+import re
+import json
+import uuid
+import hashlib
+import threading
+
+
+# Default location and size of the clip cache
+CLIP_CACHE_DIR = os.environ.get("AUDIFY_CLIP_CACHE_DIR", os.path.join(".audify_cache", "clips"))
+CLIP_CACHE_MAX_BYTES = int(os.environ.get("AUDIFY_CLIP_CACHE_MAX_MB", 500)) * 1024 * 1024
+
+
+def normalize_text(text):
+    '''
+    Normalizes a segment before hashing so that whitespace differences do not create new cache entries.
+    '''
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+def clip_key(text, voice_id, model_id, settings=None):
+    '''
+    Builds the content address of a clip.
+
+    Args:
+        text: The text that is synthesized
+        voice_id: The ElevenLabs voice id
+        model_id: The ElevenLabs model id
+        settings: Optional dict of voice settings / output format
+
+    Returns:
+        str: sha256 hex digest of the normalized inputs
+    '''
+    payload = json.dumps({
+        "text": normalize_text(text),
+        "voice_id": voice_id,
+        "model_id": model_id,
+        "settings": settings or {},
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ClipCache:
+    '''
+    Content addressed store of mp3 clips. Each clip is a file named after its key, the file
+    modification time is used as the last access time and the least recently used clips are
+    evicted once the total size goes above `max_bytes`.
+    '''
+    def __init__(self, cache_dir=CLIP_CACHE_DIR, max_bytes=CLIP_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.total_bytes = None # computed lazily from the directory
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.mp3")
+
+    def get(self, key):
+        '''
+        Returns the clip bytes for the key, or None on a miss.
+        '''
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        # Mark as recently used
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return data
+
+    def put(self, key, data):
+        '''
+        Stores the clip bytes for the key and evicts old clips if the cache is too big.
+        '''
+        path = self._path(key)
+        # Unique per call, so the processes sharing the cache never write to the same temp file
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        # Only scan the directory when the running total says the cache may be full
+        with self.lock:
+            if self.total_bytes is not None:
+                self.total_bytes += len(data)
+            needs_eviction = self.total_bytes is None or self.total_bytes > self.max_bytes
+        if needs_eviction:
+            self.evict()
+
+    def evict(self):
+        '''
+        Removes the least recently used clips until the cache fits in `max_bytes`.
+        '''
+        with self.lock:
+            entries = []
+            total = 0
+            for name in os.listdir(self.cache_dir):
+                if not name.endswith(".mp3"):
+                    continue
+                path = os.path.join(self.cache_dir, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+
+            if total > self.max_bytes:
+                entries.sort()
+                for _, size, path in entries:
+                    if total <= self.max_bytes:
+                        break
+                    try:
+                        os.remove(path)
+                        total -= size
+                    except FileNotFoundError:
+                        pass
+
+            self.total_bytes = total
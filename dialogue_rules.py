@@ -0,0 +1,180 @@
+# Rule based dialogue segmenter, the fast path of the dialogue splitter
+import re
+from character_registry import CharacterRegistry
+
+
+# Verbs of attribution tags like ", Max said." or "said Max."
+SPEECH_VERBS = (
+    "said", "says", "asked", "asks", "replied", "replies", "answered", "cried", "shouted", "whispered",
+    "exclaimed", "muttered", "murmured", "called", "added", "continued", "began", "remarked", "observed",
+    "yelled", "sighed", "laughed", "returned", "inquired", "demanded", "told", "went on", "repeated",
+)
+PRONOUNS = {"he": "male", "she": "female"}
+
+# Confidence of every way a speaker can be found
+NAMED_TAG = 1.0
+CONTINUED = 0.95
+PRONOUN_WITH_GENDER = 0.9
+PRONOUN_BY_RECENCY = 0.7
+UNLISTED_NAME = 0.6
+NO_TAG = 0.3
+
+_VERBS = r"(?i:" + "|".join(SPEECH_VERBS) + r")"
+_THE = r"(?i:the\s+)?"
+_NAME = r"[A-Za-z][\w'\-]*(?:\s+[A-Z][\w'\-]*)*"
+# Tags right after a dialogue: "Max said", "the King said" or "said Max"
+TAG_AFTER = [
+    re.compile(rf"^\s*[,.!?]?\s*{_THE}(?P<who>{_NAME})\s+{_VERBS}\b"),
+    re.compile(rf"^\s*[,.!?]?\s*{_VERBS}\s+{_THE}(?P<who>{_NAME})"),
+]
+# Tag right before a dialogue: "Max said:" or "Max said,"
+TAG_BEFORE = re.compile(rf"{_THE}(?P<who>{_NAME})\s+{_VERBS}\s*[:,]?\s*$")
+# Tag narration between two parts of the same line: ", he said, "
+SHORT_TAG = re.compile(rf"^\s*[,.!?]?\s*(?:{_THE}{_NAME}\s+{_VERBS}|{_VERBS}\s+{_THE}{_NAME})\s*,\s*$")
+
+QUOTE_PAIRS = {'“': '”', '"': '"'}
+# Other quotation marks (single quotes, OCR'd '' and guillemets) are left to the LLM, a single quote
+# can't be told from an apostrophe
+OTHER_QUOTES = re.compile(r"[‘«»„‹›]|''|``|(?:^|\s)'(?=\w)")
+
+
+def split_quotes(text):
+    '''
+    Splits the text into (is_dialogue, text) pieces following the quotation marks.
+
+    Returns:
+        list: The pieces in order, or None when the quotation marks are not balanced
+    '''
+    pieces = []
+    position = 0
+    while position < len(text):
+        start = min((i for i in (text.find(q, position) for q in QUOTE_PAIRS) if i != -1), default=-1)
+        if start == -1:
+            pieces.append((False, text[position:]))
+            break
+        end = text.find(QUOTE_PAIRS[text[start]], start + 1)
+        if end == -1 or '“' in text[start + 1:end]:
+            return None
+        pieces.append((False, text[position:start]))
+        pieces.append((True, text[start + 1:end]))
+        position = end + 1
+    if '”' in "".join(piece for is_dialogue, piece in pieces if not is_dialogue):
+        return None
+    return [(is_dialogue, piece.strip()) for is_dialogue, piece in pieces if piece.strip()]
+
+
+def build_aliases(charachter_list):
+    '''
+    Maps every lower case name, alias, name without its titles and unambiguous first name to the
+    character name, with the same policy as the character registry (a surname alone is not a name).
+    '''
+    return CharacterRegistry(charachter_list).alias_map()
+
+
+def character_gender(properties):
+    if not isinstance(properties, dict):
+        return None
+    for key, value in properties.items():
+        if key.lower() == 'gender' and value:
+            value = str(value).lower()
+            return "female" if value.startswith(("f", "w", "g")) else "male" if value.startswith(("m", "b")) else None
+    return None
+
+
+class DialogueSegmenter:
+    '''
+    Splits a page into narration and dialogue with the same rules as the dialogue splitter prompt:
+    text outside quotes is Narrator, quoted text is dialogue, attribution tags name the speaker and
+    pronouns resolve to the most recently mentioned character.
+    '''
+    def __init__(self, charachter_list):
+        self.charachter_list = charachter_list or {}
+        self.aliases = build_aliases(self.charachter_list)
+        self.alias_pattern = None
+        if self.aliases:
+            names = sorted(self.aliases, key=len, reverse=True)
+            self.alias_pattern = re.compile(r"\b(" + "|".join(re.escape(n) for n in names) + r")\b", re.IGNORECASE)
+        self.mentions = [] # characters in the order they are mentioned
+
+    def note_mentions(self, text):
+        if self.alias_pattern:
+            self.mentions.extend(self.aliases[m.lower()] for m in self.alias_pattern.findall(text))
+
+    def resolve(self, who):
+        '''
+        Returns (speaker, confidence) for the name or pronoun of an attribution tag.
+        '''
+        lowered = who.lower()
+        if lowered in self.aliases:
+            return self.aliases[lowered], NAMED_TAG
+        if lowered in PRONOUNS:
+            gender = PRONOUNS[lowered]
+            for name in reversed(self.mentions):
+                if character_gender(self.charachter_list.get(name)) == gender:
+                    return name, PRONOUN_WITH_GENDER
+            if self.mentions:
+                return self.mentions[-1], PRONOUN_BY_RECENCY
+            return "Unknown Speaker", NO_TAG
+        if who[0].isupper() and lowered not in ("i", "you", "they", "we", "it"):
+            return who, UNLISTED_NAME
+        return "Unknown Speaker", NO_TAG
+
+    def segment(self, text):
+        '''
+        Returns:
+            segments: List of {speaker, text} dicts
+            confidence: The lowest confidence of all the speakers found, 1.0 for pages without dialogue,
+                0.0 for pages with quotation marks the rules do not handle
+        '''
+        pieces = split_quotes(text)
+        if pieces is None or OTHER_QUOTES.search(text):
+            return [], 0.0
+
+        segments = []
+        confidence = 1.0
+        last_speaker = None
+        for i, (is_dialogue, piece) in enumerate(pieces):
+            if not is_dialogue:
+                segments.append({"speaker": "Narrator", "text": piece})
+                self.note_mentions(piece)
+                continue
+
+            before = pieces[i - 1][1] if i > 0 and not pieces[i - 1][0] else None
+            after = pieces[i + 1][1] if i + 1 < len(pieces) and not pieces[i + 1][0] else None
+            tag_after = next((m for m in (tag.match(after) for tag in TAG_AFTER) if m), None) if after is not None else None
+            tag_before = TAG_BEFORE.search(before) if before is not None else None
+            speaker, score = None, NO_TAG
+
+            if before is not None and last_speaker and SHORT_TAG.match(before):
+                # “Hello,” he said, “how are you?”
+                speaker, score = last_speaker, CONTINUED
+            elif tag_after:
+                speaker, score = self.resolve(tag_after.group('who'))
+            elif tag_before:
+                speaker, score = self.resolve(tag_before.group('who'))
+
+            if speaker is None:
+                speaker = "Unknown Speaker"
+            confidence = min(confidence, score)
+            last_speaker = speaker
+            if speaker in self.charachter_list:
+                self.mentions.append(speaker)
+
+            segments.append({"speaker": speaker, "text": piece.rstrip(',').strip()})
+
+        return segments, confidence
+
+
+def segment_dialogue(text, charachter_list=None):
+    '''
+    Rule based dialogue splitter.
+
+    Args:
+        text: The corrected text of the page
+        charachter_list: The known characters and their properties
+
+    Returns:
+        segments: List of {speaker, text} dicts
+        confidence: 0 to 1, how sure the rules are about every speaker
+    '''
+    return DialogueSegmenter(charachter_list).segment(text)
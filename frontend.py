@@ -4,7 +4,13 @@ import numpy as np
 import cv2
 import os
 import base64
+import time
 from app import *
+from ocr import image_ocr
+from workspace import create_job_workspace
+from audio_concat import mp3_duration
+from job_queue import JobQueue, JobWorkerPool
+from metrics import registry, trace_node, traced_node, add_stats, start_metrics_server
 
 #website url
 website_url = "https://vishwajeetsawant.lovable.app"
@@ -50,10 +56,28 @@ if 'final_audio_path' not in st.session_state:
     st.session_state.final_audio_path = None
 if 'final_state_data' not in st.session_state:
     st.session_state.final_state_data = None
+if 'job_id' not in st.session_state:
+    # Resume a background job after a reconnect
+    st.session_state.job_id = st.query_params.get("job")
 
-# Get the compiled LangGraph app and voice data (cached for performance)
-app = get_compiled_graph()
-voice_data = get_voices()
+
+# Job queue and its workers, shared by all the sessions of the process
+@st.cache_resource
+def get_job_queue():
+    queue = JobQueue()
+    JobWorkerPool(queue).start()
+    return queue
+
+# Prometheus endpoint, served once per process when AUDIFY_METRICS_PORT is set
+@st.cache_resource
+def get_metrics_server():
+    return start_metrics_server()
+
+get_metrics_server()
+
+# Get the voice data (cached for performance)
+voice_catalog = get_voice_catalog()
+voice_data = voice_catalog.voices()
 
 # HELPER FUNCTION to read an image file and convert it to a Base64 Data URL
 def get_image_as_base64(path):
@@ -161,7 +185,7 @@ for row in rows:
 
 if selected_character:
     st.success(f"You have selected: **{selected_character}**")
-    selected_character_id = get_voice_id_by_name(selected_character, voice_data)
+    selected_character_id = get_voice_id_by_name(selected_character, voice_catalog)
     
 st.markdown("---")
 
@@ -209,29 +233,84 @@ with col1:
 
 with col2:
     if uploaded_file is not None:
+        stream_audio = st.toggle("Play the audio while it is being generated", value=True,
+                                 help="When off, the audiobook is generated in the background and you can come back to it later.")
         if st.button("Generate Audiobook", type="primary", width='stretch'):
-            with st.spinner("🚀 The AI agents are at work... This may take a few minutes."):
-                # Process image
-                file_bytes = np.asarray(bytearray(uploaded_file.read()), dtype=np.uint8)
-                image = cv2.imdecode(file_bytes, 1)
-                ocr_data = image_ocr(image)
-
-                # Create initial state
-                initial_state = {
-                    "default_charachter": selected_character_id,
-                    "ocr_text": ocr_data,
-                    "voice_list": voice_data,
-                    "charachter_list": {},  
-                    "page_number": [],
-                    "speakerXid": {},
-                }
-                
-                # Run the workflow
-                final_state = app.invoke(initial_state)
-
-                # Store results in session state
-                st.session_state.final_state_data = final_state
-                st.session_state.final_audio_path = final_state.get("final_audio_path")
+            # Create initial state, every job writes into its own workspace
+            initial_state = {
+                **create_job_workspace(),
+                "default_charachter": selected_character_id,
+                "voice_list": voice_data,
+                "charachter_list": {},  
+                "page_number": [],
+                "speakerXid": {},
+            }
+
+            if stream_audio:
+                with st.spinner("🚀 The AI agents are at work... This may take a few minutes."):
+                    # Process image
+                    file_bytes = np.asarray(bytearray(uploaded_file.read()), dtype=np.uint8)
+                    image = cv2.imdecode(file_bytes, 1)
+                    initial_state["ocr_text"], initial_state["ocr_details"] = image_ocr(image, return_details=True)
+
+                    # Text stages first, then play every segment as soon as it is synthesized
+                    final_state = get_compiled_text_graph().invoke(initial_state)
+
+                    st.markdown("#### 🔊 Now playing")
+                    tts_plan = []
+                    audio_segments = []
+                    playing_until = time.monotonic()
+                    with trace_node("voice_generator") as trace:
+                        for i, request, audio in voice_generator_stream(final_state):
+                            # Every clip autoplays once the one before it has ended, the next clips keep synthesizing meanwhile
+                            time.sleep(max(0.0, playing_until - time.monotonic()))
+                            st.caption(f"**{request['speaker']}**: {request['text']}")
+                            st.audio(audio, format="audio/mpeg", autoplay=True)
+                            playing_until = time.monotonic() + mp3_duration(audio)
+                            tts_plan.append(request)
+                            audio_segments.append(audio)
+
+                    final_state["tts_plan"] = tts_plan
+                    final_state["audio_segments"] = audio_segments
+                    final_state["metrics"] = add_stats(final_state.get("metrics"), "voice_generator", trace.stats)
+                    final_state.update(traced_node("mp3_combine", mp3_combine)(final_state))
+
+                    # Store results in session state
+                    st.session_state.final_state_data = final_state
+                    st.session_state.final_audio_path = final_state.get("final_audio_path")
+            else:
+                # Queue the job, the workers run the OCR and the whole workflow
+                image_path = os.path.join(initial_state["job_dir"], "page.png")
+                with open(image_path, "wb") as f:
+                    f.write(uploaded_file.getvalue())
+                job_id = get_job_queue().submit({"image_path": image_path, "initial_state": initial_state},
+                                                job_id=initial_state["job_id"])
+
+                # Remember the job, also in the url so it can be resumed after a reconnect
+                st.session_state.job_id = job_id
+                st.query_params["job"] = job_id
+                st.session_state.final_audio_path = None
+                st.session_state.final_state_data = None
+
+    # Poll the background job
+    if st.session_state.job_id and not st.session_state.final_audio_path:
+        job = get_job_queue().get(st.session_state.job_id)
+        if job is None:
+            st.session_state.job_id = None
+        elif job["status"] == "done":
+            st.session_state.final_state_data = job["result"]
+            st.session_state.final_audio_path = job["result"].get("final_audio_path")
+        elif job["status"] == "failed":
+            st.error(f"The audiobook could not be generated: {job['error']}")
+            if st.button("Retry", width='stretch'):
+                # The job resumes from its last completed step
+                get_job_queue().retry(job["id"])
+                st.rerun()
+        else:
+            steps = ", ".join(job["progress"]) or "waiting for a worker"
+            st.info(f"🚀 The AI agents are at work ({job['status']})... Completed steps: {steps}")
+            time.sleep(2)
+            st.rerun()
 
     if st.session_state.final_audio_path:
         print("final mp3 ready")
@@ -255,6 +334,13 @@ st.info("This is a free version of Audify and hence the generated audio is of li
 
 if st.session_state.final_state_data:
     with st.expander("View Agent Workflow Data"):
-        st.json(st.session_state.final_state_data)
+        # The audio clips are raw bytes, only show the text data
+        st.json({k: v for k, v in st.session_state.final_state_data.items() if k not in ("audio_segments", "metrics")})
+
+        # Time, tokens, characters, cache hits and bytes written by every node
+        st.markdown("**Node metrics of this page**")
+        st.dataframe(st.session_state.final_state_data.get("metrics") or {})
+        st.markdown("**Node metrics of the server** (including the OCR)")
+        st.dataframe(registry.snapshot())
 
 
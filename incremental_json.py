@@ -0,0 +1,72 @@
+# Incremental parser of a streamed JSON array
+import json
+
+
+class IncrementalArrayParser:
+    '''
+    Parses a JSON array of objects while it is being streamed, e.g. token by token from an LLM.
+    Every object of the array is returned as soon as its closing brace arrives. Anything before
+    the opening bracket (like a markdown fence) is ignored.
+
+    Args:
+        loads: Function parsing the text of one object, json.loads by default
+
+    Example:
+        parser = IncrementalArrayParser()
+        for chunk in chunks:
+            for item in parser.feed(chunk):
+                ...
+    '''
+    def __init__(self, loads=json.loads):
+        self.loads = loads
+        self.started = False # the opening [ of the array was seen
+        self.finished = False # the closing ] of the array was seen
+        self.depth = 0 # nesting level inside the array
+        self.in_string = False
+        self.escaped = False
+        self.current = [] # characters of the object being read
+
+    def feed(self, chunk):
+        '''
+        Consumes a chunk of the stream.
+
+        Returns:
+            list: The objects completed by this chunk, in order
+        '''
+        items = []
+        for char in chunk:
+            if self.finished:
+                break
+
+            if not self.started:
+                if char == '[':
+                    self.started = True
+                continue
+
+            if self.depth == 0:
+                # Between two objects of the array
+                if char == '{':
+                    self.depth = 1
+                    self.current = [char]
+                elif char == ']':
+                    self.finished = True
+                continue
+
+            self.current.append(char)
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == '\\':
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char in '{[':
+                self.depth += 1
+            elif char in '}]':
+                self.depth -= 1
+                if self.depth == 0:
+                    items.append(self.loads("".join(self.current)))
+                    self.current = []
+        return items
@@ -0,0 +1,275 @@
+# Background job queue for the LangGraph pipeline
+import os
+import json
+import time
+import uuid
+import sqlite3
+import argparse
+import threading
+from contextlib import contextmanager
+from metrics import METRICS_PORT, start_metrics_server
+from scheduler import INTERACTIVE, priority
+
+
+JOB_DB_PATH = os.environ.get("AUDIFY_JOB_DB", os.path.join(".audify_cache", "jobs.db"))
+JOB_WORKERS = int(os.environ.get("AUDIFY_JOB_WORKERS", 2))
+
+# State keys that are not stored with the job result (raw audio and the voice library)
+RESULT_KEYS_TO_DROP = ('audio_segments', 'voice_list')
+
+
+class JobQueue:
+    '''
+    SQLite backed queue of pipeline jobs. Every job has a status (queued, running, done, failed),
+    the node currently running and the list of nodes already completed, so the UI can poll it
+    and resume it by id after a reconnect. Interactive jobs are claimed before the bulk ones.
+    '''
+    def __init__(self, path=JOB_DB_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as db:
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    node TEXT,
+                    progress TEXT NOT NULL DEFAULT '[]',
+                    payload TEXT NOT NULL,
+                    result TEXT,
+                    error TEXT,
+                    priority INTEGER NOT NULL DEFAULT 0,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            db.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+            db.execute("CREATE INDEX IF NOT EXISTS jobs_priority ON jobs (status, priority, created_at)")
+
+    @contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.row_factory = sqlite3.Row
+        try:
+            yield db
+        finally:
+            db.close()
+
+    def submit(self, payload, job_id=None, priority=INTERACTIVE):
+        '''
+        Adds a job to the queue.
+
+        Args:
+            payload: JSON serializable dict with the initial state (and the page image path)
+            job_id: Optional id, a new one is generated by default
+            priority: scheduler.INTERACTIVE or scheduler.BULK, the lane of the API calls of the job
+
+        Returns:
+            str: The job id
+        '''
+        job_id = job_id or uuid.uuid4().hex
+        now = time.time()
+        with self._connect() as db:
+            db.execute("INSERT INTO jobs (id, status, payload, priority, created_at, updated_at) VALUES (?, 'queued', ?, ?, ?, ?)",
+                       (job_id, json.dumps(payload), priority, now, now))
+        return job_id
+
+    def claim(self):
+        '''
+        Atomically takes the oldest queued job of the highest priority and marks it as running.
+
+        Returns:
+            (job_id, payload, priority) or None when the queue is empty
+        '''
+        with self._connect() as db:
+            try:
+                db.execute("BEGIN IMMEDIATE")
+                row = db.execute("SELECT id, payload, priority FROM jobs WHERE status = 'queued' ORDER BY priority, created_at LIMIT 1").fetchone()
+                if row is None:
+                    db.execute("COMMIT")
+                    return None
+                db.execute("UPDATE jobs SET status = 'running', updated_at = ? WHERE id = ?", (time.time(), row['id']))
+                db.execute("COMMIT")
+                return row['id'], json.loads(row['payload']), row['priority']
+            except Exception:
+                db.execute("ROLLBACK")
+                raise
+
+    def requeue_stale(self, max_age=15 * 60):
+        '''
+        Puts back in the queue the running jobs that made no progress for max_age seconds,
+        e.g. when the process running them was stopped.
+        '''
+        with self._connect() as db:
+            cursor = db.execute("UPDATE jobs SET status = 'queued' WHERE status = 'running' AND updated_at < ?",
+                                (time.time() - max_age,))
+        return cursor.rowcount
+
+    def update_progress(self, job_id, node):
+        '''
+        Records that a node of the job has completed.
+        '''
+        with self._connect() as db:
+            row = db.execute("SELECT progress FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            progress = json.loads(row['progress']) + [node]
+            db.execute("UPDATE jobs SET node = ?, progress = ?, updated_at = ? WHERE id = ?",
+                       (node, json.dumps(progress), time.time(), job_id))
+
+    def retry(self, job_id):
+        '''
+        Puts a failed job back in the queue, it resumes from its last checkpoint.
+        '''
+        with self._connect() as db:
+            db.execute("UPDATE jobs SET status = 'queued', error = NULL, updated_at = ? WHERE id = ? AND status = 'failed'",
+                       (time.time(), job_id))
+
+    def finish(self, job_id, result):
+        with self._connect() as db:
+            db.execute("UPDATE jobs SET status = 'done', result = ?, updated_at = ? WHERE id = ?",
+                       (json.dumps(result, default=str), time.time(), job_id))
+
+    def fail(self, job_id, error):
+        with self._connect() as db:
+            db.execute("UPDATE jobs SET status = 'failed', error = ?, updated_at = ? WHERE id = ?",
+                       (str(error), time.time(), job_id))
+
+    def unfinished_ids(self):
+        '''
+        Returns the ids of the queued and running jobs.
+        '''
+        with self._connect() as db:
+            return {row['id'] for row in db.execute("SELECT id FROM jobs WHERE status IN ('queued', 'running')")}
+
+    def get(self, job_id):
+        '''
+        Returns the job as a dict, or None if the id is unknown.
+        '''
+        with self._connect() as db:
+            row = db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job['progress'] = json.loads(job['progress'])
+        job['payload'] = json.loads(job['payload'])
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        return job
+
+
+# Run one job through the compiled graph
+def run_pipeline_job(job_id, payload, on_node=None):
+    '''
+    Executes the compiled graph for a job, reporting every completed node. The state is checkpointed
+    after every node under the job id, so a retried job resumes from its last completed node, and
+    the voice generator only synthesizes the segments that were not saved by the earlier attempt.
+
+    Args:
+        job_id: The job id
+        payload: dict with the initial_state and optionally the image_path of the page to OCR
+        on_node: Callback called with the name of every completed node
+
+    Returns:
+        dict: The final state, without the raw audio and the voice library
+    '''
+    import cv2
+    from ocr import image_ocr
+    from app import get_compiled_graph
+
+    app = get_compiled_graph(checkpoint=True)
+    config = {"configurable": {"thread_id": job_id}}
+
+    # 1. Resume from the last checkpoint of an earlier attempt
+    snapshot = app.get_state(config)
+    if snapshot.next:
+        print(f"Resuming job {job_id} at {', '.join(snapshot.next)}")
+        state = dict(snapshot.values)
+        graph_input = None
+    else:
+        state = dict(payload['initial_state'])
+
+        # OCR of the page
+        if payload.get('image_path'):
+            state['ocr_text'], state['ocr_details'] = image_ocr(cv2.imread(payload['image_path']), return_details=True)
+            if on_node:
+                on_node("image_ocr")
+        graph_input = state
+
+    # 2. Run the graph node by node
+    for update in app.stream(graph_input, config, stream_mode="updates"):
+        for node, values in update.items():
+            state.update(values or {})
+            if on_node:
+                on_node(node)
+
+    # 3. The checkpoints are not needed once the job is done
+    if hasattr(app.checkpointer, "delete_thread"):
+        app.checkpointer.delete_thread(job_id)
+
+    return {k: v for k, v in state.items() if k not in RESULT_KEYS_TO_DROP}
+
+
+class JobWorkerPool:
+    '''
+    Pool of worker threads executing the queued jobs.
+
+    Args:
+        queue: The JobQueue
+        workers: Number of jobs executed at the same time
+        run_job: Function executing one job, run_pipeline_job by default
+        poll_interval: Seconds to wait when the queue is empty
+    '''
+    def __init__(self, queue, workers=JOB_WORKERS, run_job=run_pipeline_job, poll_interval=0.5):
+        self.queue = queue
+        self.workers = workers
+        self.run_job = run_job
+        self.poll_interval = poll_interval
+        self.stopped = threading.Event()
+        self.threads = []
+
+    def start(self):
+        self.queue.requeue_stale()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"audify-worker-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        for thread in self.threads:
+            thread.join()
+
+    def _work(self):
+        while not self.stopped.is_set():
+            job = self.queue.claim()
+            if job is None:
+                self.stopped.wait(self.poll_interval)
+                continue
+
+            job_id, payload, job_priority = job
+            print(f"Running job {job_id}")
+            try:
+                # The API calls of the job are scheduled in its lane
+                with priority(job_priority):
+                    result = self.run_job(job_id, payload, on_node=lambda node: self.queue.update_progress(job_id, node))
+                self.queue.finish(job_id, result)
+                print(f"Job {job_id} done")
+            except Exception as e:
+                print(f"Job {job_id} failed: {e}")
+                self.queue.fail(job_id, e)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run Audify pipeline workers")
+    parser.add_argument("--workers", type=int, default=JOB_WORKERS)
+    parser.add_argument("--db", default=JOB_DB_PATH)
+    parser.add_argument("--metrics-port", type=int, default=METRICS_PORT, help="Port of the Prometheus endpoint, 0 to disable")
+    args = parser.parse_args()
+
+    start_metrics_server(args.metrics_port)
+    pool = JobWorkerPool(JobQueue(args.db), workers=args.workers).start()
+    print(f"Started {args.workers} workers on {args.db}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pool.stop()
@@ -0,0 +1,94 @@
+# Persistent cache of LLM responses
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from contextlib import contextmanager
+
+
+LLM_CACHE_PATH = os.environ.get("AUDIFY_LLM_CACHE", os.path.join(".audify_cache", "llm.db"))
+LLM_CACHE_MAX_ENTRIES = int(os.environ.get("AUDIFY_LLM_CACHE_MAX_ENTRIES", 5000))
+
+
+class LLMResponseCache:
+    '''
+    SQLite cache of raw LLM responses, keyed by the node, the version of its prompt template,
+    the model and the rendered inputs. The least recently used entries are evicted above
+    `max_entries`, and hits and misses are counted per node.
+    '''
+    def __init__(self, path=LLM_CACHE_PATH, max_entries=LLM_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.stats = {}
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as db:
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    node TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    last_access REAL NOT NULL
+                )
+            """)
+            db.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+
+    @contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            yield db
+        finally:
+            db.close()
+
+    @staticmethod
+    def key(node, template_version, model, inputs):
+        '''
+        Returns the cache key of a rendered prompt.
+        '''
+        payload = json.dumps({
+            "node": node,
+            "template_version": template_version,
+            "model": model,
+            "inputs": inputs,
+        }, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _count(self, node, outcome):
+        with self.lock:
+            node_stats = self.stats.setdefault(node, {"hits": 0, "misses": 0})
+            node_stats[outcome] += 1
+
+    def get(self, key, node):
+        '''
+        Returns the cached response content, or None on a miss.
+        '''
+        with self._connect() as db:
+            row = db.execute("SELECT content FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                db.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+
+        self._count(node, "hits" if row is not None else "misses")
+        return row[0] if row is not None else None
+
+    def delete(self, key):
+        '''
+        Removes a response, e.g. one that turned out not to be parseable.
+        '''
+        with self._connect() as db:
+            db.execute("DELETE FROM responses WHERE key = ?", (key,))
+
+    def put(self, key, node, content):
+        '''
+        Stores a response and evicts the least recently used ones above max_entries.
+        '''
+        with self._connect() as db:
+            db.execute("INSERT OR REPLACE INTO responses (key, node, content, last_access) VALUES (?, ?, ?, ?)",
+                       (key, node, content, time.time()))
+            db.execute("""
+                DELETE FROM responses WHERE key IN (
+                    SELECT key FROM responses ORDER BY last_access DESC LIMIT -1 OFFSET ?
+                )
+            """, (self.max_entries,))
@@ -0,0 +1,137 @@
+# Tolerant parsing of the JSON arrays returned by the LLM
+import re
+import json
+from pydantic import ValidationError
+from incremental_json import IncrementalArrayParser
+
+
+FENCE = re.compile(r"```(?:json)?\s*(.*?)\s*(?:```|$)", re.DOTALL | re.IGNORECASE)
+
+
+def strip_fences(content):
+    '''
+    Returns the JSON value of an LLM response without the markdown fence and the text around it.
+    '''
+    match = FENCE.search(content)
+    if match:
+        content = match.group(1)
+    starts = [i for i in (content.find('['), content.find('{')) if i != -1]
+    if not starts:
+        return content.strip()
+    start = min(starts)
+    end = content.rfind(']' if content[start] == '[' else '}')
+    return content[start:end + 1] if end > start else content[start:]
+
+
+def remove_trailing_commas(text):
+    '''
+    Removes the commas right before a closing bracket or brace, outside of the strings.
+    '''
+    out = []
+    in_string = False
+    escaped = False
+    for char in text:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in ']}':
+            end = len(out) - 1
+            while end >= 0 and out[end].isspace():
+                end -= 1
+            if end >= 0 and out[end] == ',':
+                del out[end]
+        out.append(char)
+    return "".join(out)
+
+
+def loads_lenient(content):
+    '''
+    json.loads, repairing the markdown fences, the text around the JSON value and the trailing
+    commas when the content is not valid JSON.
+
+    Raises:
+        json.JSONDecodeError: The content could not be repaired
+    '''
+    try:
+        return json.loads(content)
+    except json.JSONDecodeError:
+        return json.loads(remove_trailing_commas(strip_fences(content)))
+
+
+def loads_object(text):
+    '''
+    loads_lenient for one object of an array, None when it cannot be repaired.
+    '''
+    try:
+        return loads_lenient(text)
+    except json.JSONDecodeError:
+        return None
+
+
+def recover_objects(content):
+    '''
+    Returns the complete objects of a truncated or malformed JSON array, None for the objects that
+    cannot be repaired.
+    '''
+    return IncrementalArrayParser(loads=loads_object).feed(content)
+
+
+def validate_item(item, model, defaults=None):
+    '''
+    Validates one object of the array against a Pydantic model. The keys are matched to the
+    fields of the model case insensitively, and the missing fields take their value from defaults.
+
+    Returns:
+        dict: The validated object, with the fields of the model only
+
+    Raises:
+        ValidationError, TypeError: The object does not match the model
+    '''
+    if not isinstance(item, dict):
+        raise TypeError(f"expected an object, got {type(item).__name__}")
+    fields = {name.lower(): name for name in model.model_fields}
+    item = {fields.get(str(key).strip().lower(), key): value for key, value in item.items()}
+    return model.model_validate({**(defaults or {}), **item}).model_dump()
+
+
+def parse_array(content, model, defaults=None):
+    '''
+    Parses a JSON array of objects returned by the LLM without ever failing: the response is
+    repaired locally (markdown fences, text around the array, trailing commas, a truncated array)
+    and every object is validated against the model.
+
+    Args:
+        content: The raw response content
+        model: The Pydantic model of the objects
+        defaults: Values of the fields missing from an object
+
+    Returns:
+        items: The valid objects, in order
+        rejected: The objects that do not match the model
+        complete: False when only the start of the array could be recovered
+    '''
+    try:
+        value = loads_lenient(content)
+        complete = True
+        if isinstance(value, dict):
+            # An object wrapping the array, or a single object
+            arrays = [v for v in value.values() if isinstance(v, list)]
+            value = arrays[0] if len(arrays) == 1 else [value]
+        elif not isinstance(value, list):
+            value, complete = [], False
+    except json.JSONDecodeError:
+        value, complete = recover_objects(content), False
+
+    items, rejected = [], []
+    for item in value:
+        try:
+            items.append(validate_item(item, model, defaults))
+        except (ValidationError, TypeError):
+            rejected.append(item)
+    return items, rejected, complete
@@ -0,0 +1,222 @@
+# Instrumentation of the pipeline: per-node timing, token and character accounting
+import os
+import json
+import time
+import logging
+import threading
+import functools
+import contextvars
+from contextlib import contextmanager
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+METRICS_PORT = int(os.environ.get("AUDIFY_METRICS_PORT", 0)) # 0 disables the Prometheus endpoint
+
+# Counters recorded by the nodes, exported as audify_<name>_total
+COUNTERS = (
+    "llm_input_tokens",
+    "llm_output_tokens",
+    "llm_cache_hits",
+    "llm_batch_fallbacks",
+    "llm_json_repairs",
+    "provider_retries",
+    "tts_characters",
+    "clip_cache_hits",
+    "bytes_written",
+)
+
+logger = logging.getLogger("audify.metrics")
+if not logger.handlers:
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+
+class NodeTrace:
+    '''
+    Counters of one call of a node. It is shared by the threads the node starts, so the
+    recording is thread safe.
+    '''
+    def __init__(self, node):
+        self.node = node
+        self.counters = defaultdict(int)
+        self.stats = {}
+        self.lock = threading.Lock()
+
+    def add(self, name, value):
+        with self.lock:
+            self.counters[name] += value
+
+
+_current_trace = contextvars.ContextVar("audify_node_trace", default=None)
+
+
+class MetricsRegistry:
+    '''
+    Process wide totals of every node: calls, wall time and the counters recorded while it ran.
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.nodes = defaultdict(lambda: defaultdict(float))
+
+    def observe(self, node, seconds, counters, failed=False):
+        with self.lock:
+            totals = self.nodes[node]
+            totals["calls"] += 1
+            totals["errors"] += failed
+            totals["seconds"] += seconds
+            for name, value in counters.items():
+                totals[name] += value
+
+    def snapshot(self):
+        with self.lock:
+            return {node: dict(totals) for node, totals in self.nodes.items()}
+
+    def render_prometheus(self):
+        '''
+        Returns the totals in the Prometheus text exposition format.
+        '''
+        nodes = self.snapshot()
+        metrics = [
+            ("node_calls_total", "calls", "Number of calls of the node"),
+            ("node_errors_total", "errors", "Number of calls of the node that raised"),
+            ("node_seconds_total", "seconds", "Wall time spent in the node"),
+        ] + [(f"{name}_total", name, f"{name.replace('_', ' ').capitalize()} recorded by the node") for name in COUNTERS]
+
+        lines = []
+        for metric, key, help_text in metrics:
+            lines.append(f"# HELP audify_{metric} {help_text}")
+            lines.append(f"# TYPE audify_{metric} counter")
+            for node, totals in sorted(nodes.items()):
+                lines.append(f'audify_{metric}{{node="{node}"}} {totals.get(key, 0):g}')
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+def record(name, value=1):
+    '''
+    Adds value to a counter of the node currently running. Values recorded outside of a node
+    are attributed to "unattributed".
+    '''
+    if not value:
+        return
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(name, value)
+    else:
+        registry.observe("unattributed", 0.0, {name: value})
+
+
+def record_llm_usage(message):
+    '''
+    Records the input and output tokens of an LLM response (or of one chunk of a streamed response).
+    '''
+    usage = getattr(message, "usage_metadata", None) or {}
+    record("llm_input_tokens", usage.get("input_tokens", 0))
+    record("llm_output_tokens", usage.get("output_tokens", 0))
+
+
+@contextmanager
+def trace_node(node):
+    '''
+    Records the code run in the block as a call of the node: its wall time and the counters recorded
+    meanwhile go to the registry and to a structured log.
+
+    Yields:
+        NodeTrace: Its stats are available once the block is done
+    '''
+    trace = NodeTrace(node)
+    token = _current_trace.set(trace)
+    start = time.perf_counter()
+    failed = True
+    try:
+        yield trace
+        failed = False
+    finally:
+        seconds = time.perf_counter() - start
+        _current_trace.reset(token)
+        counters = dict(trace.counters)
+        trace.stats = {"calls": 1, "seconds": round(seconds, 4), **counters}
+        registry.observe(node, seconds, counters, failed=failed)
+        logger.info(json.dumps({"event": "node", "node": node, "seconds": round(seconds, 4), "failed": failed, **counters}))
+
+
+def add_stats(metrics, node, stats):
+    '''
+    Returns a copy of the metrics of a job (state['metrics']) with the stats of one more call of a node.
+    '''
+    metrics = dict(metrics or {})
+    previous = metrics.get(node, {})
+    metrics[node] = {k: round(previous.get(k, 0) + v, 4) for k, v in stats.items()}
+    return metrics
+
+
+def traced(node):
+    '''
+    Decorator recording every call of a function as a node, e.g. @traced("image_ocr").
+    '''
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with trace_node(node):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def traced_node(node, fn):
+    '''
+    Wraps a graph node. Besides the registry and the logs, the stats of the node are added to
+    state['metrics'], so they are returned with the rest of the state of the job. Nodes running
+    again (e.g. in a resumed job) add to their earlier stats.
+    '''
+    @functools.wraps(fn)
+    def wrapper(state, *args, **kwargs):
+        with trace_node(node) as trace:
+            update = fn(state, *args, **kwargs)
+        return {**(update or {}), "metrics": add_stats(state.get('metrics'), node, trace.stats)}
+    return wrapper
+
+
+def submit_traced(executor, fn, *args, **kwargs):
+    '''
+    Submits fn to a thread pool so that it records its counters in the node that submitted it.
+    '''
+    return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = registry.render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes are not logged
+        pass
+
+
+def start_metrics_server(port=METRICS_PORT, host="0.0.0.0"):
+    '''
+    Serves the Prometheus text endpoint on http://host:port/metrics from a background thread.
+
+    Returns:
+        The server, or None when the port is 0
+    '''
+    if not port:
+        return None
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="audify-metrics", daemon=True).start()
+    print(f"Serving metrics on http://{host}:{port}/metrics")
+    return server
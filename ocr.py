@@ -0,0 +1,213 @@
+# OCR of the book pages
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import cv2
+import numpy as np
+from metrics import traced
+
+
+#OCR preprocessing settings
+OCR_TARGET_TEXT_HEIGHT = 32 # tesseract reads best when capital letters are ~30px tall
+OCR_MIN_WIDTH = 1500 # used when the text height cannot be estimated
+OCR_MAX_SCALE = 2.0
+OCR_READ_AHEAD = int(os.environ.get("AUDIFY_OCR_READ_AHEAD", 2)) # pages queued per OCR process ahead of the reader
+
+_END = object()
+
+
+# Estimate the height of the text on a page
+def estimate_text_height(gray):
+    '''
+    Estimates the height in pixels of the characters on a page as the median height
+    of the connected components of the binarized page.
+
+    Args:
+        gray: Grayscale image
+
+    Returns:
+        float: Estimated text height, or None if no text like components were found
+    '''
+    _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    _, _, stats, _ = cv2.connectedComponentsWithStats(binary, connectivity=8)
+    heights = stats[1:, cv2.CC_STAT_HEIGHT]
+    widths = stats[1:, cv2.CC_STAT_WIDTH]
+
+    # Ignore specks, lines and pictures
+    max_height = gray.shape[0] / 10
+    mask = (heights >= 4) & (heights <= max_height) & (widths <= heights * 3)
+    if mask.sum() < 20:
+        return None
+    return float(np.median(heights[mask]))
+
+
+# Rotate the page so that the text lines are horizontal
+def deskew_image(gray):
+    '''
+    Returns the deskewed image and the rotation angle in degrees.
+    '''
+    _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    coords = cv2.findNonZero(binary)
+    if coords is None:
+        return gray, 0.0
+
+    # minAreaRect angles are in [-90, 0) or (0, 90] depending on the OpenCV version
+    angle = cv2.minAreaRect(coords)[-1]
+    if angle < -45:
+        angle += 90
+    elif angle > 45:
+        angle -= 90
+    if abs(angle) < 0.5:
+        return gray, 0.0
+
+    height, width = gray.shape[:2]
+    matrix = cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1.0)
+    gray = cv2.warpAffine(gray, matrix, (width, height), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+    return gray, float(angle)
+
+
+# function to preprocess the image before OCR
+def preprocess_for_ocr(image, deskew=False, binarize=False):
+    '''
+    Adaptive preprocessing of a page. The image is only resized when the estimated text height
+    (or the page width when the text height is unknown) is far from what tesseract needs,
+    so high resolution scans are not upscaled for nothing.
+
+    Args:
+        image: The image uploaded by the user
+        deskew: Rotate the page so that the text lines are horizontal
+        binarize: Apply Otsu thresholding after denoising
+
+    Returns:
+        image: The preprocessed image
+        details: The steps applied to the page
+    '''
+    # 1. Convert to grayscale
+    image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    height, width = image.shape[:2]
+    details = {"width": width, "height": height}
+
+    # 2. Deskew
+    if deskew:
+        image, details["deskew_angle"] = deskew_image(image)
+
+    # 3. Resize the image only when needed
+    text_height = estimate_text_height(image)
+    details["text_height"] = text_height
+    if text_height:
+        scale = OCR_TARGET_TEXT_HEIGHT / text_height
+    else:
+        scale = max(OCR_MIN_WIDTH / width, 1.0)
+    scale = min(scale, OCR_MAX_SCALE)
+
+    if scale < 0.8:
+        interpolation = "area"
+        image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    elif scale > 1.25:
+        # Linear is much cheaper than cubic and good enough for small upscales
+        interpolation = "cubic" if scale > 1.6 else "linear"
+        image = cv2.resize(image, None, fx=scale, fy=scale,
+                           interpolation=cv2.INTER_CUBIC if interpolation == "cubic" else cv2.INTER_LINEAR)
+    else:
+        scale = 1.0
+        interpolation = None
+    details["scale"] = round(scale, 3)
+    details["interpolation"] = interpolation
+
+    # 4. Denoising
+    image = cv2.medianBlur(image, 3)
+
+    # 5. Binarization
+    if binarize:
+        _, image = cv2.threshold(image, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    details["binarized"] = binarize
+
+    return image, details
+
+
+# function to preprocess the image and get the OCR text
+@traced("image_ocr")
+def image_ocr(image, deskew=False, binarize=False, return_details=False):
+    '''
+    This function applies a series of preprocessing steps to an image to improve OCR accuracy. 
+    And then runs the pytesseract OCR on the preprocessed image.
+
+    Args:
+        image: The image uploaded by the user
+        deskew: Rotate the page so that the text lines are horizontal
+        binarize: Binarize the page before OCR
+        return_details: Also return the preprocessing steps applied to the page
+
+    Returns:
+        text: OCR text from pytesseract
+        details: The preprocessing steps (only when return_details is True)
+    '''
+    print('Running image OCR using PyTesseract')
+    # 1. Preprocess the page
+    image, details = preprocess_for_ocr(image, deskew=deskew, binarize=binarize)
+
+    # 2. Run OCR, pytesseract is only imported by the processes that need it
+    import pytesseract
+    custom_config = r'--oem 3 --psm 6'  # OCR Engine Mode 3, Page Segmentation Mode 6
+    text = pytesseract.image_to_string(image, config=custom_config)
+
+    #Remove the \n tages from the text
+    text = text.replace('\n', ' ')
+
+    if return_details:
+        return text, details
+    return text
+
+# Initializer of the OCR worker processes
+def _init_ocr_worker():
+    # Each process runs one tesseract at a time, stop tesseract from spawning its own threads on top
+    os.environ["OMP_THREAD_LIMIT"] = "1"
+
+
+# OCR of one page in a worker process, the page is read from disk there when given a path
+def _ocr_page(page, **ocr_options):
+    if isinstance(page, (str, os.PathLike)):
+        image = cv2.imread(os.fspath(page))
+        if image is None:
+            raise ValueError(f"Could not read the page image {page}")
+        page = image
+    return image_ocr(page, **ocr_options)
+
+
+# function to OCR a batch of pages on all the CPU cores
+def image_ocr_batch(images, max_workers=None, read_ahead=OCR_READ_AHEAD, **ocr_options):
+    '''
+    Runs image_ocr on a batch of pages using a process pool sized to the CPU count.
+    Tesseract is CPU bound and single threaded per call, so the pages are spread across processes.
+    Only `read_ahead` pages per process are submitted ahead of the page being read by the caller,
+    so a long book is not loaded into memory (and sent to the pool) all at once.
+
+    Args:
+        images: Iterable of page images or paths of page images, the paths are read by the workers
+        max_workers: Number of processes, defaults to the CPU count
+        read_ahead: Pages submitted per process ahead of the caller
+        ocr_options: Keyword arguments passed to image_ocr (deskew, binarize, return_details)
+
+    Yields:
+        text: OCR text of each page, in page order, as soon as that page (and the ones before it) are done
+    '''
+    print('Running batch OCR using PyTesseract')
+    max_workers = max_workers or os.cpu_count()
+    window = max(1, max_workers * read_ahead)
+    executor = ProcessPoolExecutor(max_workers=max_workers, initializer=_init_ocr_worker)
+    try:
+        pages = iter(images)
+        futures = deque()
+        while True:
+            # 1. Keep the window of pages in flight full
+            while len(futures) < window:
+                page = next(pages, _END)
+                if page is _END:
+                    break
+                futures.append(executor.submit(_ocr_page, page, **ocr_options))
+            if not futures:
+                return
+            # 2. Hand the oldest page to the caller, the next one is submitted when it asks for more
+            yield futures.popleft().result()
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,233 @@
+# Client side scheduler of the calls to Gemini and ElevenLabs: rate limits, retries and priorities
+import os
+import re
+import time
+import random
+import threading
+import contextvars
+from contextlib import contextmanager
+from metrics import record
+
+
+# Priority lanes, a call of a lane waits while calls of a higher priority lane are waiting
+INTERACTIVE = 0 # a user is waiting for the page (Streamlit app)
+BULK = 1 # book mode and background jobs
+LANES = {"interactive": INTERACTIVE, "bulk": BULK}
+
+# Quotas of every provider, 0 for no limit. Gemini quotas are in tokens, roughly 4 characters each.
+PROVIDER_LIMITS = {
+    "gemini": {
+        "requests_per_minute": float(os.environ.get("AUDIFY_GEMINI_RPM", 0)),
+        "characters_per_minute": float(os.environ.get("AUDIFY_GEMINI_CPM", 0)),
+    },
+    "elevenlabs": {
+        "requests_per_minute": float(os.environ.get("AUDIFY_ELEVENLABS_RPM", float(os.environ.get("AUDIFY_ELEVENLABS_RPS", 2)) * 60)),
+        "characters_per_minute": float(os.environ.get("AUDIFY_ELEVENLABS_CPM", 0)),
+    },
+}
+
+# Retries of the transient errors (rate limited, server errors and connection errors)
+RETRY_MAX_ATTEMPTS = int(os.environ.get("AUDIFY_RETRY_MAX_ATTEMPTS", 5))
+RETRY_BASE_DELAY = float(os.environ.get("AUDIFY_RETRY_BASE_DELAY", 1.0)) # seconds, doubled on every attempt
+RETRY_MAX_DELAY = float(os.environ.get("AUDIFY_RETRY_MAX_DELAY", 30.0))
+TRANSIENT_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+TRANSIENT_ERRORS = {"ResourceExhausted", "ServiceUnavailable", "InternalServerError", "DeadlineExceeded",
+                    "TooManyRequests", "ConnectError", "ConnectTimeout", "ReadTimeout", "RemoteProtocolError"}
+TRANSIENT_MESSAGE = re.compile(r"\b(429|500|502|503|504)\b|RESOURCE_EXHAUSTED|UNAVAILABLE|rate limit", re.IGNORECASE)
+
+_lane = contextvars.ContextVar("audify_lane", default=INTERACTIVE)
+_END = object()
+
+
+@contextmanager
+def priority(lane):
+    '''
+    Runs the calls made in the block, and in the threads it submits with submit_traced, in a lane.
+
+    Args:
+        lane: INTERACTIVE, BULK or their name
+    '''
+    token = _lane.set(LANES.get(lane, lane))
+    try:
+        yield
+    finally:
+        _lane.reset(token)
+
+
+def status_code(error):
+    '''
+    Returns the HTTP status of a provider error, or None.
+    '''
+    for candidate in (error, getattr(error, "response", None)):
+        for attribute in ("status_code", "code", "status"):
+            value = getattr(candidate, attribute, None)
+            if isinstance(value, int) and 100 <= value < 600:
+                return value
+    return None
+
+
+def is_transient(error):
+    '''
+    True for the errors worth retrying: rate limits, server errors and connection errors.
+    '''
+    code = status_code(error)
+    if code is not None:
+        return code in TRANSIENT_STATUS_CODES
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    return type(error).__name__ in TRANSIENT_ERRORS or bool(TRANSIENT_MESSAGE.search(str(error)))
+
+
+def retry_delay(attempt, error=None):
+    '''
+    Seconds to wait before the next attempt: the Retry-After header of the response when there is
+    one, otherwise an exponential backoff with jitter, so the workers do not retry all at once.
+    '''
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return min(RETRY_MAX_DELAY, float(headers.get("retry-after") or headers.get("Retry-After")))
+    except (TypeError, ValueError):
+        pass
+    return random.uniform(0.5, 1.0) * min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (attempt - 1))
+
+
+class TokenBucket:
+    '''
+    Allows `per_minute` units per minute, with bursts of up to one second of units. A request larger
+    than the bucket waits for a full bucket and leaves it in debt, so the average rate is kept.
+    '''
+    def __init__(self, per_minute):
+        self.limit = per_minute / 60
+        self.rate = self.limit
+        self.capacity = max(1.0, self.limit)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def delay(self, amount, now):
+        '''
+        Returns the seconds to wait before amount units can be taken.
+        '''
+        if not self.rate:
+            return 0.0
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return max(0.0, (min(amount, self.capacity) - self.tokens) / self.rate)
+
+    def take(self, amount):
+        if self.rate:
+            self.tokens -= amount
+
+    def throttle(self):
+        # Halved on a rate limit error, down to a tenth of the limit
+        self.rate = max(self.limit * 0.1, self.rate * 0.5)
+
+    def recover(self):
+        # Back up by 5% of the limit on every successful call
+        self.rate = min(self.limit, self.rate + self.limit * 0.05)
+
+
+class ProviderScheduler:
+    '''
+    Schedules the calls to one provider. It is thread safe and shared by all the workers of the
+    process, so the provider quota is respected whatever the number of jobs:
+
+    - token buckets limit the requests and the characters sent per minute
+    - transient errors are retried with a jittered exponential backoff, and a rate limit error
+      pauses the whole provider and lowers its request rate until calls succeed again
+    - interactive calls go before the bulk calls waiting for the same provider
+
+    Args:
+        name: Name of the provider, used in the messages
+        requests_per_minute: Request quota, 0 for no limit
+        characters_per_minute: Character quota, 0 for no limit
+    '''
+    def __init__(self, name, requests_per_minute=0, characters_per_minute=0):
+        self.name = name
+        self.requests = TokenBucket(requests_per_minute)
+        self.characters = TokenBucket(characters_per_minute)
+        self.paused_until = 0.0
+        self.waiting = [0] * len(LANES) # calls waiting in every lane
+        self.condition = threading.Condition()
+
+    def acquire(self, characters=0):
+        '''
+        Blocks until a call sending `characters` characters is allowed in the lane of the caller.
+        '''
+        lane = _lane.get()
+        with self.condition:
+            self.waiting[lane] += 1
+            try:
+                while True:
+                    delay = None # wait for the higher priority calls
+                    if not any(self.waiting[:lane]):
+                        now = time.monotonic()
+                        delay = max(self.paused_until - now, self.requests.delay(1, now), self.characters.delay(characters, now))
+                        if delay <= 0:
+                            self.requests.take(1)
+                            self.characters.take(characters)
+                            return
+                    self.condition.wait(delay)
+            finally:
+                self.waiting[lane] -= 1
+                self.condition.notify_all()
+
+    def _failed(self, attempt, error):
+        '''
+        Returns the seconds to wait before retrying a failed call, or raises the error when it is not
+        transient or the last attempt failed.
+        '''
+        if attempt >= RETRY_MAX_ATTEMPTS or not is_transient(error):
+            raise error
+        delay = retry_delay(attempt, error)
+        if status_code(error) == 429 or type(error).__name__ in ("ResourceExhausted", "TooManyRequests"):
+            with self.condition:
+                self.paused_until = max(self.paused_until, time.monotonic() + delay)
+                self.requests.throttle()
+        print(f"{self.name} call failed ({type(error).__name__}: {error}), retry {attempt} in {delay:.1f} s")
+        record("provider_retries")
+        return delay
+
+    def _succeeded(self):
+        with self.condition:
+            self.requests.recover()
+
+    def call(self, fn, *args, characters=0, **kwargs):
+        '''
+        Calls fn(*args, **kwargs) within the quota of the provider, retrying the transient errors.
+        '''
+        attempt = 1
+        while True:
+            self.acquire(characters)
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                time.sleep(self._failed(attempt, e))
+                attempt += 1
+                continue
+            self._succeeded()
+            return result
+
+    def stream(self, fn, *args, characters=0, **kwargs):
+        '''
+        Iterates over fn(*args, **kwargs), e.g. a streamed LLM response, within the quota of the provider.
+        The call is retried until its first item arrives, an error after that is raised.
+        '''
+        attempt = 1
+        while True:
+            self.acquire(characters)
+            try:
+                iterator = iter(fn(*args, **kwargs))
+                first = next(iterator, _END)
+            except Exception as e:
+                time.sleep(self._failed(attempt, e))
+                attempt += 1
+                continue
+            self._succeeded()
+            break
+        if first is not _END:
+            yield first
+            yield from iterator
+
+
+# One scheduler per provider
+schedulers = {name: ProviderScheduler(name, **limits) for name, limits in PROVIDER_LIMITS.items()}
@@ -0,0 +1,14 @@
+import os
+import sys
+import tempfile
+
+# The modules of the app are imported from the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# The tests run in a scratch folder, so the clips and caches they write never land in the repository,
+# with placeholder API keys since app.py reads them from the Streamlit secrets when it is imported
+WORK_DIR = tempfile.mkdtemp(prefix="audify-tests-")
+os.makedirs(os.path.join(WORK_DIR, ".streamlit"))
+with open(os.path.join(WORK_DIR, ".streamlit", "secrets.toml"), "w") as f:
+    f.write('eleven_labs = "test"\ngoogle_gemini = "test"\n')
+os.chdir(WORK_DIR)
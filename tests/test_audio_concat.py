@@ -0,0 +1,15 @@
+from audio_concat import concat_mp3, mp3_duration
+
+
+# One MPEG1 Layer III frame: 128 kbps, 44.1 kHz, mono, 1152 samples
+FRAME = bytes([0xFF, 0xFB, 0x90, 0xC0]) + bytes(413)
+
+
+def test_duration_counts_the_frames():
+    assert abs(mp3_duration(FRAME * 100) - 100 * 1152 / 44100) < 1e-9
+    assert mp3_duration(b"not an mp3") == 0.0
+
+
+def test_combined_duration_is_the_sum_of_the_clips():
+    combined = concat_mp3([FRAME * 10, FRAME * 30])
+    assert abs(mp3_duration(combined) - 40 * 1152 / 44100) < 1e-9
@@ -0,0 +1,71 @@
+from character_registry import CharacterRegistry
+
+
+def test_shared_surname_is_a_new_character():
+    registry = CharacterRegistry({"Elizabeth Bennet": {"Gender": "Female"}})
+    assert registry.merge({"Jane Bennet": {"Gender": "Female"}}) == ["Jane Bennet"]
+    assert registry.aliases("Elizabeth Bennet") == []
+
+
+def test_different_titles_are_different_characters():
+    registry = CharacterRegistry({"Mr. Bennet": {}})
+    assert registry.merge({"Mrs. Bennet": {"Gender": "Female"}}) == ["Mrs. Bennet"]
+    assert registry.characters["Mr. Bennet"] == {}
+    assert registry.resolve("Mrs. Bennet") == "Mrs. Bennet"
+    assert registry.resolve("Mr Bennet") == "Mr. Bennet"
+
+
+def test_name_without_title_matches_when_unambiguous():
+    registry = CharacterRegistry({"Mr. Darcy": {"Gender": "Male"}})
+    assert registry.resolve("Darcy") == "Mr. Darcy"
+    registry.merge({"Mrs. Darcy": {"Gender": "Female"}})
+    assert registry.resolve("Darcy") is None
+
+
+def test_first_name_is_the_only_character_with_it():
+    registry = CharacterRegistry({"Elizabeth Bennet": {"Gender": "Female"}, "Jane Bennet": {"Gender": "Female"}})
+    assert registry.merge({"Elizabeth": {"Gender": "Female"}}) == []
+    assert registry.aliases("Elizabeth Bennet") == ["Elizabeth"]
+    assert registry.resolve("Jane") == "Jane Bennet"
+    assert registry.resolve("Bennet") is None
+
+
+def test_first_name_needs_the_titles_and_the_gender_to_agree():
+    registry = CharacterRegistry({"Elizabeth Bennet": {"Gender": "Female"}, "Mr. William Collins": {"Gender": "Male"}})
+    assert registry.merge({"Elizabeth": {"Gender": "Male"}}) == ["Elizabeth"]
+    assert registry.resolve("Mrs. William") is None
+    assert registry.resolve("Mr. William") == "Mr. William Collins"
+
+    registry = CharacterRegistry({"Elizabeth Bennet": {}, "Elizabeth Darcy": {}})
+    assert registry.resolve("Elizabeth") is None
+
+
+def test_short_form_needs_evidence():
+    registry = CharacterRegistry({"Ali": {"Gender": "Male"}, "Alice": {"Gender": "Female"}})
+    assert registry.resolve("Alicia") is None
+    assert registry.merge({"Alicia": {"Gender": "Female"}}, "Alicia smiled.") == ["Alicia"]
+
+    registry = CharacterRegistry({"Maximilian": {"Gender": "Male"}})
+    assert registry.merge({"Max": {"Gender": "Male"}}, "Max waved.") == ["Max"]
+
+    registry = CharacterRegistry({"Maximilian": {"Gender": "Male"}})
+    assert registry.merge({"Max": {"Gender": "Male"}}, "Maximilian, whom everyone called Max, waved.") == []
+    assert registry.resolve("Max") == "Maximilian"
+
+
+def test_llm_alias_of_merges_and_is_not_stored():
+    registry = CharacterRegistry({"Elizabeth Bennet": {"Gender": "Female"}})
+    assert registry.merge({"Lizzy": {"alias_of": "Elizabeth Bennet", "Age": "20"}}) == []
+    assert registry.resolve("lizzy") == "Elizabeth Bennet"
+    assert registry.characters["Elizabeth Bennet"] == {"Gender": "Female", "Age": "20", "aliases": ["Lizzy"]}
+
+
+def test_different_genders_are_never_merged():
+    registry = CharacterRegistry({"Sam": {"Gender": "Male"}})
+    assert registry.merge({"Sam": {"Gender": "Male"}, "Samantha": {"alias_of": "Sam", "Gender": "Female"}}) == ["Samantha"]
+
+
+def test_digest_lists_mentioned_characters():
+    registry = CharacterRegistry({"Artois": {"Gender": "Male", "Role": "Count"}, "Max": {}})
+    assert registry.digest("Artois read my thoughts.") == "- Artois (Gender: Male)"
+    assert registry.digest("Nobody was there.") == "None"
@@ -0,0 +1,19 @@
+import sys
+import pytest
+import clients
+
+
+def test_secrets_file_is_read_without_streamlit(monkeypatch):
+    # conftest.py writes placeholder keys into .streamlit/secrets.toml of the test folder
+    monkeypatch.delenv("ELEVENLABS_API_KEY", raising=False)
+    monkeypatch.delitem(sys.modules, "streamlit", raising=False)
+    assert clients.get_secret("eleven_labs") == "test"
+
+
+def test_tomli_is_used_before_python_3_11(monkeypatch):
+    tomllib = pytest.importorskip("tomllib")
+    monkeypatch.delenv("ELEVENLABS_API_KEY", raising=False)
+    monkeypatch.delitem(sys.modules, "streamlit", raising=False)
+    monkeypatch.setitem(sys.modules, "tomllib", None)
+    monkeypatch.setitem(sys.modules, "tomli", tomllib)
+    assert clients.get_secret("eleven_labs") == "test"
@@ -0,0 +1,33 @@
+import os
+import time
+from clip_cache import ClipCache, clip_key
+
+
+def age(cache, key, seconds):
+    past = time.time() - seconds
+    os.utime(cache._path(key), (past, past))
+
+
+def test_least_recently_used_clips_are_evicted_past_max_bytes(tmp_path):
+    cache = ClipCache(cache_dir=str(tmp_path), max_bytes=100)
+    cache.put("first", b"1" * 40)
+    cache.put("second", b"2" * 40)
+    age(cache, "first", 200)
+    age(cache, "second", 100)
+
+    # Reading the first clip makes the second one the least recently used
+    assert cache.get("first") == b"1" * 40
+    cache.put("third", b"3" * 40)
+
+    assert cache.get("second") is None
+    assert cache.get("first") == b"1" * 40
+    assert cache.get("third") == b"3" * 40
+    assert cache.total_bytes == 80
+
+
+def test_put_leaves_no_temp_file(tmp_path):
+    cache = ClipCache(cache_dir=str(tmp_path), max_bytes=100)
+    key = clip_key("Hello  world", "voice", "model")
+    cache.put(key, b"clip")
+    assert os.listdir(tmp_path) == [f"{key}.mp3"]
+    assert clip_key("Hello world", "voice", "model") == key
@@ -0,0 +1,66 @@
+import pytest
+
+from dialogue_rules import segment_dialogue, split_quotes, build_aliases
+
+
+CHARACTERS = {"Artois": {"Gender": "Male"}, "Max": {"Gender": "Male"}, "Alice": {"Gender": "Female"}}
+
+
+def test_named_tags_and_narration():
+    segments, confidence = segment_dialogue("Artois read my thoughts. “They are talking of the Polignacs,” Artois said.", CHARACTERS)
+    assert segments == [
+        {"speaker": "Narrator", "text": "Artois read my thoughts."},
+        {"speaker": "Artois", "text": "They are talking of the Polignacs"},
+        {"speaker": "Narrator", "text": "Artois said."},
+    ]
+    assert confidence == 1.0
+
+
+def test_pronoun_resolves_to_the_last_character_of_that_gender():
+    segments, confidence = segment_dialogue("Alice looked at Max. “I am tired,” he said.", CHARACTERS)
+    assert segments[1] == {"speaker": "Max", "text": "I am tired"}
+    assert confidence == 0.9
+
+
+def test_split_dialogue_keeps_the_speaker():
+    segments, _ = segment_dialogue("“My dearest friend,” Max said, “you will have to go away.”", CHARACTERS)
+    assert [segment["speaker"] for segment in segments] == ["Max", "Narrator", "Max"]
+
+
+def test_page_without_dialogue_is_narration():
+    assert segment_dialogue("The rain had not stopped.", CHARACTERS) == ([{"speaker": "Narrator", "text": "The rain had not stopped."}], 1.0)
+
+
+def test_untagged_dialogue_has_low_confidence():
+    segments, confidence = segment_dialogue("“Is anybody there?” The room was silent.", CHARACTERS)
+    assert segments[0]["speaker"] == "Unknown Speaker"
+    assert confidence < 0.8
+
+
+@pytest.mark.parametrize("text", [
+    "‘Who are you?’ said the Caterpillar.",
+    "''Who are you?'' said the Caterpillar.",
+    "'Who are you?' said the Caterpillar.",
+    "«Who are you?» said the Caterpillar.",
+    "„Who are you?“ said the Caterpillar.",
+])
+def test_other_quotation_marks_go_to_the_llm(text):
+    assert segment_dialogue(text, CHARACTERS) == ([], 0.0)
+
+
+def test_apostrophes_are_not_quotes():
+    assert segment_dialogue("It was Max’s hat, don't touch it.", CHARACTERS)[1] == 1.0
+
+
+def test_unbalanced_quotes():
+    assert split_quotes("“Hello, he said.") is None
+
+
+def test_aliases_follow_the_registry_policy():
+    aliases = build_aliases({"Mr. Darcy": {}, "Elizabeth Bennet": {"aliases": ["Lizzy"]}, "Jane Bennet": {}})
+    assert aliases["darcy"] == "Mr. Darcy"
+    assert aliases["lizzy"] == "Elizabeth Bennet"
+    assert aliases["elizabeth"] == "Elizabeth Bennet"
+    assert "bennet" not in aliases
+    # A surname is not a name even when only one character has it
+    assert "bennet" not in build_aliases({"Elizabeth Bennet": {}})
@@ -0,0 +1,77 @@
+import json
+from types import SimpleNamespace
+import pytest
+import app
+from llm_cache import LLMResponseCache
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+
+# Untagged dialogue, the rules are not confident enough and the LLM is asked
+TEXT = "“Is anybody there?” The room was silent."
+SEGMENTS = [{"speaker": "Alice", "text": "Is anybody there?"}, {"speaker": "Narrator", "text": "The room was silent."}]
+
+
+class FakeChain:
+    '''
+    Stand-in for the dialogue splitter chain, answering with the given responses in turn.
+    '''
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.calls = 0
+
+    def invoke(self, inputs):
+        self.calls += 1
+        return AIMessage(content=self.responses.pop(0))
+
+    def stream(self, inputs):
+        self.calls += 1
+        content = self.responses.pop(0)
+        for i in range(0, len(content), 7):
+            yield AIMessageChunk(content=content[i:i + 7])
+
+
+@pytest.fixture
+def llm_cache(tmp_path, monkeypatch):
+    cache = LLMResponseCache(str(tmp_path / "llm.db"))
+    monkeypatch.setattr(app, "get_llm_cache", lambda: cache)
+    return cache
+
+
+def split(chain):
+    state = {"corrected_text": TEXT, "charachter_list": {"Alice": {"Gender": "Female"}}}
+    return json.loads(app.dialogue_splitter(state, chains=SimpleNamespace(dialogue_splitter=chain))["dialogue"])
+
+
+def stream(chain):
+    return list(app.stream_dialogue_segments(TEXT, {"Alice": {"Gender": "Female"}}, chain))
+
+
+def test_unusable_response_is_not_cached(llm_cache):
+    chain = FakeChain("Sorry, I cannot help with that.", json.dumps(SEGMENTS))
+
+    # The rules split the page, and the next attempt asks the LLM again
+    assert split(chain)[1] == {"speaker": "Narrator", "text": "The room was silent."}
+    assert split(chain) == SEGMENTS
+    assert split(chain) == SEGMENTS
+    assert chain.calls == 2
+
+
+def test_streamed_response_is_cached_once_complete(llm_cache):
+    # A response cut short is completed by asking for the rest of the text, but not cached
+    chain = FakeChain(json.dumps(SEGMENTS)[:-10], json.dumps(SEGMENTS[1:]), json.dumps(SEGMENTS))
+
+    assert stream(chain) == SEGMENTS
+    assert chain.calls == 2
+    assert stream(chain) == SEGMENTS
+    assert stream(chain) == SEGMENTS
+    assert chain.calls == 3
+
+
+def test_cached_response_without_segments_is_asked_again(llm_cache):
+    key = llm_cache.key("dialogue_splitter", app.PROMPT_VERSIONS["dialogue_splitter"], app.LLM_MODEL, {"text": TEXT})
+    llm_cache.put(key, "dialogue_splitter", "[]")
+    chain = FakeChain(json.dumps(SEGMENTS))
+
+    assert stream(chain) == SEGMENTS
+    assert chain.calls == 1
+    assert llm_cache.get(key, "dialogue_splitter") == json.dumps(SEGMENTS)
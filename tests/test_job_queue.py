@@ -0,0 +1,101 @@
+import time
+import threading
+import pytest
+import app
+import clients
+import job_queue
+from scheduler import ProviderScheduler
+from benchmarks.run_benchmark import Latency, FakeElevenLabs, make_fake_llm, PAGES, VOICES
+
+
+class FailingTextToSpeech:
+    '''
+    Stand-in for client.text_to_speech recording the requested texts, the request containing
+    `fail_on` fails once, after the other requests had the time to complete.
+    '''
+    def __init__(self, fail_on):
+        self.tts = FakeElevenLabs(Latency(0, 0, 0)).text_to_speech
+        self.fail_on = fail_on
+        self.lock = threading.Lock()
+        self.texts = []
+
+    def convert(self, text, voice_id, model_id, **kwargs):
+        with self.lock:
+            self.texts.append(text)
+        if self.fail_on and self.fail_on in text:
+            self.fail_on = None
+            time.sleep(0.2)
+            raise ValueError("invalid voice settings")
+        return self.tts.convert(text, voice_id, model_id)
+
+    stream = convert
+
+
+class FailingElevenLabs:
+    def __init__(self, fail_on):
+        self.text_to_speech = FailingTextToSpeech(fail_on)
+
+
+class NoClipCache:
+    '''
+    Clip cache that never hits, so only the segment manifest can spare a request.
+    '''
+    def get(self, key):
+        return None
+
+    def put(self, key, audio):
+        pass
+
+
+@pytest.fixture
+def pipeline(tmp_path, monkeypatch):
+    from llm_cache import LLMResponseCache
+
+    llm_cache = LLMResponseCache(str(tmp_path / "llm.db"))
+    monkeypatch.setattr(app, "get_llm_cache", lambda: llm_cache)
+    monkeypatch.setattr(app, "get_clip_cache", lambda: NoClipCache())
+    monkeypatch.setattr(app, "CHECKPOINT_DB_PATH", str(tmp_path / "checkpoints.db"))
+    monkeypatch.setattr(app, "TTS_MAX_WORKERS", 3)
+    monkeypatch.setitem(app.schedulers, "elevenlabs", ProviderScheduler("elevenlabs"))
+    monkeypatch.setitem(app.schedulers, "gemini", ProviderScheduler("gemini"))
+    monkeypatch.setitem(clients._clients, "llm", make_fake_llm(Latency(0, 0, 0)))
+    app.get_checkpointer.cache_clear()
+    app.get_compiled_graph.cache_clear()
+    yield
+    app.get_checkpointer.cache_clear()
+    app.get_compiled_graph.cache_clear()
+
+
+def test_failed_job_resumes_and_only_synthesizes_the_failed_request(pipeline, monkeypatch):
+    state = {
+        **app.create_job_workspace(),
+        "ocr_text": PAGES[0],
+        "default_charachter": VOICES[0]['voice_id'],
+        "voice_list": VOICES,
+        "charachter_list": {},
+        "page_number": [],
+        "speakerXid": {},
+    }
+    payload = {"initial_state": state}
+
+    # 1. The third TTS request fails, the others are saved in the segment manifest
+    client = FailingElevenLabs(fail_on="he said")
+    monkeypatch.setitem(clients._clients, "tts", client)
+    with pytest.raises(ValueError):
+        job_queue.run_pipeline_job("job-1", payload)
+    first_attempt = list(client.text_to_speech.texts)
+    assert len(first_attempt) == app.TTS_MAX_SEGMENTS
+    assert "he said" in first_attempt[2]
+
+    # 2. The retry resumes at the node which failed and only requests the failed clip again
+    graph = app.get_compiled_graph(checkpoint=True)
+    assert graph.get_state({"configurable": {"thread_id": "job-1"}}).next == ("dialogue_splitter",)
+
+    nodes = []
+    client.text_to_speech.texts.clear()
+    result = job_queue.run_pipeline_job("job-1", payload, on_node=nodes.append)
+
+    assert nodes == ["dialogue_splitter", "mp3_combine"]
+    assert client.text_to_speech.texts == [first_attempt[2]]
+    assert len(result["tts_plan"]) == app.TTS_MAX_SEGMENTS
+    assert not graph.get_state({"configurable": {"thread_id": "job-1"}}).next
@@ -0,0 +1,47 @@
+from pydantic import BaseModel
+from llm_json import strip_fences, remove_trailing_commas, loads_lenient, parse_array
+
+
+class Segment(BaseModel):
+    speaker: str
+    text: str
+
+
+def test_fences_and_surrounding_text_are_removed():
+    assert strip_fences('Here it is:\n```json\n[{"a": 1}]\n```\nDone.') == '[{"a": 1}]'
+    assert strip_fences('Sure! {"a": [1, 2]} hope it helps') == '{"a": [1, 2]}'
+
+
+def test_trailing_commas_outside_strings():
+    assert remove_trailing_commas('[{"a": "x,]",}, ]') == '[{"a": "x,]"} ]'
+    assert loads_lenient('```json\n[1, 2,]\n```') == [1, 2]
+
+
+def test_valid_array():
+    items, rejected, complete = parse_array('[{"speaker": "Max", "text": "Hi"}]', Segment)
+    assert items == [{"speaker": "Max", "text": "Hi"}]
+    assert rejected == [] and complete
+
+
+def test_keys_are_matched_case_insensitively_and_defaults_fill_missing_fields():
+    items, _, _ = parse_array('[{"Speaker": "Max", "TEXT": "Hi"}, {"text": "Hello"}]', Segment, {"speaker": "Unknown"})
+    assert items == [{"speaker": "Max", "text": "Hi"}, {"speaker": "Unknown", "text": "Hello"}]
+
+
+def test_invalid_objects_are_rejected_not_fatal():
+    items, rejected, complete = parse_array('[{"speaker": "Max", "text": "Hi"}, {"speaker": "Alice"}, 3]', Segment)
+    assert items == [{"speaker": "Max", "text": "Hi"}]
+    assert rejected == [{"speaker": "Alice"}, 3]
+    assert complete
+
+
+def test_truncated_array_keeps_the_complete_objects():
+    items, _, complete = parse_array('[{"speaker": "Max", "text": "Hi"}, {"speaker": "Alice", "te', Segment)
+    assert items == [{"speaker": "Max", "text": "Hi"}]
+    assert not complete
+
+
+def test_object_wrapping_the_array():
+    items, _, complete = parse_array('{"dialogue": [{"speaker": "Max", "text": "Hi"}]}', Segment)
+    assert items == [{"speaker": "Max", "text": "Hi"}]
+    assert complete
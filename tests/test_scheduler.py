@@ -0,0 +1,120 @@
+import time
+import threading
+import pytest
+import scheduler
+from scheduler import BULK, INTERACTIVE, ProviderScheduler, TokenBucket, is_transient, priority, retry_delay
+
+
+class ProviderError(Exception):
+    '''
+    Stand-in for an API error with an HTTP response.
+    '''
+    def __init__(self, status_code, headers=None):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        self.response = type("Response", (), {"headers": headers or {}})()
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    # The retries record their delays instead of sleeping
+    delays = []
+    monkeypatch.setattr(scheduler.time, "sleep", delays.append)
+    return delays
+
+
+def failing(*errors, result="ok"):
+    errors = list(errors)
+    calls = []
+    def fn():
+        calls.append(1)
+        if errors:
+            raise errors.pop(0)
+        return result
+    return fn, calls
+
+
+def test_oversized_request_leaves_the_bucket_in_debt():
+    bucket = TokenBucket(60) # one unit per second
+    now = bucket.updated
+    assert bucket.delay(5, now) == 0 # waits for a full bucket only
+    bucket.take(5)
+    assert bucket.delay(1, now) == pytest.approx(5.0)
+    assert bucket.delay(1, now + 5) == pytest.approx(0.0)
+
+
+def test_unlimited_bucket_never_waits():
+    bucket = TokenBucket(0)
+    bucket.take(1000)
+    assert bucket.delay(1000, bucket.updated) == 0
+
+
+def test_transient_errors_are_retried(sleeps):
+    fn, calls = failing(ProviderError(503), ConnectionError("reset"))
+    assert ProviderScheduler("test").call(fn) == "ok"
+    assert len(calls) == 3
+    assert len(sleeps) == 2
+
+
+def test_other_errors_are_raised_at_once(sleeps):
+    fn, calls = failing(ProviderError(400), ValueError("bad"))
+    with pytest.raises(ProviderError):
+        ProviderScheduler("test").call(fn)
+    assert len(calls) == 1
+    assert not is_transient(ValueError("bad"))
+
+
+def test_retries_stop_after_the_last_attempt(sleeps, monkeypatch):
+    monkeypatch.setattr(scheduler, "RETRY_MAX_ATTEMPTS", 3)
+    fn, calls = failing(*[ProviderError(500)] * 5)
+    with pytest.raises(ProviderError):
+        ProviderScheduler("test").call(fn)
+    assert len(calls) == 3
+
+
+def test_retry_after_header_sets_the_delay(monkeypatch):
+    monkeypatch.setattr(scheduler, "RETRY_MAX_DELAY", 30.0)
+    assert retry_delay(1, ProviderError(429, {"Retry-After": "7"})) == 7.0
+    assert retry_delay(1, ProviderError(429, {"retry-after": "120"})) == 30.0
+    # Without the header, a jittered exponential backoff
+    monkeypatch.setattr(scheduler, "RETRY_BASE_DELAY", 1.0)
+    assert 2.0 <= retry_delay(3, ProviderError(503)) <= 4.0
+
+
+def test_rate_limit_pauses_and_throttles_the_provider():
+    provider = ProviderScheduler("test", requests_per_minute=60)
+    before = time.monotonic()
+    assert provider._failed(1, ProviderError(429, {"Retry-After": "2"})) == 2.0
+    assert provider.paused_until >= before + 2.0
+    assert provider.requests.rate == pytest.approx(0.5)
+
+    # A server error is retried without pausing the provider
+    provider = ProviderScheduler("test", requests_per_minute=60)
+    provider._failed(1, ProviderError(503))
+    assert provider.paused_until == 0.0
+    assert provider.requests.rate == pytest.approx(1.0)
+
+    # The rate comes back by 5% of the limit on every successful call
+    provider.requests.throttle()
+    provider._succeeded()
+    assert provider.requests.rate == pytest.approx(0.55)
+
+
+def test_interactive_calls_go_before_waiting_bulk_calls():
+    provider = ProviderScheduler("test", requests_per_minute=600) # one request every 0.1 s
+    provider.requests.tokens = 0
+    order = []
+
+    def acquire(lane):
+        with priority(lane):
+            provider.acquire()
+        order.append(lane)
+
+    bulk = threading.Thread(target=acquire, args=(BULK,))
+    bulk.start()
+    time.sleep(0.02) # the bulk call is waiting first
+    interactive = threading.Thread(target=acquire, args=(INTERACTIVE,))
+    interactive.start()
+    bulk.join()
+    interactive.join()
+    assert order == [INTERACTIVE, BULK]
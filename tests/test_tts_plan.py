@@ -0,0 +1,56 @@
+from tts_plan import split_text, join_text, plan_tts_requests
+
+
+VOICES = {"Narrator": "narrator", "Max": "max", "Alice": "alice", "Guard": "max"}
+
+
+def plan(segments, max_chars=800):
+    return list(plan_tts_requests(segments, VOICES.get, max_chars))
+
+
+def test_short_text_is_not_split():
+    assert split_text("Hello there.", 20) == ["Hello there."]
+
+
+def test_long_text_is_split_at_sentence_boundaries():
+    parts = split_text("One two three. Four five six. Seven eight.", 30)
+    assert parts == ["One two three. Four five six.", "Seven eight."]
+    assert all(len(part) <= 30 for part in parts)
+
+
+def test_long_sentence_is_split_between_words():
+    parts = split_text("word " * 20, 22)
+    assert all(len(part) <= 22 for part in parts)
+    assert " ".join(parts).split() == ["word"] * 20
+
+
+def test_join_punctuates_the_first_text():
+    assert join_text("He left", "She stayed.") == "He left. She stayed."
+    assert join_text("He left,", "she said.") == "He left, she said."
+
+
+def test_adjacent_segments_of_the_same_voice_are_merged():
+    requests = plan([
+        {"speaker": "Narrator", "text": "It was late"},
+        {"speaker": "Narrator", "text": "The fire was out."},
+        {"speaker": "Max", "text": "Hello."},
+        {"speaker": "Guard", "text": "Halt!"},
+        {"speaker": "Alice", "text": "Hi."},
+    ])
+    assert [(r['voice'], r['text'], r['segments']) for r in requests] == [
+        ("narrator", "It was late. The fire was out.", [0, 1]),
+        ("max", "Hello. Halt!", [2, 3]),
+        ("alice", "Hi.", [4]),
+    ]
+    assert requests[1]['speaker'] == "Max / Guard"
+
+
+def test_merge_stops_at_max_chars():
+    requests = plan([{"speaker": "Max", "text": "a" * 10}, {"speaker": "Max", "text": "b" * 10}], max_chars=15)
+    assert [r['segments'] for r in requests] == [[0], [1]]
+
+
+def test_long_segment_gives_several_requests_of_the_same_segment():
+    requests = plan([{"speaker": "Max", "text": "One two three. Four five six."}], max_chars=15)
+    assert [r['text'] for r in requests] == ["One two three.", "Four five six."]
+    assert all(r['segments'] == [0] for r in requests)
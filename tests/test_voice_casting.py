@@ -0,0 +1,34 @@
+from voice_casting import VoiceCastingIndex
+
+
+VOICES = [
+    {"voice_id": "narrator", "name": "Narrator", "labels": {"gender": "male", "age": "middle_aged", "use_case": "narration"}, "description": "calm narrator"},
+    {"voice_id": "young-male", "name": "Young Male", "labels": {"gender": "male", "age": "young"}, "description": "bright"},
+    {"voice_id": "old-male", "name": "Old Male", "labels": {"gender": "male", "age": "old"}, "description": "deep"},
+    {"voice_id": "young-female", "name": "Young Female", "labels": {"gender": "female", "age": "young"}, "description": "soft"},
+    {"voice_id": "old-female", "name": "Old Female", "labels": {"gender": "female", "age": "old"}, "description": "warm"},
+]
+
+
+def test_clear_match_is_cast_locally():
+    index = VoiceCastingIndex(VOICES)
+    assert index.cast("Alice", {"Gender": "Female", "Age": "Young"}) == "young-female"
+
+
+def test_narrator_voice_is_never_cast():
+    index = VoiceCastingIndex(VOICES)
+    voice_id = index.cast("Artois", {"Gender": "Male", "Age": "Middle aged"}, {"young-male", "old-male"}, {"narrator"})
+    assert voice_id != "narrator"
+    assert all(voice['voice_id'] != "narrator" for _, voice in index.rank("Artois", {"Gender": "Male"}, (), {"narrator"}))
+
+
+def test_gender_only_match_is_ambiguous():
+    index = VoiceCastingIndex(VOICES)
+    # Both male voices score the gender match only, the choice is left to the LLM instead of the voice name
+    assert index.cast("Guard", {"Gender": "Male"}, (), {"narrator"}) is None
+
+
+def test_close_runner_up_is_ambiguous():
+    index = VoiceCastingIndex(VOICES)
+    # A middle aged man is as near to the young voice as to the old one
+    assert index.cast("Artois", {"Gender": "Male", "Age": "Middle aged"}, (), {"narrator"}) is None
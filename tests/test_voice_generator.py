@@ -0,0 +1,53 @@
+import os
+import json
+import time
+import threading
+import app
+from scheduler import ProviderScheduler
+
+
+class FakeTextToSpeech:
+    '''
+    Stand-in for client.text_to_speech: the first segments take the longest, and the clip is the text.
+    '''
+    def __init__(self, delays):
+        self.delays = delays
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def convert(self, text, voice_id, model_id, **kwargs):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(self.delays[text])
+        with self.lock:
+            self.in_flight -= 1
+        return iter([voice_id.encode(), b":", text.encode()])
+
+
+class FakeElevenLabs:
+    def __init__(self, delays):
+        self.text_to_speech = FakeTextToSpeech(delays)
+
+
+def test_segments_are_synthesized_concurrently_and_saved_in_order(monkeypatch):
+    monkeypatch.setitem(app.schedulers, "elevenlabs", ProviderScheduler("elevenlabs"))
+
+    speakers = ["Narrator", "Max", "Alice", "Max"]
+    client = FakeElevenLabs({"Line 0.": 0.3, "Line 1.": 0.2, "Line 2.": 0.1, "Line 3.": 0.0})
+    state = {
+        "dialogue": json.dumps([{"speaker": speaker, "text": f"Line {i}"} for i, speaker in enumerate(speakers)]),
+        "speakerXid": {"Max": "max-voice", "Alice": "alice-voice"},
+        "charachter_list": {"Max": {}, "Alice": {}},
+        "default_charachter": "narrator-voice",
+    }
+
+    output_path = app.voice_generator(state, max_workers=4, tts_client=client)["output_path"]
+
+    clips = []
+    for i in range(1, 5):
+        with open(os.path.join(output_path, f"part_test{i}.mp3"), "rb") as f:
+            clips.append(f.read())
+    assert clips == [b"narrator-voice:Line 0.", b"max-voice:Line 1.", b"alice-voice:Line 2.", b"max-voice:Line 3."]
+    assert client.text_to_speech.max_in_flight > 1
@@ -0,0 +1,58 @@
+import json
+from types import SimpleNamespace
+import app
+from llm_cache import LLMResponseCache
+from langchain_core.messages import AIMessage
+
+
+VOICES = [
+    {"voice_id": "narrator", "name": "Narrator", "labels": {"gender": "male", "age": "middle_aged", "use_case": "narration"}},
+    {"voice_id": "young-male", "name": "Young Male", "labels": {"gender": "male", "age": "young"}},
+    {"voice_id": "old-male", "name": "Old Male", "labels": {"gender": "male", "age": "old"}},
+    {"voice_id": "young-female", "name": "Young Female", "labels": {"gender": "female", "age": "young"}},
+]
+
+
+class FakeChain:
+    '''
+    Stand-in for the voice selector chain: gives every character the same voice.
+    '''
+    def __init__(self, voice_id):
+        self.voice_id = voice_id
+        self.calls = []
+
+    def invoke(self, inputs):
+        self.calls.append(inputs)
+        return AIMessage(content=json.dumps([{"name": name, "assigned_voice_id": self.voice_id}
+                                             for name in inputs["character_list"]]))
+
+
+def select(chain, narrator):
+    # Two male voices score the same for a guard, so the choice goes to the LLM
+    state = {
+        "charachter_list": {"Guard": {"Gender": "Male"}},
+        "voice_list": VOICES,
+        "default_charachter": narrator,
+        "speakerXid": {},
+    }
+    return app.voice_selector(state, chains=SimpleNamespace(voice_selector=chain))["speakerXid"]
+
+
+def test_narrator_pick_is_rejected(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, "get_llm_cache", lambda: LLMResponseCache(str(tmp_path / "llm.db")))
+    chain = FakeChain("narrator")
+
+    speakerXid = select(chain, "narrator")
+
+    # Asked again once, then cast locally rather than read by the narrator
+    assert len(chain.calls) == 2
+    assert speakerXid["Guard"] in ("young-male", "old-male")
+
+
+def test_changing_the_narrator_keeps_the_cached_cast(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, "get_llm_cache", lambda: LLMResponseCache(str(tmp_path / "llm.db")))
+    chain = FakeChain("old-male")
+
+    assert select(chain, "narrator") == {"Guard": "old-male"}
+    assert select(chain, "young-female") == {"Guard": "old-male"}
+    assert len(chain.calls) == 1
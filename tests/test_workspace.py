@@ -0,0 +1,34 @@
+import os
+import time
+from job_queue import JobQueue
+from workspace import create_job_workspace, cleanup_workspaces
+
+
+def age(path, seconds):
+    past = time.time() - seconds
+    os.utime(path, (past, past))
+
+
+def test_expired_workspaces_are_removed(tmp_path):
+    job_dir = create_job_workspace("old", root=tmp_path)["job_dir"]
+    create_job_workspace("new", root=tmp_path)
+    age(job_dir, 7200)
+    assert cleanup_workspaces(max_age=3600, root=tmp_path, keep=()) == 1
+    assert sorted(os.listdir(tmp_path)) == ["new"]
+
+
+def test_unfinished_jobs_keep_their_workspace(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.db"))
+    root = tmp_path / "jobs"
+    for job_id in ("running", "done", "queued"):
+        create_job_workspace(job_id, root=root)
+        queue.submit({}, job_id=job_id)
+    for job_id in os.listdir(root):
+        age(root / job_id, 7200)
+    assert queue.claim()[0] == "running"
+    assert queue.claim()[0] == "done"
+    queue.finish("done", {})
+
+    assert queue.unfinished_ids() == {"running", "queued"}
+    assert cleanup_workspaces(max_age=3600, root=root, keep=queue.unfinished_ids()) == 1
+    assert sorted(os.listdir(root)) == ["queued", "running"]
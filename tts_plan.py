@@ -0,0 +1,84 @@
+# Planning of the TTS requests of a page
+import os
+import re
+
+
+TTS_MAX_REQUEST_CHARS = int(os.environ.get("AUDIFY_TTS_MAX_REQUEST_CHARS", 800))
+
+SENTENCE_END = re.compile(r"(?<=[.!?…])[\"”’']?\s+")
+
+
+def split_text(text, max_chars=TTS_MAX_REQUEST_CHARS):
+    '''
+    Splits a text longer than max_chars at sentence boundaries. A single sentence longer than
+    max_chars is split between two words.
+
+    Returns:
+        list: The parts of the text, in order
+    '''
+    if len(text) <= max_chars:
+        return [text]
+
+    parts = []
+    current = ""
+    for sentence in SENTENCE_END.split(text):
+        words = [sentence] if len(sentence) <= max_chars else sentence.split()
+        for piece in words:
+            if current and len(current) + 1 + len(piece) > max_chars:
+                parts.append(current)
+                current = piece
+            else:
+                current = f"{current} {piece}" if current else piece
+    if current:
+        parts.append(current)
+    return parts
+
+
+def join_text(first, second):
+    '''
+    Joins the texts of two segments read by the same voice. The end of the first one is
+    punctuated, the same way every segment is punctuated when it is synthesized alone.
+    '''
+    first = first.rstrip()
+    if first and first[-1] not in ".!?…,;:—-\"”’'":
+        first = f"{first}."
+    return f"{first} {second.lstrip()}"
+
+
+def plan_tts_requests(segments, voice_of, max_chars=TTS_MAX_REQUEST_CHARS):
+    '''
+    Groups the dialogue segments into TTS requests. Adjacent segments read by the same voice are
+    merged into a single request up to max_chars, and longer segments are split at sentence
+    boundaries, so a page needs fewer, larger requests and fewer clips to concatenate.
+    Requests are yielded as soon as they are complete, so the segments can be streamed in.
+
+    Args:
+        segments: Iterable of {speaker, text} segments
+        voice_of: Function returning the voice id of a speaker
+        max_chars: Maximum length of the text of a request
+
+    Yields:
+        dict: speaker, voice, text and segments (the indices of the original segments in the request)
+    '''
+    request = None
+    for i, segment in enumerate(segments):
+        voice = voice_of(segment['speaker'])
+        parts = split_text(segment['text'], max_chars)
+
+        # Merge into the previous request when it is read by the same voice and there is room left
+        if (request is not None and len(parts) == 1 and request['voice'] == voice
+                and len(request['text']) + 2 + len(parts[0]) <= max_chars):
+            request['text'] = join_text(request['text'], parts[0])
+            request['segments'].append(i)
+            if segment['speaker'] not in request['speaker'].split(" / "):
+                request['speaker'] = f"{request['speaker']} / {segment['speaker']}"
+            continue
+
+        if request is not None:
+            yield request
+        for part in parts[:-1]:
+            yield {"speaker": segment['speaker'], "voice": voice, "text": part, "segments": [i]}
+        request = {"speaker": segment['speaker'], "voice": voice, "text": parts[-1], "segments": [i]}
+
+    if request is not None:
+        yield request
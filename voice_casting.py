@@ -0,0 +1,182 @@
+# Local voice casting engine
+import re
+
+
+# Words used to read the gender and the age of a character or a voice
+GENDER_WORDS = {
+    "male": "male", "man": "male", "boy": "male", "masculine": "male", "he": "male",
+    "female": "female", "woman": "female", "girl": "female", "feminine": "female", "lady": "female", "she": "female",
+    "neutral": "neutral", "non-binary": "neutral",
+}
+AGE_WORDS = {
+    "child": "young", "kid": "young", "teen": "young", "teenager": "young", "young": "young", "youthful": "young", "boy": "young", "girl": "young",
+    "middle": "middle_aged", "middle-aged": "middle_aged", "middle_aged": "middle_aged", "adult": "middle_aged",
+    "old": "old", "elderly": "old", "aged": "old", "senior": "old", "ancient": "old",
+}
+AGE_ORDER = ["young", "middle_aged", "old"]
+
+# Words that carry no casting information
+STOP_WORDS = {"a", "an", "and", "the", "of", "with", "for", "to", "in", "is", "voice", "very", "has", "his", "her", "who"}
+
+# Scoring weights
+GENDER_MATCH = 2.0
+AGE_MATCH = 2.0
+AGE_NEAR = 0.5
+TOKEN_MATCH = 1.0
+MAX_TOKEN_SCORE = 3.0
+NARRATION_MATCH = 1.0
+ALREADY_CAST = -1.0
+
+# A cast is ambiguous when even the best voice matches nothing we know about the character,
+# or when the runner-up scores almost as well (e.g. two voices that only match the gender)
+MIN_SCORE = 1.0
+MIN_MARGIN = 1.0
+
+
+def tokenize(value):
+    '''
+    Splits any label, description or property value into lower case words.
+    '''
+    if value is None:
+        return []
+    if isinstance(value, dict):
+        return [token for v in value.values() for token in tokenize(v)]
+    if isinstance(value, (list, tuple)):
+        return [token for v in value for token in tokenize(v)]
+    return [t for t in re.findall(r"[a-z][a-z\-]*", str(value).lower()) if t not in STOP_WORDS]
+
+
+def read_age(value):
+    '''
+    Maps an age description ("young", "middle aged", "45", ...) to young, middle_aged or old.
+    '''
+    if value is None:
+        return None
+    text = str(value).lower()
+    number = re.search(r'\d+', text)
+    if number:
+        years = int(number.group())
+        return "young" if years < 30 else "middle_aged" if years < 55 else "old"
+    if "middle" in text:
+        return "middle_aged"
+    for token in tokenize(text):
+        if token in AGE_WORDS:
+            return AGE_WORDS[token]
+    return None
+
+
+def read_gender(value):
+    '''
+    Maps a gender description to male, female or neutral.
+    '''
+    for token in tokenize(value):
+        if token in GENDER_WORDS:
+            return GENDER_WORDS[token]
+    return None
+
+
+def get_property(properties, name):
+    '''
+    Case insensitive lookup of a character property.
+    '''
+    for key, value in properties.items():
+        if key.lower() == name:
+            return value
+    return None
+
+
+class VoiceCastingIndex:
+    '''
+    Index of the voice library by gender, age, accent, use case and description words.
+    Characters are scored against the index locally, and only the ambiguous ones need the LLM.
+    '''
+    def __init__(self, voice_list):
+        self.voices = []
+        self.by_gender = {}
+        for voice in voice_list:
+            labels = voice.get('labels') or {}
+            entry = {
+                "voice_id": voice['voice_id'],
+                "name": voice.get('name', ''),
+                "gender": read_gender(labels.get('gender')),
+                "age": read_age(labels.get('age')),
+                "use_case": " ".join(tokenize(labels.get('use case') or labels.get('use_case'))),
+                "tokens": set(tokenize(labels)) | set(tokenize(voice.get('description'))),
+            }
+            self.voices.append(entry)
+            self.by_gender.setdefault(entry['gender'], []).append(entry)
+
+    def candidates(self, gender):
+        '''
+        Hard filter on the gender, voices without a gender label are always kept.
+        '''
+        if gender is None:
+            return self.voices
+        return self.by_gender.get(gender, []) + self.by_gender.get(None, [])
+
+    def score(self, voice, gender, age, tokens, is_narrator, used_voice_ids):
+        score = GENDER_MATCH if gender and voice['gender'] == gender else 0.0
+        if age and voice['age']:
+            distance = abs(AGE_ORDER.index(age) - AGE_ORDER.index(voice['age']))
+            score += AGE_MATCH if distance == 0 else AGE_NEAR if distance == 1 else 0
+        score += min(len(tokens & voice['tokens']) * TOKEN_MATCH, MAX_TOKEN_SCORE)
+        if is_narrator and "narration" in voice['use_case']:
+            score += NARRATION_MATCH
+        if voice['voice_id'] in used_voice_ids:
+            score += ALREADY_CAST
+        return score
+
+    def rank(self, name, properties, used_voice_ids=(), excluded_voice_ids=()):
+        '''
+        Scores every candidate voice for a character.
+
+        Args:
+            name: The character name
+            properties: The character properties from charachter_list (Gender, Age, Characteristics ...)
+            used_voice_ids: Voices already given to other characters, they are ranked lower
+            excluded_voice_ids: Voices that are never given to a character, e.g. the narrator voice
+
+        Returns:
+            list: (score, voice) pairs, best first
+        '''
+        properties = properties if isinstance(properties, dict) else {"description": properties}
+        gender = read_gender(get_property(properties, 'gender'))
+        age = read_age(get_property(properties, 'age'))
+        tokens = set(tokenize(properties)) - set(GENDER_WORDS) - set(AGE_WORDS)
+        is_narrator = name.lower() == "narrator" or "narrat" in " ".join(tokens)
+
+        ranked = [(self.score(voice, gender, age, tokens, is_narrator, used_voice_ids), voice)
+                  for voice in self.candidates(gender) if voice['voice_id'] not in excluded_voice_ids]
+        # Sort by score, and by name so that the ranking is stable (cast sends the ties to the LLM)
+        ranked.sort(key=lambda item: (-item[0], item[1]['name']))
+        return ranked
+
+    def cast(self, name, properties, used_voice_ids=(), excluded_voice_ids=()):
+        '''
+        Returns the best voice id for a character, or None when the choice is ambiguous: the best
+        voice scores less than MIN_SCORE, or less than MIN_MARGIN above the runner-up.
+        '''
+        ranked = self.rank(name, properties, used_voice_ids, excluded_voice_ids)
+        if not ranked:
+            return None
+        best_score, best_voice = ranked[0]
+        if best_score < MIN_SCORE:
+            return None
+        if len(ranked) > 1 and best_score - ranked[1][0] < MIN_MARGIN:
+            return None
+        return best_voice['voice_id']
+
+
+# Index cache, the voice library rarely changes between pages
+_index_cache = {}
+
+
+def get_casting_index(voice_list):
+    '''
+    Returns the casting index of a voice library, built once per library.
+    '''
+    key = tuple(voice['voice_id'] for voice in voice_list)
+    if key not in _index_cache:
+        _index_cache.clear()
+        _index_cache[key] = VoiceCastingIndex(voice_list)
+    return _index_cache[key]
@@ -0,0 +1,109 @@
+# Voice catalog with an on-disk snapshot and a TTL
+import os
+import json
+import time
+import threading
+
+
+VOICE_SNAPSHOT_PATH = os.environ.get("AUDIFY_VOICE_SNAPSHOT", os.path.join(".audify_cache", "voices.json"))
+VOICE_CATALOG_TTL = int(os.environ.get("AUDIFY_VOICE_CATALOG_TTL", 6 * 60 * 60)) # seconds
+
+
+class VoiceCatalog:
+    '''
+    Keeps the voice library in memory, indexed by name and voice_id, and persisted to a snapshot file.
+    A stale catalog is still served while it is refreshed in a background thread, so only the very
+    first start without a snapshot waits for the voice API.
+
+    Args:
+        fetch: Function returning the list of voice dicts (get_voices)
+        snapshot_path: Path of the json snapshot
+        ttl: Age in seconds after which the catalog is refreshed
+    '''
+    def __init__(self, fetch, snapshot_path=VOICE_SNAPSHOT_PATH, ttl=VOICE_CATALOG_TTL):
+        self.fetch = fetch
+        self.snapshot_path = snapshot_path
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.refreshing = False
+        self.fetched_at = 0.0
+        self._set_voices([])
+        self._load_snapshot()
+
+    def _set_voices(self, voice_list):
+        self.voice_list = voice_list
+        self.by_name = {voice['name']: voice for voice in voice_list}
+        self.by_id = {voice['voice_id']: voice for voice in voice_list}
+
+    def _load_snapshot(self):
+        try:
+            with open(self.snapshot_path) as f:
+                snapshot = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return
+        self._set_voices(snapshot['voices'])
+        self.fetched_at = snapshot['fetched_at']
+        print(f"Loaded {len(self.voice_list)} voices from the snapshot")
+
+    def _save_snapshot(self):
+        os.makedirs(os.path.dirname(self.snapshot_path) or ".", exist_ok=True)
+        tmp_path = f"{self.snapshot_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"fetched_at": self.fetched_at, "voices": self.voice_list}, f)
+        os.replace(tmp_path, self.snapshot_path)
+
+    def refresh(self):
+        '''
+        Fetches the voices from the API, rebuilds the indexes and writes the snapshot.
+        '''
+        try:
+            voice_list = self.fetch()
+            with self.lock:
+                self._set_voices(voice_list)
+                self.fetched_at = time.time()
+                self._save_snapshot()
+        finally:
+            self.refreshing = False
+
+    def is_stale(self):
+        return time.time() - self.fetched_at > self.ttl
+
+    def _refresh_in_background(self):
+        with self.lock:
+            if self.refreshing:
+                return
+            self.refreshing = True
+
+        def run():
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Voice catalog refresh failed, serving the snapshot: {e}")
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def voices(self):
+        '''
+        Returns the list of voice dicts, refreshing them if needed.
+        '''
+        if not self.voice_list:
+            # Nothing to serve yet, the first fetch has to be synchronous
+            self.refreshing = True
+            self.refresh()
+        elif self.is_stale():
+            self._refresh_in_background()
+        return self.voice_list
+
+    def get_voice_id(self, name):
+        '''
+        Returns the voice_id of a voice name, or None.
+        '''
+        self.voices()
+        voice = self.by_name.get(name)
+        return voice['voice_id'] if voice else None
+
+    def get_voice(self, voice_id):
+        '''
+        Returns the voice dict of a voice_id, or None.
+        '''
+        return self.by_id.get(voice_id)
@@ -0,0 +1,99 @@
+# Per-job workspaces
+import os
+import time
+import uuid
+import shutil
+
+
+WORKSPACE_ROOT = os.environ.get("AUDIFY_WORKSPACE_ROOT", ".audify_jobs")
+WORKSPACE_TTL = int(os.environ.get("AUDIFY_WORKSPACE_TTL", 60 * 60)) # seconds a finished job is kept
+
+
+def create_job_workspace(job_id=None, root=WORKSPACE_ROOT):
+    '''
+    Creates a unique folder for a job, so concurrent jobs never share their clips or output files.
+    Workspaces of old jobs are garbage collected at the same time.
+
+    Args:
+        job_id: Optional id of the job, a new one is generated by default
+        root: Folder holding all the workspaces
+
+    Returns:
+        dict: job_id, job_dir, output_path and final_audio_path, ready to be merged into the state
+    '''
+    cleanup_workspaces(root=root)
+
+    job_id = job_id or uuid.uuid4().hex
+    job_dir = os.path.join(root, job_id)
+    output_path = os.path.join(job_dir, "audio_clips")
+    os.makedirs(output_path, exist_ok=True)
+
+    return {
+        "job_id": job_id,
+        "job_dir": job_dir,
+        "output_path": output_path,
+        "final_audio_path": os.path.join(job_dir, "final_audiobook.mp3"),
+    }
+
+
+def unfinished_job_ids():
+    '''
+    Returns the ids of the queued and running jobs of the job queue, their workspaces are in use.
+    '''
+    from job_queue import JOB_DB_PATH, JobQueue
+    if not os.path.exists(JOB_DB_PATH):
+        return set()
+    return JobQueue(JOB_DB_PATH).unfinished_ids()
+
+
+def cleanup_workspaces(max_age=WORKSPACE_TTL, root=WORKSPACE_ROOT, keep=None):
+    '''
+    Removes the workspaces that have not been modified for more than max_age seconds. The workspace
+    of a job still queued or running is kept however long it waits.
+
+    Args:
+        max_age: Seconds since the last modification of a workspace
+        root: Folder holding all the workspaces
+        keep: Job ids whose workspaces are kept, defaults to the unfinished jobs of the job queue
+
+    Returns:
+        int: The number of workspaces removed
+    '''
+    if not os.path.isdir(root):
+        return 0
+
+    # 1. Workspaces old enough to be removed
+    now = time.time()
+    expired = []
+    for name in os.listdir(root):
+        try:
+            if now - os.path.getmtime(os.path.join(root, name)) > max_age:
+                expired.append(name)
+        except OSError:
+            # Removed by another session in the meantime
+            continue
+    if not expired:
+        return 0
+
+    # 2. Remove them, unless their job is not finished
+    keep = unfinished_job_ids() if keep is None else set(keep)
+    removed = 0
+    for name in expired:
+        if name in keep:
+            continue
+        try:
+            shutil.rmtree(os.path.join(root, name))
+            removed += 1
+        except OSError:
+            continue
+
+    if removed:
+        print(f"Removed {removed} finished job workspaces")
+    return removed
+
+
+def remove_workspace(job_dir):
+    '''
+    Removes the workspace of a job once its output is no longer needed.
+    '''
+    shutil.rmtree(job_dir, ignore_errors=True)